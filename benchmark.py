@@ -0,0 +1,243 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import time
+
+import gatorLibrary
+from gatorLibrary import (
+    BOOK_INDEXES,
+    COMMAND_NAMES,
+    LibrarySystem,
+    compileCommand,
+    executeCommand,
+)
+
+# Share of each workload's measured commands taken by each command type
+WORKLOAD_MIXES = {
+    "insert": {"InsertBook": 0.9, "PrintBook": 0.05, "FindClosestBook": 0.05},
+    "churn": {"BorrowBook": 0.45, "ReturnBook": 0.45, "PrintBook": 0.1},
+    "delete": {"DeleteBook": 0.5, "InsertBook": 0.4, "ColorFlipCount": 0.1},
+    "range": {"PrintBooks": 0.7, "InsertBook": 0.15, "DeleteBook": 0.15},
+    "closest": {"FindClosestBook": 0.8, "InsertBook": 0.2},
+}
+
+def bookLine(bookId):
+    return f'InsertBook({bookId}, "Book{bookId}", "Author{bookId % 97}", "Yes")'
+
+def generateWorkload(mix, size, seed):
+    # Reproducible (setup, measured) command lines for a workload. Setup
+    # preloads a catalogue of size books for every mix except insert.
+    rng = random.Random(f"{mix}-{size}-{seed}")
+    idSpace = size * 4
+    books = set()
+    setup = []
+    if mix != "insert":
+        books.update(rng.sample(range(1, idSpace + 1), size))
+        setup = [bookLine(bookId) for bookId in sorted(books)]
+    # Sorted copy of books for picking existing IDs, rebuilt when stale
+    bookList = sorted(books)
+    stale = False
+    # (bookId, patronId) of loans the workload may return later
+    loans = []
+    patrons = max(size // 10, 1)
+    commands, weights = zip(*WORKLOAD_MIXES[mix].items())
+    measured = []
+    for command in rng.choices(commands, weights, k=size):
+        if stale and command in ("BorrowBook", "ReturnBook", "DeleteBook"):
+            bookList = sorted(books)
+            stale = False
+        if command == "InsertBook":
+            bookId = rng.randint(1, idSpace)
+            books.add(bookId)
+            stale = True
+            measured.append(bookLine(bookId))
+        elif command == "DeleteBook":
+            bookId = rng.choice(bookList) if bookList else rng.randint(1, idSpace)
+            books.discard(bookId)
+            stale = True
+            measured.append(f"DeleteBook({bookId})")
+        elif command == "BorrowBook":
+            bookId = rng.choice(bookList) if bookList else rng.randint(1, idSpace)
+            patronId = rng.randint(1, patrons)
+            loans.append((bookId, patronId))
+            measured.append(f"BorrowBook({patronId}, {bookId}, {rng.randint(1, 20)})")
+        elif command == "ReturnBook":
+            if loans:
+                i = rng.randrange(len(loans))
+                loans[i], loans[-1] = loans[-1], loans[i]
+                bookId, patronId = loans.pop()
+            else:
+                bookId = rng.randint(1, idSpace)
+                patronId = rng.randint(1, patrons)
+            measured.append(f"ReturnBook({patronId}, {bookId})")
+        elif command == "PrintBook":
+            measured.append(f"PrintBook({rng.randint(1, idSpace)})")
+        elif command == "PrintBooks":
+            low = rng.randint(1, idSpace)
+            measured.append(f"PrintBooks({low}, {low + rng.randint(0, 400)})")
+        elif command == "FindClosestBook":
+            measured.append(f"FindClosestBook({rng.randint(1, idSpace)})")
+        else:
+            measured.append(f"{command}()")
+    return setup, measured
+
+def percentile(sortedValues, fraction):
+    return sortedValues[int(fraction * (len(sortedValues) - 1))]
+
+def runWorkload(mix, size, seed, compact, backend="redblack"):
+    # Run one workload in this process and return its measurements
+    setup, measured = generateWorkload(mix, size, seed)
+    library = LibrarySystem(compact, backend=backend)
+    started = time.perf_counter()
+    library.insertBooks(compileCommand(line)[1] for line in setup)
+    setupSeconds = time.perf_counter() - started
+    latencies = {}
+    started = time.perf_counter()
+    for line in measured:
+        begin = time.perf_counter_ns()
+        opcode, args = compileCommand(line)
+        output = executeCommand(library, opcode, args)
+        if output is not None:
+            # Encode the result as the runner would, dropping what it writes
+            library.output.writeResult(opcode, output, len)
+        latencies.setdefault(COMMAND_NAMES[opcode], []).append(
+            time.perf_counter_ns() - begin
+        )
+    totalSeconds = time.perf_counter() - started
+    commands = {}
+    for command, values in sorted(latencies.items()):
+        values.sort()
+        commands[command] = {
+            "count": len(values),
+            "opsPerSec": len(values) / (sum(values) / 1e9),
+            "p50Us": percentile(values, 0.5) / 1000,
+            "p99Us": percentile(values, 0.99) / 1000,
+        }
+    return {
+        "workload": mix,
+        "size": size,
+        "seed": seed,
+        "compact": compact,
+        "backend": backend,
+        "setupSeconds": setupSeconds,
+        "totalSeconds": totalSeconds,
+        "opsPerSec": len(measured) / totalSeconds,
+        "treeHeight": library.bookTree.height(),
+        "books": library.bookTree.size,
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        "peakRss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "commands": commands,
+    }
+
+def runIsolated(mix, size, seed, compact, backend="redblack"):
+    # Run a workload in a fresh process so its peak memory is its own
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1) as pool:
+        return pool.apply(runWorkload, (mix, size, seed, compact, backend))
+
+def compareResults(baseline, results, threshold):
+    # Print commands whose throughput fell by more than threshold, returning
+    # the number of regressions
+    def key(result):
+        # Results from before backends were selectable used the red-black tree
+        return (
+            result["workload"],
+            result["size"],
+            result["compact"],
+            result.get("backend", "redblack"),
+        )
+
+    previous = {key(result): result for result in baseline["results"]}
+    regressions = 0
+    for result in results:
+        old = previous.get(key(result))
+        if old is None:
+            continue
+        for command, stats in result["commands"].items():
+            if command not in old["commands"]:
+                continue
+            ratio = stats["opsPerSec"] / old["commands"][command]["opsPerSec"]
+            if ratio < 1 - threshold:
+                regressions += 1
+                print(
+                    f"REGRESSION {result['workload']}/{command}: "
+                    f"{ratio:.2f}x of baseline throughput"
+                )
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Gator Library benchmark suite")
+    parser.add_argument("--size", type=int, nargs="+", default=[10000])
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--mix", nargs="+", choices=sorted(WORKLOAD_MIXES), default=list(WORKLOAD_MIXES)
+    )
+    parser.add_argument("--compact", action="store_true", help="use the compact tree")
+    parser.add_argument(
+        "--backend",
+        choices=list(BOOK_INDEXES),
+        default="redblack",
+        help="ordered index to keep the books in",
+    )
+    parser.add_argument("--output", default="bench_output.json")
+    parser.add_argument(
+        "--dump",
+        metavar="DIR",
+        help="also write each workload as a command file runnable by gatorLibrary.py",
+    )
+    parser.add_argument("--compare", metavar="BASELINE", help="earlier results to compare with")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="throughput drop reported as a regression (default 0.2)",
+    )
+    parser.add_argument(
+        "--in-process",
+        action="store_true",
+        help="run workloads in this process (peak memory then accumulates)",
+    )
+    options = parser.parse_args()
+    if options.compact and options.backend != "redblack":
+        parser.error("--compact needs the redblack backend")
+    results = []
+    for size in options.size:
+        for mix in options.mix:
+            if options.dump:
+                os.makedirs(options.dump, exist_ok=True)
+                setup, measured = generateWorkload(mix, size, options.seed)
+                with open(os.path.join(options.dump, f"{mix}_{size}.txt"), "w") as file:
+                    file.writelines(f"{line}\n" for line in setup + measured)
+                    file.write("Quit()\n")
+            run = runWorkload if options.in_process else runIsolated
+            result = run(mix, size, options.seed, options.compact, options.backend)
+            results.append(result)
+            print(
+                f"{mix:>8} n={size}: {result['opsPerSec']:.0f} ops/s, "
+                f"height {result['treeHeight']}, peak RSS {result['peakRss']}"
+            )
+            for command, stats in result["commands"].items():
+                print(
+                    f"{'':>10}{command:<16} {stats['opsPerSec']:>10.0f} ops/s  "
+                    f"p50 {stats['p50Us']:.1f}us  p99 {stats['p99Us']:.1f}us"
+                )
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "script": os.path.basename(gatorLibrary.__file__),
+        "timestamp": time.time(),
+        "results": results,
+    }
+    with open(options.output, "w") as file:
+        json.dump(report, file, indent=2)
+    if options.compare:
+        with open(options.compare) as file:
+            if compareResults(json.load(file), results, options.threshold):
+                raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,38 @@
+import argparse
+import gc
+import glob
+import json
+import mmap
+import multiprocessing
+import os
+import re
+import struct
 import time
 import sys
+import threading
+from array import array
+from collections import OrderedDict, deque
+from itertools import count, islice
+from bisect import bisect_left, insort
 from os.path import splitext
+# Longest waitlist a book can have
+WAITLIST_LIMIT = 20
+# Availability of a book that is on the shelf
+AVAILABLE = '"Yes"'
+# Versions handed to books as they are made and changed. No two books share
+# one, so a bookId and version never name details of a deleted book again
+BOOK_VERSIONS = count()
+
 class BookNode:
+    __slots__ = (
+        "bookId",
+        "bookName",
+        "authorName",
+        "availability",
+        "borrowedBy",
+        "reservations",
+        "version",
+    )
     def __init__(self, bookId, bookName, authorName, availability):
         self.bookId = bookId 
         self.bookName = bookName
@@ -9,38 +40,56 @@ class BookNode:
         self.availability = availability
         # Track who currently has the book checked out
         self.borrowedBy = None  
-        # Use a heap to store reservation requests 
-        self.reservations = BinaryMinHeap()  
+        # Use a heap to store reservation requests, allocated on the first
+        # reservation
+        self.reservations = EMPTY_RESERVATIONS
+        # Renewed whenever the book's details change, so cached details of an
+        # older version are not served
+        self.version = next(BOOK_VERSIONS)
    
+    @property
+    def value(self):
+        # Indexes that store BookNodes directly hand them out as their nodes
+        return self
+    def copy(self):
+        # Copy with its own reservation heap, to change without touching a
+        # book that readers may hold
+        book = BookNode(self.bookId, self.bookName, self.authorName, self.availability)
+        book.borrowedBy = self.borrowedBy
+        if self.reservations is not EMPTY_RESERVATIONS:
+            book.reservations = self.reservations.copy()
+        book.version = self.version
+        return book
     def addReservation(self, patronId, priorityNumber):
+        # A patron keeps their first reservation for a book
+        if patronId in self.reservations:
+            return "Already reserved"
+        # Limit number of reservations 
+        if len(self.reservations) >= WAITLIST_LIMIT:
+            return "Waitlist full"
+        if self.reservations is EMPTY_RESERVATIONS:
+            self.reservations = BinaryMinHeap()
         # Get current timestamp for the reservation
         timestamp = time.time()  
         reservation = (priorityNumber, patronId, timestamp)
         self.reservations.insert(reservation)
-        # Limit number of reservations 
-        if len(self.reservations.heap) > 20:
-            return "Wailist full"
 
     def getReservations(self):
-        # Extract reservations from heap
-        reservations = [] 
-        while True:
-            minentry = self.reservations.removeMin()
-            if minentry is not None:
-                # Get just the patron ID 
-                patronId = minentry[1]  
-                reservations.append(patronId)
-            else:
-                break
-        return reservations
+        # Patron IDs in the order they would be served, leaving the heap intact
+        entries = sorted(self.reservations, key=lambda entry: (entry[0], entry[2]))
+        return [entry[1] for entry in entries]
 
 class RedBlackNode:
+    __slots__ = ("value", "red", "parent", "l", "r", "size", "available")
     def __init__(self, value: BookNode):
         self.value = value
         self.red = False
         self.parent = None
         self.l = None
         self.r = None
+        # Number of nodes, and of available books, in the subtree rooted here
+        self.size = 1
+        self.available = 1 if value.availability == AVAILABLE else 0
         
 class RedBlackTree:
     def __init__(self):
@@ -49,47 +98,65 @@ class RedBlackTree:
         self.nil.red = False  
         self.nil.l = None
         self.nil.r = None
+        self.nil.size = 0
         self.root = self.nil
   
         # Track recoloring for balancing
         self.colorFlipCount = 0
+        # Instrumentation, off unless instrument is called
+        self.stats = None
+        # Number of books stored in the tree
+        self.size = 0
+        self.colorsBefore = {}
 
+    def newNode(self, value):
+        # Red leaf node holding value, not yet linked into the tree
+        node = RedBlackNode(value)
+        node.red = True
+        node.l = self.nil
+        node.r = self.nil
+        return node
     def insert(self, value):
-        newNode = RedBlackNode(value) 
-        newNode.red = True  
-        # Initialize new node child pointers  
-        newNode.l = self.nil
-        newNode.r = self.nil
-        
         parent = None
         current = self.root
+        available = 1 if value.availability == AVAILABLE else 0
 
-        # Find spot to insert new node  
+        # Find spot to insert new node, counting it in every subtree on the way
         while current != self.nil:
             parent = current  
-            if newNode.value.bookId < current.value.bookId:
+            current.size += 1
+            current.available += available
+            if value.bookId < current.value.bookId:
                 current = current.l
-            elif newNode.value.bookId > current.value.bookId:   
+            elif value.bookId > current.value.bookId:   
                 current = current.r
             else:
                 # Node already exists  
+                while current is not None:
+                    current.size -= 1
+                    current.available -= available
+                    current = current.parent
                 return
         
-        # Insert node in tree
+        return self.addLeaf(value, parent)
+    def addLeaf(self, value, parent):
+        # Insert node in tree below parent, where insert's search ended
+        newNode = self.newNode(value)
         newNode.parent = parent
         if parent is None:
            self.root = newNode
-        elif newNode.value.bookId < parent.value.bookId:
+        elif value.bookId < parent.value.bookId:
            parent.l = newNode
         else:
           parent.r = newNode
 
+        self.size += 1
         # Balance tree after insert   
         self.fixInsert(newNode)
+        return newNode
 
     def find(self, value):
         # Find Book in Tree
-        value = int(value)  
         curr = self.root
         while curr != self.nil and value != curr.value.bookId:
             if value < curr.value.bookId:
@@ -102,6 +169,60 @@ class RedBlackTree:
             return None
         else:
             return curr
+    def findMany(self, values):
+        # Nodes for a sorted list of bookIds, None where missing. Each search
+        # starts from the node the last one ended at and climbs only until
+        # the bookId is in range of the subtree below, so bookIds close
+        # together share most of their path.
+        finger = self.root
+        for value in values:
+            if finger == self.nil:
+                yield None
+                continue
+            # The subtree of a left child ends below its parent's bookId
+            while finger.parent is not None and not (
+                finger == finger.parent.l and value < finger.parent.value.bookId
+            ):
+                finger = finger.parent
+            while value != finger.value.bookId:
+                child = finger.l if value < finger.value.bookId else finger.r
+                if child == self.nil:
+                    break
+                finger = child
+            yield finger if value == finger.value.bookId else None
+    def instrument(self, stats):
+        # Record the path length of every find, and the rebalancing work, in
+        # stats
+        self.stats = stats
+        self.find = self.findCounted
+        self.countRotations()
+    def countRotations(self):
+        # Wrap the rotations to count themselves, so uninstrumented trees
+        # run them without the counter
+        stats = self.stats
+        rotateLeft, rotateRight = self.rotateLeft, self.rotateRight
+        def countedLeft(x):
+            stats.rotations += 1
+            rotateLeft(x)
+        def countedRight(x):
+            stats.rotations += 1
+            rotateRight(x)
+        self.rotateLeft = countedLeft
+        self.rotateRight = countedRight
+    def findCounted(self, value):
+        # find, counting the nodes passed on the way down
+        curr = self.root
+        steps = 0
+        while curr != self.nil and value != curr.value.bookId:
+            steps += 1
+            if value < curr.value.bookId:
+                curr = curr.l
+            else:
+                curr = curr.r
+        self.stats.recordSearch(steps)
+        if curr == self.nil:
+            return None
+        return curr
     def rotateLeft(self, x):
         # Rotate Left
         y = x.r
@@ -117,6 +238,12 @@ class RedBlackTree:
             x.parent.r = y
         y.l = x
         x.parent = y
+        y.size = x.size
+        x.size = x.l.size + x.r.size + 1
+        # x keeps its subtree less y and y's right subtree
+        yAvailable = y.available
+        y.available = x.available
+        x.available += x.r.available - yAvailable
     def rotateRight(self, x):
         # Rotate Right
         y = x.l
@@ -132,27 +259,26 @@ class RedBlackTree:
             x.parent.l = y
         y.r = x
         x.parent = y
+        y.size = x.size
+        x.size = x.l.size + x.r.size + 1
+        # x keeps its subtree less y and y's left subtree
+        yAvailable = y.available
+        y.available = x.available
+        x.available += x.l.available - yAvailable
     def delete(self, value):
-        # Create an empty dictionary to store the color of each node before deletion
-        dictBefore = {}
-        # Create an empty stack and add the root node to it
-        tempStack = []
-        node = self.root
-        tempStack.append(node)
-        # Traverse the tree using BFS and store the color of each node in dictBefore
-        while tempStack:
-            curr = tempStack.pop(0)
-            dictBefore[curr.value.bookId] = 1 if curr.red else 0
-            if curr.l:
-                tempStack.append(curr.l)
-            if curr.r:
-                tempStack.append(curr.r)
+        # Returns the node taken out of the tree, None if value is not there
         # Find the node to be deleted
         z = self.find(value)
         if z is None:
             return
+        self.size -= 1
+        # Remember the original colour of every node recoloured by this delete
+        self.colorsBefore = {}
         y = z
         y_original_color = y.red
+        # Uncount the node leaving its place: z, or its successor when z has
+        # two children
+        self.uncount(z if z.l == self.nil or z.r == self.nil else self.minimum(z.r), z)
         # If z has no left child, replace z with its right child
         if z.l == self.nil:
             x = z.r
@@ -175,162 +301,159 @@ class RedBlackTree:
             self.transfer(z, y)
             y.l = z.l
             y.l.parent = y
-            y.red = z.red
+            y.size = z.size
+            y.available = z.available
+            self.recolor(y, z.red)
         # Fix the tree if the original color of y was black
         if y_original_color == False:
-            self.fixDelete(x, dictBefore)
-        # Otherwise, update the color flip count
-        else:
-            dictAfter = {}
-            tempStack = []
-            node = self.root
-            tempStack.append(node)
-            while tempStack:
-                curr = tempStack.pop(0)
-                dictAfter[curr.value.bookId] = 1 if curr.red else 0
-                if curr.l:
-                    tempStack.append(curr.l)
-                if curr.r:
-                    tempStack.append(curr.r)
-            diff = {x: dictBefore[x] == dictAfter[x] for x in dictBefore if x in dictAfter}
-            incrementBy = 0
-            for d in diff.values():
-                if d == False:
-                    incrementBy += 1
-            self.colorFlipCount += incrementBy
+            self.fixDelete(x)
+        # Count the nodes whose colour differs from before the delete
+        incrementBy = 0
+        for node, red in self.colorsBefore.items():
+            if node != z and node.red != red:
+                incrementBy += 1
+        self.colorFlipCount += incrementBy
+        self.colorsBefore = {}
+        return z
+    def uncount(self, removed, z):
+        # Take the node removed out of the counts above it. Below z the
+        # successor's book leaves the subtrees, from z up it is z's book.
+        lost = self.ownAvailable(removed)
+        zAvailable = self.ownAvailable(z)
+        node = removed.parent
+        while node is not None:
+            if node == z:
+                lost = zAvailable
+            node.size -= 1
+            node.available -= lost
+            node = node.parent
+    def recolor(self, node, red):
+        # Set colour during delete, keeping the colour it had before the delete
+        if node not in self.colorsBefore:
+            self.colorsBefore[node] = node.red
+        node.red = red
     def fixInsert(self, newNode):
+        stats = self.stats
         while newNode != self.root and newNode.parent.red:
-            if newNode.parent == newNode.parent.parent.r:
-                u = newNode.parent.parent.l
+            if stats is not None:
+                stats.fixInsertLoops += 1
+            parent = newNode.parent
+            grandparent = parent.parent
+            if parent == grandparent.r:
+                u = grandparent.l
                 if u.red:
                     # Case 1: Recoloring
                     u.red = False
-                    newNode.parent.red = False
-                    newNode.parent.parent.red = True
+                    parent.red = False
+                    grandparent.red = True
                     if (
                         u == self.root
-                        or newNode.parent == self.root
-                        or newNode.parent.parent == self.root
+                        or parent == self.root
+                        or grandparent == self.root
                     ):
                         self.colorFlipCount += 2
                     else:
                         self.colorFlipCount += 3
-                    newNode = newNode.parent.parent
+                    newNode = grandparent
                 else:
                     # Case 2: Restructuring
-                    if newNode == newNode.parent.l:
-                        newNode = newNode.parent
+                    if newNode == parent.l:
+                        newNode = parent
                         self.rotateRight(newNode)
-                    newNode.parent.red = False
-                    newNode.parent.parent.red = True
-                    if (
-                        newNode.parent == self.root
-                        or newNode.parent.parent == self.root
-                    ):
+                        parent = newNode.parent
+                    parent.red = False
+                    grandparent.red = True
+                    if parent == self.root or grandparent == self.root:
                         if self.root.red == True:
                             self.colorFlipCount += 2
                         else:
                             self.colorFlipCount += 1
                     else:
                         self.colorFlipCount += 2
-                    self.rotateLeft(newNode.parent.parent)
+                    self.rotateLeft(grandparent)
             else:
                 # Similar as above
-                u = newNode.parent.parent.r
+                u = grandparent.r
                 if u.red:
                     u.red = False
-                    newNode.parent.red = False
-                    newNode.parent.parent.red = True
+                    parent.red = False
+                    grandparent.red = True
                     if (
                         u == self.root
-                        or newNode.parent == self.root
-                        or newNode.parent.parent == self.root
+                        or parent == self.root
+                        or grandparent == self.root
                     ):
                         self.colorFlipCount += 2
                     else:
                         self.colorFlipCount += 3
-                    newNode = newNode.parent.parent
+                    newNode = grandparent
                 else:
-                    if newNode == newNode.parent.r:
-                        newNode = newNode.parent
+                    if newNode == parent.r:
+                        newNode = parent
                         self.rotateLeft(newNode)
-                    newNode.parent.red = False
-                    newNode.parent.parent.red = True
-                    if (
-                        newNode.parent == self.root
-                        or newNode.parent.parent == self.root
-                    ):
+                        parent = newNode.parent
+                    parent.red = False
+                    grandparent.red = True
+                    if parent == self.root or grandparent == self.root:
                         if self.root.red == True:
                             self.colorFlipCount += 2
                         else:
                             self.colorFlipCount += 1
                     else:
                         self.colorFlipCount += 2
-                    self.rotateRight(newNode.parent.parent)
+                    self.rotateRight(grandparent)
         self.root.red = False
-    def fixDelete(self, x, dictBefore):
-        # Restructuring and recoloring for delete operations, similar to fix insert.
+    def fixDelete(self, x):
+        # Restructuring and recoloring for delete operations, similar to fix
+        # insert. The rotations move x's parent down but leave it x's parent.
+        stats = self.stats
         while x != self.root and x.red == False:
-            if x == x.parent.l:
-                w = x.parent.r
+            if stats is not None:
+                stats.fixDeleteLoops += 1
+            parent = x.parent
+            if x == parent.l:
+                w = parent.r
                 if w.red:
-                    w.red = False
-                    x.parent.red = True
-                    self.rotateLeft(x.parent)
-                    w = x.parent.r
+                    self.recolor(w, False)
+                    self.recolor(parent, True)
+                    self.rotateLeft(parent)
+                    w = parent.r
                 if w.l.red == False and w.r.red == False:
-                    w.red = True
-                    x = x.parent
+                    self.recolor(w, True)
+                    x = parent
                 else:
                     if w.r.red == False:
-                        w.l.red = False
-                        w.red = True
+                        self.recolor(w.l, False)
+                        self.recolor(w, True)
                         self.rotateRight(w)
-                        w = x.parent.r
-                    w.red = x.parent.red
-                    x.parent.red = False
-                    w.r.red = False
-                    self.rotateLeft(x.parent)
+                        w = parent.r
+                    self.recolor(w, parent.red)
+                    self.recolor(parent, False)
+                    self.recolor(w.r, False)
+                    self.rotateLeft(parent)
                     x = self.root
             else:
-                w = x.parent.l
+                w = parent.l
                 if w.red:
-                    w.red = False
-                    x.parent.red = True
-                    self.rotateRight(x.parent)
-                    w = x.parent.l
+                    self.recolor(w, False)
+                    self.recolor(parent, True)
+                    self.rotateRight(parent)
+                    w = parent.l
                 if w.r.red == False and w.l.red == False:
-                    w.red = True
-                    x = x.parent
+                    self.recolor(w, True)
+                    x = parent
                 else:
                     if w.l.red == False:
-                        w.r.red = False
-                        w.red = True
+                        self.recolor(w.r, False)
+                        self.recolor(w, True)
                         self.rotateLeft(w)
-                        w = x.parent.l
-                    w.red = x.parent.red
-                    x.parent.red = False
-                    w.l.red = False
-                    self.rotateRight(x.parent)
+                        w = parent.l
+                    self.recolor(w, parent.red)
+                    self.recolor(parent, False)
+                    self.recolor(w.l, False)
+                    self.rotateRight(parent)
                     x = self.root
-        x.red = False
-        dictAfter = {}
-        tempStack = []
-        node = self.root
-        tempStack.append(node)
-        while tempStack:
-            curr = tempStack.pop(0)
-            dictAfter[curr.value.bookId] = 1 if curr.red else 0
-            if curr.l:
-                tempStack.append(curr.l)
-            if curr.r:
-                tempStack.append(curr.r)
-        diff = {x: dictBefore[x] == dictAfter[x] for x in dictBefore if x in dictAfter}
-        incrementBy = 0
-        for d in diff.values():
-            if d == False:
-                incrementBy += 1
-        self.colorFlipCount += incrementBy
+        self.recolor(x, False)
     def transfer(self, u, v):
         #Supporting code for transformation
         if u.parent is None:
@@ -344,24 +467,2066 @@ class RedBlackTree:
         while x.l != self.nil:
             x = x.l
         return x
+    def maximum(self, x):
+        while x.r != self.nil:
+            x = x.r
+        return x
+    def successor(self, x):
+        # Next node in order, found through the subtree or parent pointers
+        if x.r != self.nil:
+            return self.minimum(x.r)
+        y = x.parent
+        while y is not None and x == y.r:
+            x = y
+            y = y.parent
+        return y
+    def predecessor(self, x):
+        # Previous node in order, found through the subtree or parent pointers
+        if x.l != self.nil:
+            return self.maximum(x.l)
+        y = x.parent
+        while y is not None and x == y.l:
+            x = y
+            y = y.parent
+        return y
+    def nearest(self, targetId):
+        # In-order cursors walking outward from targetId: one down through
+        # the nodes at or below it, one up through the nodes above it
+        lower = higher = None
+        node = self.root
+        while node != self.nil:
+            if node.value.bookId <= targetId:
+                lower = node
+                node = node.r
+            else:
+                higher = node
+                node = node.l
+        return self.walk(lower, self.predecessor), self.walk(higher, self.successor)
+    def walk(self, node, step):
+        while node is not None:
+            yield node
+            node = step(node)
+    def rangeSearch(self, low, high, skip=0):
+        # Descend to the first node >= low, or the one skip places after it,
+        # then follow successors up to high
+        if skip:
+            start = self.select(self.countBelow(self.root, low) + skip)
+        else:
+            curr = self.root
+            start = None
+            while curr != self.nil:
+                if curr.value.bookId >= low:
+                    start = curr
+                    curr = curr.l
+                else:
+                    curr = curr.r
+        while start is not None and start.value.bookId <= high:
+            yield start
+            start = self.successor(start)
+    def closest(self, targetId):
+        # Nearest nodes at or below and at or above targetId
+        closestLower = closestHigher = None
+        node = self.root
+        while node != self.nil:
+            if node.value.bookId == targetId:
+                return node, node
+            elif node.value.bookId < targetId:
+                closestLower = node
+                node = node.r
+            else:
+                closestHigher = node
+                node = node.l
+        return closestLower, closestHigher
+    def countBelow(self, node, bookId):
+        # Number of books under node with a bookId below bookId
+        count = 0
+        while node != self.nil:
+            if node.value.bookId < bookId:
+                count += node.l.size + 1
+                node = node.r
+            else:
+                node = node.l
+        return count
+    def count(self, low, high):
+        # Number of books with low <= bookId <= high
+        if low > high:
+            return 0
+        # One version for both counts when readers share a persistent tree
+        root = self.root
+        return self.countBelow(root, high + 1) - self.countBelow(root, low)
+    def select(self, position):
+        # Node with position books before it, or None if there is none
+        node = self.root
+        while node != self.nil:
+            leftSize = node.l.size
+            if position < leftSize:
+                node = node.l
+            elif position == leftSize:
+                return node
+            else:
+                position -= leftSize + 1
+                node = node.r
+        return None
+    def ownAvailable(self, node):
+        # 1 if node's book is available, else 0. Read from the counts rather
+        # than the book, so readers of a persistent version agree with it.
+        return node.available - node.l.available - node.r.available
+    def editBook(self, node):
+        # Book of node to change, followed by publishBook once done
+        return node.value
+    def publishBook(self):
+        # Returns the book the edited one replaced, None if edited in place
+        return None
+    def setAvailability(self, node, availability):
+        # Change a book's availability, recounting the subtrees above it
+        change = (availability == AVAILABLE) - (node.value.availability == AVAILABLE)
+        node.value.availability = availability
+        while change and node is not None:
+            node.available += change
+            node = node.parent
+    def availableBelow(self, node, bookId):
+        # Number of available books under node with a bookId below bookId
+        count = 0
+        while node != self.nil:
+            if node.value.bookId < bookId:
+                count += node.available - node.r.available
+                node = node.r
+            else:
+                node = node.l
+        return count
+    def countAvailable(self, low, high):
+        # Number of available books with low <= bookId <= high
+        if low > high:
+            return 0
+        root = self.root
+        return self.availableBelow(root, high + 1) - self.availableBelow(root, low)
+    def selectAvailable(self, root, position):
+        # Available node under root with position available books before it,
+        # or None. Subtrees with every book borrowed are stepped over whole.
+        node = root
+        while node != self.nil:
+            leftAvailable = node.l.available
+            if position < leftAvailable:
+                node = node.l
+                continue
+            position -= leftAvailable
+            if self.ownAvailable(node):
+                if position == 0:
+                    return node
+                position -= 1
+            node = node.r
+        return None
+    def nextAvailable(self, bookId):
+        # First available node with a bookId at or above bookId, or None
+        root = self.root
+        return self.selectAvailable(root, self.availableBelow(root, bookId))
+    def closestAvailable(self, targetId):
+        # Nearest available nodes at or below and at or above targetId
+        root = self.root
+        position = self.availableBelow(root, targetId)
+        higher = self.selectAvailable(root, position)
+        if higher is not None and higher.value.bookId == targetId:
+            return higher, higher
+        lower = self.selectAvailable(root, position - 1) if position else None
+        return lower, higher
+    def inorder(self):
+        # Yield every node in order of bookId
+        if self.root == self.nil:
+            return
+        curr = self.minimum(self.root)
+        while curr is not None:
+            yield curr
+            curr = self.successor(curr)
+    def height(self):
+        # Number of nodes on the longest path from the root to a leaf
+        best = 0
+        stack = [(self.root, 1)] if self.root != self.nil else []
+        while stack:
+            node, depth = stack.pop()
+            best = max(best, depth)
+            if node.l != self.nil:
+                stack.append((node.l, depth + 1))
+            if node.r != self.nil:
+                stack.append((node.r, depth + 1))
+        return best
+    def preorder(self):
+        # Yield (value, red, hasLeft, hasRight) for every node in preorder
+        stack = [self.root] if self.root != self.nil else []
+        while stack:
+            node = stack.pop()
+            yield node.value, node.red, node.l != self.nil, node.r != self.nil
+            if node.r != self.nil:
+                stack.append(node.r)
+            if node.l != self.nil:
+                stack.append(node.l)
+    def loadPreorder(self, records):
+        # Rebuild the tree from preorder records, as produced by preorder(),
+        # without rebalancing. Returns the node values in preorder.
+        nodes = []
+        # Parents still waiting for a left ("l") or right ("r") child
+        pending = []
+        for value, red, hasLeft, hasRight in records:
+            node = self.newNode(value)
+            node.red = red
+            if pending:
+                parent, side = pending.pop()
+                node.parent = parent
+                setattr(parent, side, node)
+            else:
+                self.root = node
+            if hasRight:
+                pending.append((node, "r"))
+            if hasLeft:
+                pending.append((node, "l"))
+            nodes.append(node)
+        # Children come after their parent in preorder
+        for node in reversed(nodes):
+            node.size = node.l.size + node.r.size + 1
+            node.available = node.l.available + node.r.available + (
+                node.value.availability == AVAILABLE
+            )
+        self.size = len(nodes)
+        return [node.value for node in nodes]
+    def bulkLoad(self, values):
+        # Add a batch of BookNodes, rebuilding the tree in linear time when the
+        # batch is at least as large as the tree. Bulk-loaded nodes are given
+        # their colours directly, so they add no colour flips. Returns the
+        # BookNodes that were added.
+        values = sorted(values, key=lambda value: value.bookId)
+        if len(values) < self.size:
+            added = []
+            for value in values:
+                node = self.insert(value)
+                if node is not None:
+                    added.append(node.value)
+            return added
+        merged = []
+        # Positions in merged of the books the batch adds
+        added = []
+        existing = [node.value for node in self.inorder()]
+        i = j = 0
+        while i < len(existing) or j < len(values):
+            # Books already in the tree win over the batch, as with insert
+            if j == len(values) or (
+                i < len(existing) and existing[i].bookId <= values[j].bookId
+            ):
+                value = existing[i]
+                i += 1
+            else:
+                value = values[j]
+                j += 1
+                if merged and merged[-1].bookId == value.bookId:
+                    continue
+                added.append(len(merged))
+            if not merged or merged[-1].bookId != value.bookId:
+                merged.append(value)
+        stored = self.build(merged)
+        return [stored[i] for i in added]
+    def build(self, values):
+        # Build a balanced tree from BookNodes sorted by unique bookId. Only the
+        # deepest level can be incomplete, so colouring it red keeps every
+        # path at the same black height. Returns the node values in order.
+        redDepth = len(values).bit_length() - 1
+        stored = [None] * len(values)
+        def buildRange(lo, hi, depth, parent):
+            if lo > hi:
+                return self.nil
+            mid = (lo + hi) // 2
+            node = self.newNode(values[mid])
+            stored[mid] = node.value
+            node.parent = parent
+            node.size = hi - lo + 1
+            node.red = depth == redDepth and depth > 0
+            node.l = buildRange(lo, mid - 1, depth + 1, node)
+            node.r = buildRange(mid + 1, hi, depth + 1, node)
+            node.available += node.l.available + node.r.available
+            return node
+        self.root = buildRange(0, len(values) - 1, 0, None)
+        self.size = len(values)
+        return stored
+    def blackHeight(self, node):
+        # Black nodes on a path from node down to a leaf
+        height = 0
+        while node != self.nil:
+            if not node.red:
+                height += 1
+            node = node.l
+        return height
+    def detach(self, node):
+        # Cut node off from its children and parent, keeping its own counts
+        node.available -= node.l.available + node.r.available
+        node.size = 1
+        node.l = node.r = self.nil
+        node.parent = None
+    def join(self, left, node, right):
+        # Root of one tree holding the detached trees left and right and the
+        # detached node, every bookId in left being below node's and every
+        # one in right above. node is hung red from the taller tree's spine
+        # where the black height matches the other tree, then fixed up as an
+        # inserted node would be.
+        left.red = right.red = False
+        leftHeight = self.blackHeight(left)
+        rightHeight = self.blackHeight(right)
+        node.red = True
+        parent = None
+        if leftHeight >= rightHeight:
+            root = current = left
+            height = leftHeight
+            while current.red or height > rightHeight:
+                if not current.red:
+                    height -= 1
+                parent = current
+                current = current.r
+            node.l, node.r = current, right
+        else:
+            root = current = right
+            height = rightHeight
+            while current.red or height > leftHeight:
+                if not current.red:
+                    height -= 1
+                parent = current
+                current = current.l
+            node.l, node.r = left, current
+        if node.l != self.nil:
+            node.l.parent = node
+        if node.r != self.nil:
+            node.r.parent = node
+        node.size += node.l.size + node.r.size
+        node.available += node.l.available + node.r.available
+        node.parent = parent
+        if parent is None:
+            root = node
+        elif leftHeight >= rightHeight:
+            parent.r = node
+        else:
+            parent.l = node
+        # Count what was added below the spine nodes above node
+        size = node.size - current.size
+        available = node.available - current.available
+        while parent is not None:
+            parent.size += size
+            parent.available += available
+            parent = parent.parent
+        self.root = root
+        self.fixInsert(node)
+        return self.root
+    def split(self, node, bookId):
+        # Detached trees of the nodes under the detached root node with a
+        # bookId below bookId, and of the rest
+        if node == self.nil:
+            return self.nil, self.nil
+        left, right = node.l, node.r
+        left.parent = right.parent = None
+        self.detach(node)
+        if bookId <= node.value.bookId:
+            lower, upper = self.split(left, bookId)
+            return lower, self.join(upper, node, right)
+        lower, upper = self.split(right, bookId)
+        return self.join(left, node, lower), upper
+    def removeRange(self, low, high):
+        # Take the nodes with low <= bookId <= high out of the tree and
+        # return their values in order. The tree is split around them and
+        # the outer parts joined, costing O(log n) rebalancing however many
+        # books go; colour flips are counted as fixInsert counts them.
+        if low > high or self.root == self.nil:
+            return []
+        lower, rest = self.split(self.root, low)
+        middle, upper = self.split(rest, high + 1)
+        if upper != self.nil:
+            # The first node of upper joins the outer parts back together
+            first, upper = self.split(upper, self.minimum(upper).value.bookId + 1)
+            lower = self.join(lower, first, upper)
+        lower.parent = None
+        lower.red = False
+        self.root = lower
+        removed = []
+        stack = []
+        node = middle
+        while stack or node != self.nil:
+            if node != self.nil:
+                stack.append(node)
+                node = node.l
+            else:
+                node = stack.pop()
+                removed.append(node.value)
+                node = node.r
+        self.size -= len(removed)
+        return removed
 
-class BinaryMinHeap:
+class PersistentNode:
+    # Tree node that is never changed once published. version is the
+    # mutation that created it; only that mutation may modify it.
+    __slots__ = ("value", "red", "l", "r", "version", "size", "available")
+    def __init__(self, value, red, l, r, version, size, available):
+        self.value = value
+        self.red = red
+        self.l = l
+        self.r = r
+        self.version = version
+        # Number of nodes, and of available books, in the subtree rooted here
+        self.size = size
+        self.available = available
+
+class PersistentRedBlackTree(RedBlackTree):
+    # Path-copying red-black tree for lock-free readers. A mutation copies the
+    # nodes it changes, rebalances the copies with the same steps and colour
+    # flip counting as RedBlackTree, then publishes the new root with a single
+    # assignment to self.root. Readers take self.root once and follow only
+    # child links, so they always see one consistent version, and versions no
+    # reader holds any more are freed by reference counting. Parent links
+    # live in the writer's parents dict only while a mutation runs. Books
+    # are copied the same way when they change, so readers never see a book
+    # half changed.
     def __init__(self):
+        self.nil = PersistentNode(BookNode(0, None, None, None), False, None, None, 0, 0, 0)
+        # Published root, and the root the running mutation is building
+        self.root = self.nil
+        self.work = self.nil
+        self.version = 0
+        self.parents = {}
+
+        # Track recoloring for balancing
+        self.colorFlipCount = 0
+        # Instrumentation, off unless instrument is called
+        self.stats = None
+        # Number of books stored in the tree
+        self.size = 0
+        self.colorsBefore = {}
+        # Copied path down to the book being edited, and the book it had
+        self.editPath = []
+        self.replaced = None
+
+    def begin(self):
+        # Start a mutation from a writable copy of the published root
+        self.version += 1
+        self.parents = {}
+        self.colorsBefore = {}
+        self.work = self.root
+        if self.work != self.nil:
+            self.work = self.copy(self.work)
+            self.parents[self.work] = None
+    def publish(self):
+        self.root = self.work
+        self.parents = {}
+        self.colorsBefore = {}
+    def copy(self, node):
+        return PersistentNode(
+            node.value, node.red, node.l, node.r, self.version, node.size, node.available
+        )
+    def child(self, parent, left):
+        # Writable copy of a child of the writable node parent, linked in
+        # place of the original
+        node = parent.l if left else parent.r
+        if node == self.nil:
+            return node
+        if node.version != self.version:
+            node = self.copy(node)
+            if left:
+                parent.l = node
+            else:
+                parent.r = node
+        self.parents[node] = parent
+        return node
+    def own(self, node):
+        # Writable copy of a node whose parent is already writable
+        if node == self.nil or node.version == self.version:
+            return node
+        parent = self.parents[node]
+        if parent is None:
+            self.work = self.copy(node)
+            self.parents[self.work] = None
+            return self.work
+        return self.child(parent, parent.l is node)
+
+    def insert(self, value):
+        self.begin()
+        parent = None
+        current = self.work
+        available = 1 if value.availability == AVAILABLE else 0
+        # Find spot to insert new node, copying the path down to it and
+        # counting the new node in every copy. Nothing is published if the
+        # book is already there.
+        while current != self.nil:
+            parent = current
+            current.size += 1
+            current.available += available
+            if value.bookId < current.value.bookId:
+                current = self.child(current, True)
+            elif value.bookId > current.value.bookId:
+                current = self.child(current, False)
+            else:
+                # Node already exists
+                return
+        newNode = PersistentNode(
+            value, True, self.nil, self.nil, self.version, 1, available
+        )
+        self.parents[newNode] = parent
+        if parent is None:
+            self.work = newNode
+        elif value.bookId < parent.value.bookId:
+            parent.l = newNode
+        else:
+            parent.r = newNode
+
+        self.size += 1
+        # Balance tree after insert
+        self.fixInsert(newNode)
+        self.publish()
+        return newNode
+    def rotateLeft(self, x):
+        # Rotate Left; x and its right child must be writable
+        parents = self.parents
+        y = x.r
+        x.r = y.l
+        if y.l != self.nil:
+            parents[y.l] = x
+        parent = parents[x]
+        parents[y] = parent
+        if parent is None:
+            self.work = y
+        elif x == parent.l:
+            parent.l = y
+        else:
+            parent.r = y
+        y.l = x
+        parents[x] = y
+        y.size = x.size
+        x.size = x.l.size + x.r.size + 1
+        # x keeps its subtree less y and y's right subtree
+        yAvailable = y.available
+        y.available = x.available
+        x.available += x.r.available - yAvailable
+    def rotateRight(self, x):
+        # Rotate Right; x and its left child must be writable
+        parents = self.parents
+        y = x.l
+        x.l = y.r
+        if y.r != self.nil:
+            parents[y.r] = x
+        parent = parents[x]
+        parents[y] = parent
+        if parent is None:
+            self.work = y
+        elif x == parent.r:
+            parent.r = y
+        else:
+            parent.l = y
+        y.r = x
+        parents[x] = y
+        y.size = x.size
+        x.size = x.l.size + x.r.size + 1
+        # x keeps its subtree less y and y's left subtree
+        yAvailable = y.available
+        y.available = x.available
+        x.available += x.l.available - yAvailable
+    def delete(self, value):
+        self.begin()
+        parents = self.parents
+        # Find the node to be deleted, copying the path down to it
+        z = self.work
+        while z != self.nil and z.value.bookId != value:
+            z = self.child(z, value < z.value.bookId)
+        if z == self.nil:
+            return
+        self.size -= 1
+        y = z
+        if z.l != self.nil and z.r != self.nil:
+            # z will be replaced by its in-order successor
+            y = self.child(z, False)
+            while y.l != self.nil:
+                y = self.child(y, True)
+        # Uncount the node leaving its place in the copied path above it, as
+        # RedBlackTree.delete does
+        lost = self.ownAvailable(y)
+        zAvailable = self.ownAvailable(z)
+        node = parents[y]
+        while node is not None:
+            if node == z:
+                lost = zAvailable
+            node.size -= 1
+            node.available -= lost
+            node = parents[node]
+        y_original_color = y.red
+        # If z has no left child, replace z with its right child
+        if z.l == self.nil:
+            x = z.r
+            self.transfer(z, z.r)
+        # If z has no right child, replace z with its left child
+        elif z.r == self.nil:
+            x = z.l
+            self.transfer(z, z.l)
+        # If z has two children, replace z with its in-order successor
+        else:
+            x = y.r
+            if parents[y] == z:
+                parents[x] = y
+            else:
+                self.transfer(y, y.r)
+                y.r = z.r
+                parents[y.r] = y
+            self.transfer(z, y)
+            y.l = z.l
+            parents[y.l] = y
+            y.size = z.size
+            y.available = z.available
+            self.recolor(y, z.red)
+        # Fix the tree if the original color of y was black
+        if y_original_color == False:
+            self.fixDelete(x)
+        # Count the nodes whose colour differs from before the delete
+        incrementBy = 0
+        for node, red in self.colorsBefore.items():
+            if node != z and node.red != red:
+                incrementBy += 1
+        self.colorFlipCount += incrementBy
+        self.publish()
+    def fixInsert(self, newNode):
+        parents = self.parents
+        stats = self.stats
+        while newNode != self.work and parents[newNode].red:
+            if stats is not None:
+                stats.fixInsertLoops += 1
+            parent = parents[newNode]
+            grandparent = parents[parent]
+            if parent == grandparent.r:
+                if grandparent.l.red:
+                    # Case 1: Recoloring
+                    u = self.child(grandparent, True)
+                    u.red = False
+                    parent.red = False
+                    grandparent.red = True
+                    if (
+                        u == self.work
+                        or parent == self.work
+                        or grandparent == self.work
+                    ):
+                        self.colorFlipCount += 2
+                    else:
+                        self.colorFlipCount += 3
+                    newNode = grandparent
+                else:
+                    # Case 2: Restructuring
+                    if newNode == parent.l:
+                        newNode = parent
+                        self.rotateRight(newNode)
+                    parent = parents[newNode]
+                    grandparent = parents[parent]
+                    parent.red = False
+                    grandparent.red = True
+                    if parent == self.work or grandparent == self.work:
+                        if self.work.red == True:
+                            self.colorFlipCount += 2
+                        else:
+                            self.colorFlipCount += 1
+                    else:
+                        self.colorFlipCount += 2
+                    self.rotateLeft(grandparent)
+            else:
+                # Similar as above
+                if grandparent.r.red:
+                    u = self.child(grandparent, False)
+                    u.red = False
+                    parent.red = False
+                    grandparent.red = True
+                    if (
+                        u == self.work
+                        or parent == self.work
+                        or grandparent == self.work
+                    ):
+                        self.colorFlipCount += 2
+                    else:
+                        self.colorFlipCount += 3
+                    newNode = grandparent
+                else:
+                    if newNode == parent.r:
+                        newNode = parent
+                        self.rotateLeft(newNode)
+                    parent = parents[newNode]
+                    grandparent = parents[parent]
+                    parent.red = False
+                    grandparent.red = True
+                    if parent == self.work or grandparent == self.work:
+                        if self.work.red == True:
+                            self.colorFlipCount += 2
+                        else:
+                            self.colorFlipCount += 1
+                    else:
+                        self.colorFlipCount += 2
+                    self.rotateRight(grandparent)
+        self.work.red = False
+    def fixDelete(self, x):
+        # As RedBlackTree.fixDelete, copying each sibling and nephew before
+        # it is recoloured or rotated
+        parents = self.parents
+        stats = self.stats
+        while x != self.work and x.red == False:
+            if stats is not None:
+                stats.fixDeleteLoops += 1
+            parent = parents[x]
+            if x == parent.l:
+                w = self.child(parent, False)
+                if w.red:
+                    self.recolor(w, False)
+                    self.recolor(parent, True)
+                    self.rotateLeft(parent)
+                    w = self.child(parent, False)
+                if w.l.red == False and w.r.red == False:
+                    self.recolor(w, True)
+                    x = parent
+                else:
+                    if w.r.red == False:
+                        self.recolor(self.child(w, True), False)
+                        self.recolor(w, True)
+                        self.rotateRight(w)
+                        w = self.child(parent, False)
+                    self.recolor(w, parent.red)
+                    self.recolor(parent, False)
+                    self.recolor(self.child(w, False), False)
+                    self.rotateLeft(parent)
+                    x = self.work
+            else:
+                w = self.child(parent, True)
+                if w.red:
+                    self.recolor(w, False)
+                    self.recolor(parent, True)
+                    self.rotateRight(parent)
+                    w = self.child(parent, True)
+                if w.r.red == False and w.l.red == False:
+                    self.recolor(w, True)
+                    x = parent
+                else:
+                    if w.l.red == False:
+                        self.recolor(self.child(w, False), False)
+                        self.recolor(w, True)
+                        self.rotateLeft(w)
+                        w = self.child(parent, True)
+                    self.recolor(w, parent.red)
+                    self.recolor(parent, False)
+                    self.recolor(self.child(w, True), False)
+                    self.rotateRight(parent)
+                    x = self.work
+        self.recolor(self.own(x), False)
+    def transfer(self, u, v):
+        parent = self.parents[u]
+        if parent is None:
+            self.work = v
+        elif u == parent.l:
+            parent.l = v
+        else:
+            parent.r = v
+        self.parents[v] = parent
+    def removeRange(self, low, high):
+        # As RedBlackTree.removeRange, deleting one book at a time so each
+        # step is published as a version of its own
+        removed = [node.value for node in self.rangeSearch(low, high)]
+        for book in removed:
+            self.delete(book.bookId)
+        return removed
+    def editBook(self, node):
+        # Readers may be rendering node's book, so changes go to a copy
+        # linked into a new version of the path down to it. publishBook
+        # then shows readers every change at once.
+        self.begin()
+        bookId = node.value.bookId
+        current = self.work
+        path = [current]
+        while bookId != current.value.bookId:
+            current = self.child(current, bookId < current.value.bookId)
+            path.append(current)
+        self.editPath = path
+        self.replaced = current.value
+        current.value = current.value.copy()
+        return current.value
+    def publishBook(self):
+        replaced = self.replaced
+        self.editPath = []
+        self.replaced = None
+        self.publish()
+        return replaced
+    def setAvailability(self, node, availability):
+        # Change the availability of the book being edited, recounting the
+        # copied path above it
+        book = self.editPath[-1].value
+        change = (availability == AVAILABLE) - (book.availability == AVAILABLE)
+        book.availability = availability
+        if change:
+            for current in self.editPath:
+                current.available += change
+    def rangeSearch(self, low, high, skip=0):
+        # Walk the published version in order from the first node >= low, or
+        # the one skip places after it, keeping the nodes still to visit on a
+        # stack
+        stack = []
+        curr = self.root
+        if skip:
+            position = self.countBelow(curr, low) + skip
+            while curr != self.nil:
+                leftSize = curr.l.size
+                if position <= leftSize:
+                    stack.append(curr)
+                    if position == leftSize:
+                        break
+                    curr = curr.l
+                else:
+                    position -= leftSize + 1
+                    curr = curr.r
+        else:
+            while curr != self.nil:
+                if curr.value.bookId >= low:
+                    stack.append(curr)
+                    curr = curr.l
+                else:
+                    curr = curr.r
+        while stack:
+            node = stack.pop()
+            if node.value.bookId > high:
+                return
+            yield node
+            curr = node.r
+            while curr != self.nil:
+                stack.append(curr)
+                curr = curr.l
+    def inorder(self):
+        # Yield every node in order of bookId
+        return self.rangeSearch(float("-inf"), float("inf"))
+    def findMany(self, values):
+        # As RedBlackTree.findMany, in the published version. Without parent
+        # links the finger is the path down to the last node reached, each
+        # with the bookId its subtree ends below.
+        root = self.root
+        path = []
+        for value in values:
+            while path and path[-1][1] <= value:
+                path.pop()
+            node, high = path.pop() if path else (root, float("inf"))
+            while node != self.nil:
+                path.append((node, high))
+                if value == node.value.bookId:
+                    break
+                if value < node.value.bookId:
+                    high = node.value.bookId
+                    node = node.l
+                else:
+                    node = node.r
+            if path and path[-1][0].value.bookId == value:
+                yield path[-1][0]
+            else:
+                yield None
+    def nearest(self, targetId):
+        # As RedBlackTree.nearest, both cursors walking the published version
+        root = self.root
+        return self.walkDown(root, targetId), self.walkUp(root, targetId)
+    def walkDown(self, root, targetId):
+        # Nodes at or below targetId in descending order
+        stack = []
+        curr = root
+        while curr != self.nil:
+            if curr.value.bookId <= targetId:
+                stack.append(curr)
+                curr = curr.r
+            else:
+                curr = curr.l
+        while stack:
+            node = stack.pop()
+            yield node
+            curr = node.l
+            while curr != self.nil:
+                stack.append(curr)
+                curr = curr.r
+    def walkUp(self, root, targetId):
+        # Nodes above targetId in ascending order
+        stack = []
+        curr = root
+        while curr != self.nil:
+            if curr.value.bookId > targetId:
+                stack.append(curr)
+                curr = curr.l
+            else:
+                curr = curr.r
+        while stack:
+            node = stack.pop()
+            yield node
+            curr = node.r
+            while curr != self.nil:
+                stack.append(curr)
+                curr = curr.l
+    def loadPreorder(self, records):
+        # Rebuild the tree from preorder records, as produced by preorder(),
+        # without rebalancing. Returns the node values in preorder.
+        self.version += 1
+        nodes = []
+        root = self.nil
+        # Parents still waiting for a left ("l") or right ("r") child
+        pending = []
+        for value, red, hasLeft, hasRight in records:
+            node = PersistentNode(value, red, self.nil, self.nil, self.version, 1, 0)
+            if pending:
+                parent, side = pending.pop()
+                setattr(parent, side, node)
+            else:
+                root = node
+            if hasRight:
+                pending.append((node, "r"))
+            if hasLeft:
+                pending.append((node, "l"))
+            nodes.append(node)
+        # Children come after their parent in preorder
+        for node in reversed(nodes):
+            node.size = node.l.size + node.r.size + 1
+            node.available = node.l.available + node.r.available + (
+                node.value.availability == AVAILABLE
+            )
+        self.root = root
+        self.size = len(nodes)
+        return [node.value for node in nodes]
+    def build(self, values):
+        # Build a balanced tree from BookNodes sorted by unique bookId and
+        # publish it, colouring the deepest level red as RedBlackTree does
+        self.version += 1
+        redDepth = len(values).bit_length() - 1
+        def buildRange(lo, hi, depth):
+            if lo > hi:
+                return self.nil
+            mid = (lo + hi) // 2
+            l = buildRange(lo, mid - 1, depth + 1)
+            r = buildRange(mid + 1, hi, depth + 1)
+            return PersistentNode(
+                values[mid],
+                depth == redDepth and depth > 0,
+                l,
+                r,
+                self.version,
+                hi - lo + 1,
+                l.available + r.available + (values[mid].availability == AVAILABLE),
+            )
+        self.root = buildRange(0, len(values) - 1, 0)
+        self.size = len(values)
+        return values
+
+class CompactNode:
+    # Handle to one book in a CompactRedBlackTree. It stands in for both the
+    # RedBlackNode and its BookNode value, reading fields from the arrays, so
+    # the RedBlackTree algorithms run on the arrays unchanged.
+    __slots__ = ("tree", "index")
+    def __init__(self, tree, index):
+        self.tree = tree
+        self.index = index
+    def __eq__(self, other):
+        # Handles to the same slot refer to the same book
+        return (
+            other.__class__ is CompactNode
+            and self.index == other.index
+            and self.tree is other.tree
+        )
+    def __ne__(self, other):
+        return not (
+            other.__class__ is CompactNode
+            and self.index == other.index
+            and self.tree is other.tree
+        )
+    def __hash__(self):
+        return hash(self.index)
+    @property
+    def value(self):
+        return self
+    @property
+    def l(self):
+        return CompactNode(self.tree, self.tree.left[self.index])
+    @l.setter
+    def l(self, node):
+        self.tree.left[self.index] = node.index
+    @property
+    def r(self):
+        return CompactNode(self.tree, self.tree.right[self.index])
+    @r.setter
+    def r(self, node):
+        self.tree.right[self.index] = node.index
+    @property
+    def parent(self):
+        # None for the root, as for a RedBlackNode
+        parent = self.tree.parents[self.index]
+        if parent == -1:
+            return None
+        return CompactNode(self.tree, parent)
+    @parent.setter
+    def parent(self, node):
+        self.tree.parents[self.index] = -1 if node is None else node.index
+    @property
+    def red(self):
+        return self.tree.red[self.index]
+    @red.setter
+    def red(self, red):
+        self.tree.red[self.index] = red
+    @property
+    def size(self):
+        return self.tree.sizes[self.index]
+    @size.setter
+    def size(self, size):
+        self.tree.sizes[self.index] = size
+    @property
+    def available(self):
+        return self.tree.availableCounts[self.index]
+    @available.setter
+    def available(self, available):
+        self.tree.availableCounts[self.index] = available
+    @property
+    def bookId(self):
+        return self.tree.keys[self.index]
+    @property
+    def bookName(self):
+        return self.tree.bookNames[self.index]
+    @property
+    def authorName(self):
+        return self.tree.authorNames[self.index]
+    @property
+    def availability(self):
+        return self.tree.availabilities[self.index]
+    @availability.setter
+    def availability(self, availability):
+        self.tree.availabilities[self.index] = availability
+    @property
+    def borrowedBy(self):
+        return self.tree.borrowers[self.index]
+    @borrowedBy.setter
+    def borrowedBy(self, borrowedBy):
+        self.tree.borrowers[self.index] = borrowedBy
+    @property
+    def version(self):
+        return self.tree.versions[self.index]
+    @version.setter
+    def version(self, version):
+        self.tree.versions[self.index] = version
+    @property
+    def reservations(self):
+        return self.tree.reservationHeaps.get(self.index, EMPTY_RESERVATIONS)
+    def addReservation(self, patronId, priorityNumber):
+        # Allocate the reservation heap on the first reservation
+        if self.index not in self.tree.reservationHeaps:
+            self.tree.reservationHeaps[self.index] = BinaryMinHeap()
+        return BookNode.addReservation(self, patronId, priorityNumber)
+    getReservations = BookNode.getReservations
+
+class CompactRedBlackTree(RedBlackTree):
+    # RedBlackTree stored in parallel arrays indexed by node number. Nodes
+    # are CompactNode handles made on demand, so the balancing, colour flip
+    # counting and searches are RedBlackTree's own; this class manages the
+    # slots and walks the arrays directly on the hottest paths. Index 0 is the sentinel leaf and a parent of -1 marks the
+    # root.
+    def __init__(self):
+        self.keys = array("q", [0])
+        self.red = bytearray(1)
+        self.left = array("i", [0])
+        self.right = array("i", [0])
+        self.parents = array("i", [-1])
+        # Number of nodes, and of available books, in the subtree rooted at
+        # each node
+        self.sizes = array("i", [0])
+        self.availableCounts = array("i", [0])
+        self.bookNames = [None]
+        self.authorNames = [None]
+        self.availabilities = [None]
+        self.borrowers = [None]
+        self.versions = array("q", [0])
+        # Only books with a waitlist get a reservation heap
+        self.reservationHeaps = {}
+        # Slots of deleted nodes, reused by later inserts
+        self.free = []
+        self.nil = CompactNode(self, 0)
+        self.rootIndex = 0
+
+        # Track recoloring for balancing
+        self.colorFlipCount = 0
+        # Instrumentation, off unless instrument is called
+        self.stats = None
+        self.colorsBefore = {}
+        # Number of books stored in the tree
+        self.size = 0
+
+    @property
+    def root(self):
+        return CompactNode(self, self.rootIndex)
+    @root.setter
+    def root(self, node):
+        self.rootIndex = node.index
+    def newNode(self, value):
+        # Red leaf holding a BookNode's fields in a free slot. A handle to a
+        # book already in this tree keeps its slot, so handles to it stay
+        # valid when build relinks the tree.
+        if isinstance(value, CompactNode) and value.tree is self:
+            index = value.index
+            self.sizes[index] = 1
+            self.availableCounts[index] = 1 if self.availabilities[index] == AVAILABLE else 0
+        else:
+            index = self.storeBook(value)
+        self.red[index] = 1
+        self.left[index] = 0
+        self.right[index] = 0
+        self.parents[index] = -1
+        return CompactNode(self, index)
+    def storeBook(self, value):
+        # Copy a BookNode's fields into a free slot and return its index
+        availability = value.availability
+        if availability is not None:
+            availability = sys.intern(availability)
+        available = 1 if availability == AVAILABLE else 0
+        if self.free:
+            index = self.free.pop()
+            self.keys[index] = value.bookId
+            self.sizes[index] = 1
+            self.availableCounts[index] = available
+            self.bookNames[index] = value.bookName
+            self.authorNames[index] = value.authorName
+            self.availabilities[index] = availability
+            self.borrowers[index] = value.borrowedBy
+            self.versions[index] = value.version
+        else:
+            index = len(self.keys)
+            self.keys.append(value.bookId)
+            self.red.append(0)
+            self.left.append(0)
+            self.right.append(0)
+            self.parents.append(-1)
+            self.sizes.append(1)
+            self.availableCounts.append(available)
+            self.bookNames.append(value.bookName)
+            self.authorNames.append(value.authorName)
+            self.availabilities.append(availability)
+            self.borrowers.append(value.borrowedBy)
+            self.versions.append(value.version)
+        if value.reservations.heap:
+            self.reservationHeaps[index] = value.reservations
+        return index
+    def releaseNode(self, index):
+        # Drop a deleted node's payload and make its slot reusable
+        self.bookNames[index] = None
+        self.authorNames[index] = None
+        self.availabilities[index] = None
+        self.borrowers[index] = None
+        self.reservationHeaps.pop(index, None)
+        self.free.append(index)
+
+    def findIndex(self, value):
+        # Index of the node holding a bookId, or 0 if it is not in the tree.
+        # Every command starts with a lookup, so it reads the arrays directly.
+        keys, left, right = self.keys, self.left, self.right
+        curr = self.rootIndex
+        while curr != 0 and value != keys[curr]:
+            if value < keys[curr]:
+                curr = left[curr]
+            else:
+                curr = right[curr]
+        return curr
+    def successor(self, x):
+        # As RedBlackTree.successor, on the arrays; every range scan and
+        # in-order walk steps through it
+        left, right, parents = self.left, self.right, self.parents
+        index = x.index
+        if right[index] != 0:
+            index = right[index]
+            while left[index] != 0:
+                index = left[index]
+            return CompactNode(self, index)
+        parent = parents[index]
+        while parent != -1 and index == right[parent]:
+            index = parent
+            parent = parents[parent]
+        return None if parent == -1 else CompactNode(self, parent)
+    def uncount(self, removed, z):
+        # As RedBlackTree.uncount, on the arrays
+        parents, sizes, availableCounts = self.parents, self.sizes, self.availableCounts
+        left, right = self.left, self.right
+        removed, z = removed.index, z.index
+        lost = availableCounts[removed] - availableCounts[left[removed]] - availableCounts[right[removed]]
+        zAvailable = availableCounts[z] - availableCounts[left[z]] - availableCounts[right[z]]
+        node = parents[removed]
+        while node != -1:
+            if node == z:
+                lost = zAvailable
+            sizes[node] -= 1
+            availableCounts[node] -= lost
+            node = parents[node]
+    def countBelow(self, node, bookId):
+        # As RedBlackTree.countBelow, on the arrays
+        keys, left, right, sizes = self.keys, self.left, self.right, self.sizes
+        index = node.index
+        count = 0
+        while index != 0:
+            if keys[index] < bookId:
+                count += sizes[left[index]] + 1
+                index = right[index]
+            else:
+                index = left[index]
+        return count
+    def availableBelow(self, node, bookId):
+        # As RedBlackTree.availableBelow, on the arrays
+        keys, left, right = self.keys, self.left, self.right
+        availableCounts = self.availableCounts
+        index = node.index
+        count = 0
+        while index != 0:
+            if keys[index] < bookId:
+                count += availableCounts[index] - availableCounts[right[index]]
+                index = right[index]
+            else:
+                index = left[index]
+        return count
+    def instrument(self, stats):
+        # Record the path length of every find, and the rebalancing work, in
+        # stats
+        self.stats = stats
+        self.findIndex = self.findIndexCounted
+        self.countRotations()
+    def findIndexCounted(self, value):
+        # findIndex, counting the nodes passed on the way down
+        keys, left, right = self.keys, self.left, self.right
+        curr = self.rootIndex
+        steps = 0
+        while curr != 0 and value != keys[curr]:
+            steps += 1
+            if value < keys[curr]:
+                curr = left[curr]
+            else:
+                curr = right[curr]
+        self.stats.recordSearch(steps)
+        return curr
+    def find(self, value):
+        # Find Book in Tree
+        index = self.findIndex(value)
+        if index == 0:
+            return None
+        return CompactNode(self, index)
+    def insert(self, value):
+        # As RedBlackTree.insert, searching and counting on the arrays
+        keys, left, right, sizes = self.keys, self.left, self.right, self.sizes
+        availableCounts = self.availableCounts
+        key = value.bookId
+        parent = -1
+        current = self.rootIndex
+        available = 1 if value.availability == AVAILABLE else 0
+        while current != 0:
+            parent = current
+            sizes[current] += 1
+            availableCounts[current] += available
+            if key < keys[current]:
+                current = left[current]
+            elif key > keys[current]:
+                current = right[current]
+            else:
+                # Node already exists
+                while current != -1:
+                    sizes[current] -= 1
+                    availableCounts[current] -= available
+                    current = self.parents[current]
+                return
+        return self.addLeaf(value, None if parent == -1 else CompactNode(self, parent))
+    def delete(self, value):
+        # As RedBlackTree.delete, then frees the deleted node's slot
+        z = RedBlackTree.delete(self, value)
+        if z is not None:
+            self.releaseNode(z.index)
+        return z
+    def bookAt(self, index):
+        # BookNode copy of the book in a slot
+        book = BookNode(
+            self.keys[index],
+            self.bookNames[index],
+            self.authorNames[index],
+            self.availabilities[index],
+        )
+        book.borrowedBy = self.borrowers[index]
+        book.reservations = self.reservationHeaps.get(index, EMPTY_RESERVATIONS)
+        book.version = self.versions[index]
+        return book
+    def removeRange(self, low, high):
+        # As RedBlackTree.removeRange, copying the books out of their slots,
+        # which are then freed
+        removed = []
+        for node in RedBlackTree.removeRange(self, low, high):
+            removed.append(self.bookAt(node.index))
+            self.releaseNode(node.index)
+        return removed
+
+def balancedPreorder(books):
+    # (value, red, hasLeft, hasRight) records, in preorder, of the tree
+    # RedBlackTree.build makes from books sorted by bookId, so snapshots
+    # saved from any book index load into every other
+    redDepth = len(books).bit_length() - 1
+    stack = [(0, len(books) - 1, 0)] if books else []
+    while stack:
+        lo, hi, depth = stack.pop()
+        mid = (lo + hi) // 2
+        yield books[mid], depth == redDepth and depth > 0, mid > lo, mid < hi
+        if mid < hi:
+            stack.append((mid + 1, hi, depth + 1))
+        if mid > lo:
+            stack.append((lo, mid - 1, depth + 1))
+
+class OrderedIndex:
+    # Shared parts of the book indexes that are not red-black trees. They
+    # store BookNodes as their own nodes; subclasses provide find, insert,
+    # delete, build, rank, select, availableRank, selectAvailable,
+    # setAvailability, ascend, descend, rangeSearch and height. Nothing is
+    # recoloured, so colorFlipCount stays 0.
+    def __init__(self):
+        self.colorFlipCount = 0
+        # Number of books stored in the index
+        self.size = 0
+        self.stats = None
+    def instrument(self, stats):
+        # Record the levels passed by every find in stats
+        self.stats = stats
+        self.find = self.findCounted
+    def editBook(self, node):
+        # Book of node to change, followed by publishBook once done
+        return node
+    def publishBook(self):
+        # Returns the book the edited one replaced, None if edited in place
+        return None
+    def findMany(self, values):
+        return map(self.find, values)
+    def count(self, low, high):
+        # Number of books with low <= bookId <= high
+        if low > high:
+            return 0
+        return self.rank(high + 1) - self.rank(low)
+    def countAvailable(self, low, high):
+        # Number of available books with low <= bookId <= high
+        if low > high:
+            return 0
+        return self.availableRank(high + 1) - self.availableRank(low)
+    def nextAvailable(self, bookId):
+        # First available book with a bookId at or above bookId, or None
+        return self.selectAvailable(self.availableRank(bookId))
+    def closestAvailable(self, targetId):
+        # Nearest available books at or below and at or above targetId
+        position = self.availableRank(targetId)
+        higher = self.selectAvailable(position)
+        if higher is not None and higher.bookId == targetId:
+            return higher, higher
+        lower = self.selectAvailable(position - 1) if position else None
+        return lower, higher
+    def closest(self, targetId):
+        # Nearest books at or below and at or above targetId
+        position = self.rank(targetId)
+        higher = self.select(position)
+        if higher is not None and higher.bookId == targetId:
+            return higher, higher
+        lower = self.select(position - 1) if position else None
+        return lower, higher
+    def nearest(self, targetId):
+        # Books at or below targetId in descending order, and those above it
+        # in ascending order
+        position = self.rank(targetId + 1)
+        below = self.descend(position - 1) if position else iter(())
+        return below, self.ascend(position)
+    def inorder(self):
+        return self.ascend(0)
+    def removeRange(self, low, high):
+        # Take the books with low <= bookId <= high out one at a time and
+        # return them in order
+        removed = list(self.rangeSearch(low, high))
+        for book in removed:
+            self.delete(book.bookId)
+        return removed
+    def preorder(self):
+        return balancedPreorder(list(self.inorder()))
+    def loadPreorder(self, records):
+        # Rebuild from preorder records of any tree shape. Returns the books
+        # in record order.
+        values = [record[0] for record in records]
+        self.build(sorted(values, key=lambda value: value.bookId))
+        return values
+    def bulkLoad(self, values):
+        # As RedBlackTree.bulkLoad: rebuild in linear time when the batch is
+        # at least as large as the index. Returns the BookNodes that were
+        # added.
+        values = sorted(values, key=lambda value: value.bookId)
+        if len(values) < self.size:
+            return [value for value in values if self.insert(value) is not None]
+        merged = []
+        added = []
+        existing = list(self.inorder())
+        i = j = 0
+        while i < len(existing) or j < len(values):
+            # Books already in the index win over the batch, as with insert
+            if j == len(values) or (
+                i < len(existing) and existing[i].bookId <= values[j].bookId
+            ):
+                value = existing[i]
+                i += 1
+            else:
+                value = values[j]
+                j += 1
+                if merged and merged[-1].bookId == value.bookId:
+                    continue
+                added.append(value)
+            if not merged or merged[-1].bookId != value.bookId:
+                merged.append(value)
+        self.build(merged)
+        return added
+
+class BTreeNode:
+    __slots__ = ("ids", "books", "children", "size", "available")
+    def __init__(self, ids, books, children):
+        # Sorted bookIds with their books, and no children for a leaf
+        self.ids = ids
+        self.books = books
+        self.children = children
+        self.recount()
+    def recount(self):
+        # Number of books, and of available books, in the subtree rooted here
+        self.size = len(self.books) + sum(child.size for child in self.children)
+        self.available = sum(
+            1 for book in self.books if book.availability == AVAILABLE
+        ) + sum(child.available for child in self.children)
+
+class BTreeIndex(OrderedIndex):
+    # In-memory B-tree. Wide nodes searched with bisect visit far fewer
+    # objects per lookup than a binary tree. Inserts split full nodes and
+    # deletes refill thin ones on the way down, so each change is a single
+    # pass from the root.
+    # Fewest children of a node other than the root. Nodes hold up to
+    # 2 * MIN_DEGREE - 1 books.
+    MIN_DEGREE = 32
+    def __init__(self):
+        super().__init__()
+        self.root = BTreeNode([], [], [])
+    def find(self, value):
+        node = self.root
+        while True:
+            ids = node.ids
+            i = bisect_left(ids, value)
+            if i < len(ids) and ids[i] == value:
+                return node.books[i]
+            if not node.children:
+                return None
+            node = node.children[i]
+    def findCounted(self, value):
+        # find, counting the nodes passed on the way down
+        node = self.root
+        steps = 0
+        while True:
+            ids = node.ids
+            i = bisect_left(ids, value)
+            found = i < len(ids) and ids[i] == value
+            if found or not node.children:
+                self.stats.recordSearch(steps)
+                return node.books[i] if found else None
+            steps += 1
+            node = node.children[i]
+    def insert(self, value):
+        maxBooks = 2 * self.MIN_DEGREE - 1
+        if len(self.root.ids) == maxBooks:
+            self.root = BTreeNode([], [], [self.root])
+            self.splitChild(self.root, 0)
+        bookId = value.bookId
+        node = self.root
+        # Nodes that gain the book, counted once it is placed
+        path = [node]
+        while True:
+            ids = node.ids
+            i = bisect_left(ids, bookId)
+            if i < len(ids) and ids[i] == bookId:
+                # Book already exists
+                return
+            if not node.children:
+                ids.insert(i, bookId)
+                node.books.insert(i, value)
+                break
+            if len(node.children[i].ids) == maxBooks:
+                self.splitChild(node, i)
+                continue
+            node = node.children[i]
+            path.append(node)
+        available = 1 if value.availability == AVAILABLE else 0
+        for node in path:
+            node.size += 1
+            node.available += available
+        self.size += 1
+        return value
+    def splitChild(self, parent, i):
+        # Split parent's full child i around its middle book, which moves up
+        t = self.MIN_DEGREE
+        child = parent.children[i]
+        right = BTreeNode(child.ids[t:], child.books[t:], child.children[t:])
+        parent.ids.insert(i, child.ids[t - 1])
+        parent.books.insert(i, child.books[t - 1])
+        parent.children.insert(i + 1, right)
+        del child.ids[t - 1 :], child.books[t - 1 :], child.children[t:]
+        child.recount()
+    def delete(self, value):
+        book = self.find(value)
+        if book is None:
+            return
+        t = self.MIN_DEGREE
+        node = self.root
+        # Every node entered loses one book: the deleted one or, below the
+        # node holding it, the neighbour moved up in its place
+        while True:
+            node.size -= 1
+            node.available -= book.availability == AVAILABLE
+            ids = node.ids
+            i = bisect_left(ids, book.bookId)
+            if not node.children:
+                del ids[i], node.books[i]
+                break
+            if i < len(ids) and ids[i] == book.bookId:
+                left, right = node.children[i], node.children[i + 1]
+                if len(left.ids) >= t:
+                    # Replace the book with its predecessor
+                    neighbour = left
+                    while neighbour.children:
+                        neighbour = neighbour.children[-1]
+                    book = neighbour.books[-1]
+                    ids[i] = book.bookId
+                    node.books[i] = book
+                    node = left
+                elif len(right.ids) >= t:
+                    # Replace the book with its successor
+                    neighbour = right
+                    while neighbour.children:
+                        neighbour = neighbour.children[0]
+                    book = neighbour.books[0]
+                    ids[i] = book.bookId
+                    node.books[i] = book
+                    node = right
+                else:
+                    self.merge(node, i)
+                    node = left
+                continue
+            if len(node.children[i].ids) < t:
+                i = self.refill(node, i)
+            node = node.children[i]
+        if not self.root.ids and self.root.children:
+            self.root = self.root.children[0]
+        self.size -= 1
+    def refill(self, node, i):
+        # Give node's child i more than the fewest books before a delete
+        # enters it, from a sibling or by merging with one. Returns the
+        # child's position afterwards.
+        t = self.MIN_DEGREE
+        children = node.children
+        child = children[i]
+        if i > 0 and len(children[i - 1].ids) >= t:
+            sibling = children[i - 1]
+            child.ids.insert(0, node.ids[i - 1])
+            child.books.insert(0, node.books[i - 1])
+            node.ids[i - 1] = sibling.ids.pop()
+            node.books[i - 1] = sibling.books.pop()
+            if sibling.children:
+                child.children.insert(0, sibling.children.pop())
+        elif i < len(node.ids) and len(children[i + 1].ids) >= t:
+            sibling = children[i + 1]
+            child.ids.append(node.ids[i])
+            child.books.append(node.books[i])
+            node.ids[i] = sibling.ids.pop(0)
+            node.books[i] = sibling.books.pop(0)
+            if sibling.children:
+                child.children.append(sibling.children.pop(0))
+        else:
+            if i == len(node.ids):
+                i -= 1
+            self.merge(node, i)
+            return i
+        sibling.recount()
+        child.recount()
+        return i
+    def merge(self, node, i):
+        # Merge node's child i + 1, and the book between them, into child i
+        left, right = node.children[i], node.children.pop(i + 1)
+        left.ids.append(node.ids.pop(i))
+        left.books.append(node.books.pop(i))
+        left.ids += right.ids
+        left.books += right.books
+        left.children += right.children
+        left.recount()
+    def rank(self, bookId):
+        # Number of books with a bookId below bookId
+        count = 0
+        node = self.root
+        while True:
+            i = bisect_left(node.ids, bookId)
+            count += i
+            if not node.children:
+                return count
+            count += sum(child.size for child in node.children[:i])
+            node = node.children[i]
+    def availableRank(self, bookId):
+        # Number of available books with a bookId below bookId
+        count = 0
+        node = self.root
+        while True:
+            i = bisect_left(node.ids, bookId)
+            count += sum(1 for book in node.books[:i] if book.availability == AVAILABLE)
+            if not node.children:
+                return count
+            count += sum(child.available for child in node.children[:i])
+            node = node.children[i]
+    def select(self, position):
+        # Book with position books before it, or None if there is none
+        if position < 0:
+            return None
+        node = self.root
+        while node.children:
+            for j, child in enumerate(node.children):
+                if position < child.size:
+                    node = child
+                    break
+                position -= child.size
+                if j == len(node.books):
+                    return None
+                if position == 0:
+                    return node.books[j]
+                position -= 1
+        return node.books[position] if position < len(node.books) else None
+    def selectAvailable(self, position):
+        # Available book with position available books before it, or None.
+        # Subtrees with every book borrowed are stepped over whole.
+        if position < 0:
+            return None
+        node = self.root
+        while True:
+            books = node.books
+            if not node.children:
+                for book in books:
+                    if book.availability == AVAILABLE:
+                        if position == 0:
+                            return book
+                        position -= 1
+                return None
+            for j, child in enumerate(node.children):
+                if position < child.available:
+                    node = child
+                    break
+                position -= child.available
+                if j == len(books):
+                    return None
+                if books[j].availability == AVAILABLE:
+                    if position == 0:
+                        return books[j]
+                    position -= 1
+    def setAvailability(self, node, availability):
+        # Change a book's availability, recounting the nodes on its path
+        change = (availability == AVAILABLE) - (node.availability == AVAILABLE)
+        node.availability = availability
+        bookId = node.bookId
+        current = self.root
+        while change:
+            current.available += change
+            i = bisect_left(current.ids, bookId)
+            if i < len(current.ids) and current.ids[i] == bookId:
+                return
+            current = current.children[i]
+    def ascend(self, position):
+        # Books in ascending order from the one with position books before
+        # it. A stack entry (node, i) means node.books[i] comes next, once
+        # everything above it on the stack is done.
+        stack = []
+        node = self.root
+        while node is not None:
+            if not node.children:
+                stack.append((node, position))
+                break
+            below = None
+            for j, child in enumerate(node.children):
+                if position < child.size:
+                    stack.append((node, j))
+                    below = child
+                    break
+                position -= child.size
+                if j == len(node.books):
+                    break
+                if position == 0:
+                    stack.append((node, j))
+                    break
+                position -= 1
+            node = below
+        while stack:
+            node, i = stack.pop()
+            if i >= len(node.books):
+                continue
+            yield node.books[i]
+            stack.append((node, i + 1))
+            if node.children:
+                child = node.children[i + 1]
+                while child is not None:
+                    stack.append((child, 0))
+                    child = child.children[0] if child.children else None
+    def descend(self, position):
+        # Books in descending order from the one with position books before
+        # it. A stack entry (node, i) means node.books[i] comes next, once
+        # everything above it on the stack is done.
+        stack = []
+        node = self.root
+        while node is not None:
+            if not node.children:
+                stack.append((node, min(position, len(node.books) - 1)))
+                break
+            below = None
+            for j, child in enumerate(node.children):
+                if position < child.size:
+                    stack.append((node, j - 1))
+                    below = child
+                    break
+                position -= child.size
+                if j == len(node.books):
+                    stack.append((node, j - 1))
+                    break
+                if position == 0:
+                    stack.append((node, j))
+                    break
+                position -= 1
+            node = below
+        while stack:
+            node, i = stack.pop()
+            if i < 0:
+                continue
+            yield node.books[i]
+            stack.append((node, i - 1))
+            if node.children:
+                child = node.children[i]
+                while child is not None:
+                    stack.append((child, len(child.books) - 1))
+                    child = child.children[-1] if child.children else None
+    def rangeSearch(self, low, high, skip=0):
+        for book in self.ascend(self.rank(low) + skip):
+            if book.bookId > high:
+                return
+            yield book
+    def height(self):
+        # Number of nodes on a path from the root to a leaf
+        if self.size == 0:
+            return 0
+        levels = 1
+        node = self.root
+        while node.children:
+            levels += 1
+            node = node.children[0]
+        return levels
+    def build(self, values):
+        # Build from BookNodes sorted by unique bookId, bottom up: the leaves
+        # first, then each level over the one below with the books between
+        # its nodes as separators. Nodes of a level are filled evenly.
+        maxBooks = 2 * self.MIN_DEGREE - 1
+        count = (len(values) + maxBooks + 1) // (maxBooks + 1)
+        base, extra = divmod(len(values) - count + 1, count)
+        nodes = []
+        separators = []
+        position = 0
+        for k in range(count):
+            end = position + base + (k < extra)
+            books = values[position:end]
+            nodes.append(BTreeNode([book.bookId for book in books], books, []))
+            if k < count - 1:
+                separators.append(values[end])
+            position = end + 1
+        while len(nodes) > 1:
+            count = (len(nodes) + maxBooks) // (maxBooks + 1)
+            base, extra = divmod(len(nodes), count)
+            parents = []
+            parentSeparators = []
+            position = 0
+            for k in range(count):
+                end = position + base + (k < extra)
+                books = separators[position : end - 1]
+                parents.append(
+                    BTreeNode([book.bookId for book in books], books, nodes[position:end])
+                )
+                if k < count - 1:
+                    parentSeparators.append(separators[end - 1])
+                position = end
+            nodes, separators = parents, parentSeparators
+        self.root = nodes[0]
+        self.size = len(values)
+
+class FenwickTree:
+    # Prefix sums over a list of counts, each count changed and each sum
+    # taken in O(log n)
+    def __init__(self, counts=()):
+        tree = [0]
+        tree.extend(counts)
+        for i in range(1, len(tree)):
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self.tree = tree
+    def add(self, index, change):
+        tree = self.tree
+        index += 1
+        while index < len(tree):
+            tree[index] += change
+            index += index & -index
+    def prefix(self, count):
+        # Sum of the first count counts
+        tree = self.tree
+        total = 0
+        while count:
+            total += tree[count]
+            count &= count - 1
+        return total
+    def find(self, position):
+        # (index, position within it) of the count that position falls in,
+        # counting from 0 across all of them, or (number of counts, what is
+        # left over) past the end
+        tree = self.tree
+        index = 0
+        step = 1 << (len(tree) - 1).bit_length()
+        while step:
+            following = index + step
+            if following < len(tree) and tree[following] <= position:
+                index = following
+                position -= tree[following]
+            step >>= 1
+        return index, position
+
+class SortedArrayIndex(OrderedIndex):
+    # Books in sorted blocks of bounded size, found by bisecting the last
+    # bookId of each block and then the block, so lookups and scans touch a
+    # few flat lists and an insert or delete only shifts one block
+    BLOCK_SIZE = 512
+    def __init__(self):
+        super().__init__()
+        self.idBlocks = []
+        self.blocks = []
+        # Last bookId, and number of available books, of each block
+        self.maxes = []
+        self.availableCounts = []
+        # Prefix sums of the block sizes and available counts, rebuilt when
+        # blocks are added or removed
+        self.blockSizes = FenwickTree()
+        self.blockAvailable = FenwickTree()
+    def recount(self):
+        self.blockSizes = FenwickTree(map(len, self.idBlocks))
+        self.blockAvailable = FenwickTree(self.availableCounts)
+    def locate(self, bookId):
+        # (block, position) where bookId is or would be inserted
+        block = bisect_left(self.maxes, bookId)
+        if block == len(self.maxes):
+            block -= 1
+        return block, bisect_left(self.idBlocks[block], bookId)
+    def find(self, value):
+        if not self.blocks:
+            return None
+        block, i = self.locate(value)
+        ids = self.idBlocks[block]
+        if i < len(ids) and ids[i] == value:
+            return self.blocks[block][i]
+        return None
+    def findCounted(self, value):
+        # find, counting the block as one step below the directory
+        self.stats.recordSearch(1 if self.blocks else 0)
+        return SortedArrayIndex.find(self, value)
+    def insert(self, value):
+        bookId = value.bookId
+        available = 1 if value.availability == AVAILABLE else 0
+        if not self.blocks:
+            self.idBlocks.append([bookId])
+            self.blocks.append([value])
+            self.maxes.append(bookId)
+            self.availableCounts.append(available)
+            self.size = 1
+            self.recount()
+            return value
+        block, i = self.locate(bookId)
+        ids = self.idBlocks[block]
+        if i < len(ids) and ids[i] == bookId:
+            # Book already exists
+            return
+        ids.insert(i, bookId)
+        self.blocks[block].insert(i, value)
+        self.maxes[block] = ids[-1]
+        self.availableCounts[block] += available
+        self.size += 1
+        if len(ids) > 2 * self.BLOCK_SIZE:
+            self.splitBlock(block)
+        else:
+            self.blockSizes.add(block, 1)
+            if available:
+                self.blockAvailable.add(block, 1)
+        return value
+    def splitBlock(self, block):
+        # Split an overgrown block in half
+        ids, books = self.idBlocks[block], self.blocks[block]
+        half = len(ids) // 2
+        upperAvailable = sum(1 for book in books[half:] if book.availability == AVAILABLE)
+        self.idBlocks[block : block + 1] = [ids[:half], ids[half:]]
+        self.blocks[block : block + 1] = [books[:half], books[half:]]
+        self.maxes[block : block + 1] = [ids[half - 1], ids[-1]]
+        self.availableCounts[block : block + 1] = [
+            self.availableCounts[block] - upperAvailable,
+            upperAvailable,
+        ]
+        self.recount()
+    def delete(self, value):
+        if not self.blocks:
+            return
+        block, i = self.locate(value)
+        ids = self.idBlocks[block]
+        if i == len(ids) or ids[i] != value:
+            return
+        book = self.blocks[block].pop(i)
+        del ids[i]
+        available = 1 if book.availability == AVAILABLE else 0
+        self.availableCounts[block] -= available
+        self.size -= 1
+        if ids:
+            self.maxes[block] = ids[-1]
+            self.blockSizes.add(block, -1)
+            if available:
+                self.blockAvailable.add(block, -1)
+        else:
+            del self.idBlocks[block], self.blocks[block]
+            del self.maxes[block], self.availableCounts[block]
+            self.recount()
+    def rank(self, bookId):
+        # Number of books with a bookId below bookId
+        if not self.blocks:
+            return 0
+        block, i = self.locate(bookId)
+        return self.blockSizes.prefix(block) + i
+    def availableRank(self, bookId):
+        # Number of available books with a bookId below bookId
+        if not self.blocks:
+            return 0
+        block, i = self.locate(bookId)
+        return self.blockAvailable.prefix(block) + sum(
+            1 for book in self.blocks[block][:i] if book.availability == AVAILABLE
+        )
+    def position(self, position):
+        # (block, position in it) of the book with position books before it,
+        # or (number of blocks, 0) past the last book
+        block, position = self.blockSizes.find(position)
+        if block == len(self.idBlocks):
+            return block, 0
+        return block, position
+    def select(self, position):
+        # Book with position books before it, or None if there is none
+        if position < 0:
+            return None
+        block, i = self.position(position)
+        if block == len(self.blocks):
+            return None
+        return self.blocks[block][i]
+    def closest(self, targetId):
+        # Nearest books at or below and at or above targetId, found from the
+        # block targetId falls in rather than by rank
+        if not self.blocks:
+            return None, None
+        block, i = self.locate(targetId)
+        books = self.blocks[block]
+        higher = books[i] if i < len(books) else None
+        if higher is not None and higher.bookId == targetId:
+            return higher, higher
+        if i:
+            lower = books[i - 1]
+        else:
+            lower = self.blocks[block - 1][-1] if block else None
+        return lower, higher
+    def selectAvailable(self, position):
+        # Available book with position available books before it, or None.
+        # The available counts find its block, which is then scanned.
+        if position < 0:
+            return None
+        block, position = self.blockAvailable.find(position)
+        if block == len(self.blocks):
+            return None
+        for book in self.blocks[block]:
+            if book.availability == AVAILABLE:
+                if position == 0:
+                    return book
+                position -= 1
+    def setAvailability(self, node, availability):
+        # Change a book's availability, recounting its block
+        change = (availability == AVAILABLE) - (node.availability == AVAILABLE)
+        node.availability = availability
+        if change:
+            block = self.locate(node.bookId)[0]
+            self.availableCounts[block] += change
+            self.blockAvailable.add(block, change)
+    def ascend(self, position):
+        # Books in ascending order from the one with position books before it
+        return self.ascendFrom(*self.position(position))
+    def ascendFrom(self, block, i):
+        blocks = self.blocks
+        if block < len(blocks):
+            yield from islice(blocks[block], i, None)
+            for books in islice(blocks, block + 1, None):
+                yield from books
+    def descend(self, position):
+        # Books in descending order from the one with position books before
+        # it
+        block, i = self.position(position)
+        blocks = self.blocks
+        if block < len(blocks):
+            yield from reversed(blocks[block][: i + 1])
+            for block in range(block - 1, -1, -1):
+                yield from reversed(blocks[block])
+    def rangeSearch(self, low, high, skip=0):
+        if not self.blocks:
+            return
+        if skip:
+            books = self.ascend(self.rank(low) + skip)
+        else:
+            books = self.ascendFrom(*self.locate(low))
+        for book in books:
+            if book.bookId > high:
+                return
+            yield book
+    def height(self):
+        # Levels searched: the directory of block maxes, then a block
+        return 2 if self.blocks else 0
+    def build(self, values):
+        # Cut BookNodes sorted by unique bookId into blocks
+        size = self.BLOCK_SIZE
+        self.blocks = [values[i : i + size] for i in range(0, len(values), size)]
+        self.idBlocks = [[book.bookId for book in books] for books in self.blocks]
+        self.maxes = [ids[-1] for ids in self.idBlocks]
+        self.availableCounts = [
+            sum(1 for book in books if book.availability == AVAILABLE)
+            for books in self.blocks
+        ]
+        self.size = len(values)
+        self.recount()
+
+# Ordered indexes LibrarySystem can keep its books in, by --backend name
+BOOK_INDEXES = {
+    "redblack": RedBlackTree,
+    "btree": BTreeIndex,
+    "sortedarray": SortedArrayIndex,
+}
+
+class BinaryMinHeap:
+    # Reservations ordered by (priority, timestamp), indexed by patron so an
+    # entry can be cancelled or reprioritised in O(log n)
+    def __init__(self, stats=None):
         self.heap = []
+        # Position of each patron's entry in heap
+        self.positions = {}
+        # Stats that count the swaps made while sifting, if enabled
+        self.stats = stats
+    def copy(self):
+        heap = BinaryMinHeap(self.stats)
+        heap.heap = list(self.heap)
+        heap.positions = dict(self.positions)
+        return heap
     def __iter__(self):
         return iter(self.heap)
+    def __len__(self):
+        return len(self.heap)
+    def __contains__(self, patronId):
+        return patronId in self.positions
     def insert(self, element):
+        self.positions[element[1]] = len(self.heap)
         self.heap.append(element)
         self.heapifyUp(len(self.heap) - 1)
+    def load(self, elements):
+        # Replace the contents with (priority, patronId, timestamp) entries
+        self.heap = list(elements)
+        self.positions = {entry[1]: index for index, entry in enumerate(self.heap)}
+        for index in reversed(range(len(self.heap) // 2)):
+            self.heapifyDown(index)
     def pop(self):
-        if not self.heap:
-            return None
-        if len(self.heap) == 1:
-            return self.heap.pop()
-        top = self.heap[0]
-        self.heap[0] = self.heap.pop()
-        self.heapifyDown()
-        return top
+        return self.removeMin()
     def heapifyUp(self, currentIndex):
         #Heapify Up: Reorganizes the heap after inserting an element
         while currentIndex > 0:
@@ -375,19 +2540,43 @@ class BinaryMinHeap:
             else:
                 break
     def swap(self, i, j):
+        if self.stats is not None:
+            self.stats.siftSteps += 1
         self.heap[i], self.heap[j] = self.heap[j], self.heap[i]
+        self.positions[self.heap[i][1]] = i
+        self.positions[self.heap[j][1]] = j
     def removeMin(self):
         if not self.heap:
             return None
-        minElement = self.heap[0]
+        return self.removeAt(0)
+    def removeAt(self, index):
+        # Remove the entry at index, moving the last entry into its place
+        element = self.heap[index]
+        del self.positions[element[1]]
         last_element = self.heap.pop()
-        if self.heap:
-            self.heap[0] = last_element
-            self.heapifyDown()
-        return minElement
-    def heapifyDown(self):
+        if index < len(self.heap):
+            self.heap[index] = last_element
+            self.positions[last_element[1]] = index
+            self.heapifyUp(index)
+            self.heapifyDown(self.positions[last_element[1]])
+        return element
+    def remove(self, patronId):
+        # Cancel a patron's reservation, returning it or None if absent
+        index = self.positions.get(patronId)
+        if index is None:
+            return None
+        return self.removeAt(index)
+    def updatePriority(self, patronId, priorityNumber):
+        # Change a patron's priority, keeping their original timestamp
+        index = self.positions.get(patronId)
+        if index is None:
+            return False
+        self.heap[index] = (priorityNumber, patronId, self.heap[index][2])
+        self.heapifyUp(index)
+        self.heapifyDown(self.positions[patronId])
+        return True
+    def heapifyDown(self, currentIndex=0):
         # Heapify Down: Adjusts the heap after removing the root element
-        currentIndex = 0
         while True:
             leftChildInd = 2 * currentIndex + 1
             rightChildInd = 2 * currentIndex + 2
@@ -414,56 +2603,484 @@ class BinaryMinHeap:
             else:
                 break
 
-class LibrarySystem:
+class SortedBlockList:
+    # Sorted list split into blocks of bounded size, so an insert or remove
+    # only shifts one block. maxes holds the last item of each block. Blocks
+    # split when they pass twice BLOCK_SIZE and join a neighbour when they
+    # fall under half of it.
+    BLOCK_SIZE = 512
+    def __init__(self, items=(), presorted=False):
+        items = list(items) if presorted else sorted(items)
+        size = self.BLOCK_SIZE
+        self.blocks = [items[i : i + size] for i in range(0, len(items), size)]
+        self.maxes = [block[-1] for block in self.blocks]
+        self.size = len(items)
+    def __len__(self):
+        return self.size
+    def add(self, item):
+        if not self.blocks:
+            self.blocks.append([item])
+            self.maxes.append(item)
+            self.size = 1
+            return
+        i = bisect_left(self.maxes, item)
+        if i == len(self.maxes):
+            i -= 1
+        block = self.blocks[i]
+        insort(block, item)
+        self.maxes[i] = block[-1]
+        self.size += 1
+        if len(block) > 2 * self.BLOCK_SIZE:
+            # Split an overgrown block in half
+            half = len(block) // 2
+            self.blocks[i : i + 1] = [block[:half], block[half:]]
+            self.maxes[i : i + 1] = [block[half - 1], block[-1]]
+    def remove(self, item):
+        # Remove one copy of item, returning whether it was present
+        i = bisect_left(self.maxes, item)
+        if i == len(self.maxes):
+            return False
+        block = self.blocks[i]
+        j = bisect_left(block, item)
+        if block[j] != item:
+            return False
+        del block[j]
+        self.size -= 1
+        if len(block) < self.BLOCK_SIZE // 2 and len(self.blocks) > 1:
+            # Join the shrunken block and its neighbour, splitting them again
+            # in half if together they overgrow
+            if i == len(self.blocks) - 1:
+                i -= 1
+            joined = self.blocks[i] + self.blocks[i + 1]
+            if len(joined) > 2 * self.BLOCK_SIZE:
+                half = len(joined) // 2
+                self.blocks[i : i + 2] = [joined[:half], joined[half:]]
+                self.maxes[i : i + 2] = [joined[half - 1], joined[-1]]
+            else:
+                self.blocks[i : i + 2] = [joined]
+                self.maxes[i : i + 2] = [joined[-1]]
+        elif block:
+            self.maxes[i] = block[-1]
+        else:
+            del self.blocks[i]
+            del self.maxes[i]
+        return True
+    def __iter__(self):
+        for block in self.blocks:
+            yield from block
+    def irange(self, low):
+        # Yield items >= low in order
+        i = bisect_left(self.maxes, low)
+        if i == len(self.maxes):
+            return
+        block = self.blocks[i]
+        yield from block[bisect_left(block, low) :]
+        for block in self.blocks[i + 1 :]:
+            yield from block
+
+def unquote(text):
+    # Strip the double quotes command arguments carry around names
+    if len(text) >= 2 and text[0] == '"' and text[-1] == '"':
+        return text[1:-1]
+    return text
+
+# Rendered book details kept by a library's details cache
+DETAILS_CACHE_SIZE = 4096
+
+class DetailsCache:
+    # Least recently used book details keyed by bookId. Each entry keeps the
+    # book version it was rendered from, so a book that changed since misses
+    # and is rendered again. Versions are never reused, so an entry a reader
+    # stores for a book deleted meanwhile cannot match a book inserted again
+    # under the same bookId.
+    # Server reader threads share the cache, so changes to it hold a lock.
+    def __init__(self, size=DETAILS_CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+    def get(self, book):
+        bookId = book.bookId
+        version = book.version
+        with self.lock:
+            entry = self.entries.get(bookId)
+            if entry is not None and entry[0] == version:
+                self.hits += 1
+                self.entries.move_to_end(bookId)
+                return entry[1]
+            self.misses += 1
+        # Rendered outside the lock; books readers hold are never changed
+        details = formatBook(book)
+        with self.lock:
+            self.entries[bookId] = (version, details)
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return details
+    def discard(self, bookId):
+        with self.lock:
+            self.entries.pop(bookId, None)
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+def formatBook(book):
+    patron_ids = [patronId[1] for patronId in book.reservations.heap]
+    return (
+        f"BookID = {book.bookId}\n"
+        f"Title = {book.bookName}\n"
+        f"Author = {book.authorName}\n"
+        f"Availability = {book.availability}\n"
+        f"BorrowedBy = {book.borrowedBy}\n"
+        f"Reservations = {patron_ids}"
+    )
+
+class BookOutput:
+    # Books a command reports, encoded by the library's output format when
+    # the result is written rather than rendered as text up front. In text,
+    # a listing puts a blank line after each book, and scanned books are
+    # not added to the details cache.
+    __slots__ = ("books", "listing", "scanned")
+    def __init__(self, books, listing=True, scanned=False):
+        self.books = books
+        self.listing = listing
+        self.scanned = scanned
+
+class TextOutput:
+    # The original output: book details as "Field = value" lines and each
+    # result followed by two blank lines
+    binary = False
+    extension = ".txt"
+    def __init__(self, library):
+        self.library = library
+    def bookDetails(self, output):
+        if output.scanned:
+            return self.library.scanDetails(output.books)
+        return map(self.library.details.get, output.books)
+    def render(self, output):
+        # Text of a command's output, None staying None
+        if output.__class__ is BookOutput:
+            if output.listing:
+                return "\n".join([f"{book}\n" for book in self.bookDetails(output)])
+            return "".join(self.bookDetails(output))
+        if output.__class__ is list:
+            return batchOutput([self.render(item) for item in output])
+        return output
+    def result(self, opcode, output):
+        return f"{self.render(output)}\n\n\n"
+    def writeResult(self, opcode, output, write):
+        # Pass a command's result to write, a listing book by book rather
+        # than joined into one string, which a wide PrintBooks would make
+        # as large as the range
+        if output.__class__ is BookOutput and output.listing:
+            separator = ""
+            for book in self.bookDetails(output):
+                write(f"{separator}{book}\n")
+                separator = "\n"
+            write("\n\n\n")
+        else:
+            write(self.result(opcode, output))
+    def invalid(self, lineNumber, message):
+        return f"Invalid command on line {lineNumber}: {message}\n\n\n"
+    def quit(self):
+        return "Program Terminated!!\n"
+
+class JsonLinesOutput:
+    # One JSON object per line for each result: the command and its books,
+    # message, or per-book results for batch commands
+    binary = False
+    extension = ".jsonl"
+    def __init__(self, library):
+        self.library = library
+    def book(self, book):
+        return {
+            "bookId": book.bookId,
+            "title": unquote(book.bookName),
+            "author": unquote(book.authorName),
+            "availability": unquote(book.availability),
+            "borrowedBy": book.borrowedBy,
+            "reservations": [entry[1] for entry in book.reservations.heap],
+        }
+    def record(self, output):
+        if isinstance(output, BookOutput):
+            return {"books": [self.book(book) for book in output.books]}
+        if isinstance(output, list):
+            return {"results": [self.record(item) for item in output]}
+        return {"message": output}
+    def dump(self, record):
+        return json.dumps(record, separators=(",", ":")) + "\n"
+    def result(self, opcode, output):
+        record = {"command": COMMAND_NAMES[opcode]}
+        record.update(self.record(output))
+        return self.dump(record)
+    def writeResult(self, opcode, output, write):
+        write(self.result(opcode, output))
+    def invalid(self, lineNumber, message):
+        return self.dump({"line": lineNumber, "error": message})
+    def quit(self):
+        return self.dump({"command": "Quit", "message": "Program Terminated!!"})
+
+# Binary output records: a uint32 byte count of the rest, the command's
+# opcode (BINARY_INVALID for a malformed line) and the kind of record
+BINARY_HEADER = struct.Struct("<IBB")
+BINARY_INVALID = 255
+# A message is UTF-8 text. Books and batches give a uint32 count, then that
+# many books or nested records.
+BINARY_MESSAGE = 0
+BINARY_BOOKS = 1
+BINARY_BATCH = 2
+BINARY_COUNT = struct.Struct("<I")
+# bookId, 1 if available, borrowedBy (-1 for none), title and author byte
+# counts and reservation count, followed by the title, author and
+# reservations' int64 patronIds
+BINARY_BOOK = struct.Struct("<qBqIIH")
+
+class BinaryOutput:
+    # Length-prefixed binary records, with book fields packed from the
+    # BookNodes rather than parsed back out of text
+    binary = True
+    extension = ".bin"
+    def __init__(self, library):
+        self.library = library
+    def book(self, book):
+        title = unquote(book.bookName).encode("utf-8")
+        author = unquote(book.authorName).encode("utf-8")
+        patrons = [entry[1] for entry in book.reservations.heap]
+        return b"".join(
+            (
+                BINARY_BOOK.pack(
+                    book.bookId,
+                    book.availability == AVAILABLE,
+                    -1 if book.borrowedBy is None else book.borrowedBy,
+                    len(title),
+                    len(author),
+                    len(patrons),
+                ),
+                title,
+                author,
+                struct.pack(f"<{len(patrons)}q", *patrons),
+            )
+        )
+    def record(self, opcode, output):
+        if isinstance(output, BookOutput):
+            books = [self.book(book) for book in output.books]
+            kind, parts = BINARY_BOOKS, [BINARY_COUNT.pack(len(books))] + books
+        elif isinstance(output, list):
+            kind = BINARY_BATCH
+            parts = [BINARY_COUNT.pack(len(output))]
+            parts += [self.record(opcode, item) for item in output]
+        else:
+            kind, parts = BINARY_MESSAGE, [output.encode("utf-8")]
+        body = b"".join(parts)
+        return BINARY_HEADER.pack(len(body) + 2, opcode, kind) + body
+    def result(self, opcode, output):
+        return self.record(opcode, output)
+    def writeResult(self, opcode, output, write):
+        write(self.result(opcode, output))
+    def invalid(self, lineNumber, message):
+        return self.record(
+            BINARY_INVALID, f"Invalid command on line {lineNumber}: {message}"
+        )
+    def quit(self):
+        return self.record(QUIT, "Program Terminated!!")
+
+# Formats results can be written in, by --output-format name
+OUTPUT_FORMATS = {
+    "text": TextOutput,
+    "jsonl": JsonLinesOutput,
+    "binary": BinaryOutput,
+}
+
+class Patron:
+    def __init__(self, patronId):
+        self.patronId = patronId
+        # Books the patron currently has checked out
+        self.borrowed = set()
+        # Books the patron is waiting for
+        self.reservations = set()
+    def addReservation(self, bookId):
+        self.reservations.add(bookId)
+    def cancelReservation(self, bookId):
+        self.reservations.discard(bookId)
+    def isEmpty(self):
+        return not self.borrowed and not self.reservations
+
+# Latency histogram buckets; bucket b counts commands that took under 2**b
+# microseconds
+LATENCY_BUCKETS = 32
+
+class Stats:
+    # Opt-in instrumentation: per-command latency histograms and find path
+    # lengths. Red-black trees count their rotations and fix-up loops here
+    # once instrumented, and reservation heaps count their sifts once the
+    # library hands them these stats.
     def __init__(self):
-        self.bookTree = RedBlackTree()
+        self.latencies = {}
+        self.searches = 0
+        self.searchSteps = 0
+        self.longestSearch = 0
+        # Swaps made sifting reservation heaps, counted by the heaps
+        self.siftSteps = 0
+        # Rebalancing work, counted by instrumented red-black trees
+        self.rotations = 0
+        self.fixInsertLoops = 0
+        self.fixDeleteLoops = 0
+        # Server reader threads record their searches too
+        self.lock = threading.Lock()
+    def recordLatency(self, command, nanoseconds):
+        histogram = self.latencies.get(command)
+        if histogram is None:
+            histogram = self.latencies[command] = [0] * LATENCY_BUCKETS
+        histogram[min((nanoseconds // 1000).bit_length(), LATENCY_BUCKETS - 1)] += 1
+    def recordSearch(self, steps):
+        with self.lock:
+            self.searches += 1
+            self.searchSteps += steps
+            if steps > self.longestSearch:
+                self.longestSearch = steps
+    def percentile(self, histogram, fraction):
+        # Upper bound in microseconds of the bucket holding the percentile
+        rank = fraction * sum(histogram)
+        seen = 0
+        for bucket, count in enumerate(histogram):
+            seen += count
+            if count and seen >= rank:
+                return 1 << bucket
+        return 1 << (LATENCY_BUCKETS - 1)
+    def report(self, tree, details):
+        lines = ["Command latencies:"]
+        for command, histogram in sorted(self.latencies.items()):
+            lines.append(
+                f"{command}: {sum(histogram)} calls, "
+                f"p50 < {self.percentile(histogram, 0.5)}us, "
+                f"p99 < {self.percentile(histogram, 0.99)}us, "
+                f"max < {self.percentile(histogram, 1)}us"
+            )
+        meanSearch = self.searchSteps / self.searches if self.searches else 0
+        lines.append(
+            f"Searches: {self.searches}, mean path {meanSearch:.1f}, "
+            f"longest path {self.longestSearch}"
+        )
+        if not isinstance(tree, OrderedIndex):
+            lines.append(f"Rotations: {self.rotations}")
+            lines.append(f"FixInsert Iterations: {self.fixInsertLoops}")
+            lines.append(f"FixDelete Iterations: {self.fixDeleteLoops}")
+        lines.append(f"Heap Sift Steps: {self.siftSteps}")
+        lines.append(f"Details Cache: {details.hits} hits, {details.misses} misses")
+        return "\n".join(lines)
+
+# Reservations of books that have no waitlist. It is shared, so code must
+# give a book its own heap before adding to it.
+EMPTY_RESERVATIONS = BinaryMinHeap()
+
+# Snapshot file layout: header, string table, fixed-size book records in
+# tree preorder, every book's reservations in the same order, then the author
+# and title index orders as preorder positions of the books
+SNAPSHOT_MAGIC = b"GATORSNP"
+SNAPSHOT_VERSION = 1
+# magic, version, book count, reservation count, colour flip count, string count
+SNAPSHOT_HEADER = struct.Struct("<8sIqqqI")
+SNAPSHOT_STRING = struct.Struct("<I")
+# bookId, flags, title, author and availability string indexes (0 for None),
+# borrowedBy, reservation count
+SNAPSHOT_BOOK = struct.Struct("<qBIIIqH")
+# priority, patronId, timestamp
+SNAPSHOT_RESERVATION = struct.Struct("<qqd")
+SNAPSHOT_RED = 1
+SNAPSHOT_LEFT = 2
+SNAPSHOT_RIGHT = 4
+SNAPSHOT_BORROWED = 8
+
+class LibrarySystem:
+    def __init__(
+        self, compact=False, persistent=False, backend="redblack", outputFormat="text"
+    ):
+        if compact:
+            self.bookTree = CompactRedBlackTree()
+        elif persistent:
+            # Readers on other threads can use the tree while it changes
+            self.bookTree = PersistentRedBlackTree()
+        else:
+            self.bookTree = BOOK_INDEXES[backend]()
         self.patrons = {}
+        # Ordered (name, bookId, book) entries for author and title lookups,
+        # (name, bookId) with a compact tree (see indexEntry)
+        self.authorIndex = SortedBlockList()
+        self.titleIndex = SortedBlockList()
+        # Rendered details of recently printed books
+        self.details = DetailsCache()
+        # Encoder for the results written by runCommands
+        self.output = OUTPUT_FORMATS[outputFormat](self)
+        # Instrumentation, off unless enableStats is called
+        self.stats = None
+    def enableStats(self):
+        self.stats = Stats()
+        self.bookTree.instrument(self.stats)
+    def printStats(self):
+        if self.stats is None:
+            return "Stats are disabled, run with --stats to collect them"
+        return self.stats.report(self.bookTree, self.details)
     def colorFlipCount(self):
         return self.bookTree.colorFlipCount
     def quit(self):
         exit()
+    def getPatron(self, patronId):
+        # Patron index entry, created on first use
+        patron = self.patrons.get(patronId)
+        if patron is None:
+            patron = self.patrons[patronId] = Patron(patronId)
+        return patron
+    def releasePatron(self, patron):
+        # Drop patrons with no loans or reservations left from the index
+        if patron.isEmpty():
+            self.patrons.pop(patron.patronId, None)
     def printBook(self, bookId):
         # Print 1 Book based on bookId
-        node = self.bookTree.find(bookId)
+        return self.printFound(bookId, self.bookTree.find(bookId))
+    def printFound(self, bookId, node):
         if node is not None:
-            patron_ids = [patronId[1] for patronId in node.value.reservations.heap]
-            details = (
-                f"BookID = {node.value.bookId}\n"
-                f"Title = {node.value.bookName}\n"
-                f"Author = {node.value.authorName}\n"
-                f"Availability = {node.value.availability}\n"
-                f"BorrowedBy = {node.value.borrowedBy}\n"
-                f"Reservations = {patron_ids}"
-            )
-            return details
+            return BookOutput([node.value], listing=False)
         else:
             return f"Book {bookId} not found in the library."
-    def printBooks(self, node, bookId1, bookId2):
-        # Print books in range of given bookids
-        detailsList = []
-        def processBook(bookNode):
-            patron_ids = [patronId[1] for patronId in bookNode.value.reservations.heap]
-            details = (
-                f"BookID = {bookNode.value.bookId}\n"
-                f"Title = {bookNode.value.bookName}\n"
-                f"Author = {bookNode.value.authorName}\n"
-                f"Availability = {bookNode.value.availability}\n"
-                f"BorrowedBy = {bookNode.value.borrowedBy}\n"
-                f"Reservations = {patron_ids}"
-            )
-            detailsList.append(details)
-        def inorderTraversal(node):
-            nonlocal detailsList
-            if node is not None:
-                inorderTraversal(node.l)
-                if (
-                    isinstance(node.value, BookNode)
-                    and bookId1 <= node.value.bookId <= bookId2
-                ):
-                    processBook(node)
-                inorderTraversal(node.r)
-        inorderTraversal(node)
-        return detailsList
+    def printBookSet(self, bookIds):
+        # PrintBook for each of bookIds, in order
+        return [
+            self.printFound(bookId, node)
+            for bookId, node in zip(bookIds, self.findBooks(bookIds))
+        ]
+    def findBooks(self, bookIds):
+        # Node for each of bookIds (None where missing), found in one pass
+        # over the tree in order of bookId
+        order = sorted(range(len(bookIds)), key=bookIds.__getitem__)
+        nodes = [None] * len(bookIds)
+        for i, node in zip(order, self.bookTree.findMany([bookIds[i] for i in order])):
+            nodes[i] = node
+        return nodes
+    def printBooks(self, bookId1, bookId2, offset=0, limit=None):
+        # Lazily yield books in range of given bookids, skipping the first
+        # offset of them and stopping after limit if one is given
+        nodes = self.bookTree.rangeSearch(bookId1, bookId2, offset)
+        if limit is not None:
+            nodes = islice(nodes, limit)
+        return (node.value for node in nodes)
+    def countBooks(self, bookId1, bookId2):
+        # Number of books in range of given bookids
+        return self.bookTree.count(bookId1, bookId2)
+    def kthBook(self, k):
+        # Details of the k-th book in order of bookId, counting from 1
+        node = self.bookTree.select(k - 1) if k >= 1 else None
+        if node is None:
+            return f"Book number {k} not found in the library."
+        return BookOutput([node.value], listing=False)
+    def countAvailable(self, bookId1, bookId2):
+        # Number of available books in range of given bookids
+        return self.bookTree.countAvailable(bookId1, bookId2)
+    def nextAvailableBook(self, bookId):
+        # Details of the first available book at or after bookId
+        node = self.bookTree.nextAvailable(bookId)
+        if node is None:
+            return f"No available books found at or after {bookId}."
+        return BookOutput([node.value], listing=False)
     def insertBook(
         self,
         bookId,
@@ -478,45 +3095,151 @@ class LibrarySystem:
         newBook.availability = availability
         newBook.borrowedBy = borrowedBy
         if reservationHeap:
-            newBook.reservations.heap = reservationHeap
-        self.bookTree.insert(newBook)
+            newBook.reservations = BinaryMinHeap(self.stats)
+            newBook.reservations.load(reservationHeap)
+        node = self.bookTree.insert(newBook)
+        if node is None:
+            return
+        self.indexBook(node.value)
+        # Index the loan and reservations the book arrives with
+        if borrowedBy is not None:
+            self.getPatron(borrowedBy).borrowed.add(bookId)
+        for reservation in newBook.reservations.heap:
+            self.getPatron(reservation[1]).addReservation(bookId)
+    def insertBooks(self, books):
+        # Bulk insert (bookId, bookName, authorName, availability) tuples
+        added = self.bookTree.bulkLoad(
+            [
+                BookNode(bookId, bookName, authorName, availability)
+                for bookId, bookName, authorName, availability in books
+            ]
+        )
+        self.indexBooks(added)
+    def indexBooks(self, added):
+        if not self.authorIndex:
+            # Build empty indexes in one sort rather than book by book
+            self.authorIndex = SortedBlockList(
+                self.indexEntry(book.authorName, book) for book in added
+            )
+            self.titleIndex = SortedBlockList(
+                self.indexEntry(book.bookName, book) for book in added
+            )
+        else:
+            for book in added:
+                self.indexBook(book)
+    def indexEntry(self, name, book):
+        # Author or title index entry of a book. The books of a compact tree
+        # are handles made on each lookup, so keeping one per book would cost
+        # the memory the tree saves; its entries hold the bookId only and
+        # indexedBooks finds the book again.
+        if isinstance(self.bookTree, CompactRedBlackTree):
+            return (unquote(name), book.bookId)
+        return (unquote(name), book.bookId, book)
+    def indexedBooks(self, entries):
+        # (name, bookId, book) for index entries
+        if isinstance(self.bookTree, CompactRedBlackTree):
+            find = self.bookTree.find
+            return ((name, bookId, find(bookId)) for name, bookId in entries)
+        return entries
+    def indexBook(self, book):
+        self.authorIndex.add(self.indexEntry(book.authorName, book))
+        self.titleIndex.add(self.indexEntry(book.bookName, book))
+    def unindexBook(self, book):
+        self.authorIndex.remove(self.indexEntry(book.authorName, book))
+        self.titleIndex.remove(self.indexEntry(book.bookName, book))
+    def editBook(self, node):
+        # Book of node to change, followed by publishBook once done
+        book = self.bookTree.editBook(node)
+        if self.stats is not None and book.reservations is not EMPTY_RESERVATIONS:
+            book.reservations.stats = self.stats
+        return book
+    def publishBook(self, book):
+        replaced = self.bookTree.publishBook()
+        if replaced is not None:
+            # The tree published a copy of the book, which the indexes now
+            # hold instead
+            self.unindexBook(replaced)
+            self.indexBook(book)
+    def changingNodes(self, bookIds):
+        # Nodes for a batch that changes books. The persistent tree replaces
+        # the nodes of books it changes, so a bookId repeated in the batch is
+        # found again when its turn comes.
+        seen = set()
+        for bookId, node in zip(bookIds, self.findBooks(bookIds)):
+            if bookId in seen:
+                node = self.bookTree.find(bookId)
+            seen.add(bookId)
+            yield node
     def borrowBook(self, patronId, bookId, patronPriority):
         # Borrow book and if not available add to reservation
-        node = self.bookTree.find(bookId)
+        return self.borrowFound(patronId, bookId, patronPriority, self.bookTree.find(bookId))
+    def borrowBooks(self, patronId, patronPriority, bookIds):
+        # BorrowBook for each of bookIds, in order
+        return [
+            self.borrowFound(patronId, bookId, patronPriority, node)
+            for bookId, node in zip(bookIds, self.changingNodes(bookIds))
+        ]
+    def borrowFound(self, patronId, bookId, patronPriority, node):
         if node is not None:
-            if node.value.availability == '"Yes"':
-                node.value.availability = '"No"'
-                node.value.borrowedBy = patronId
-                self.patrons
+            book = self.editBook(node)
+            if book.availability == AVAILABLE:
+                self.bookTree.setAvailability(node, '"No"')
+                book.borrowedBy = patronId
+                book.version = next(BOOK_VERSIONS)
+                self.publishBook(book)
+                self.getPatron(patronId).borrowed.add(bookId)
                 return f"Book {bookId} Borrowed by Patron {patronId}"
             else:
-                reservationAdded = node.value.addReservation(patronId, patronPriority)
-                if reservationAdded == "Waitlist full":
+                reservationAdded = book.addReservation(patronId, patronPriority)
+                if reservationAdded == "Already reserved":
+                    self.publishBook(book)
+                    return f"Patron {patronId} already has a reservation for Book {bookId}."
+                elif reservationAdded == "Waitlist full":
+                    self.publishBook(book)
                     return f"Waitlist for Book {bookId} is full. Cannot add reservation for Patron {patronId}"
                 else:
+                    book.version = next(BOOK_VERSIONS)
+                    self.publishBook(book)
+                    self.getPatron(patronId).addReservation(bookId)
                     return f"Book {bookId} Reserved by Patron {patronId}"
         else:
             return f"Book {bookId} is not available for borrowing."
     def returnBook(self, patronId, bookId):
         # Return Borrowed Book  based on bookId and allot to reserved patrons
-        node = self.bookTree.find(bookId)
+        return self.returnFound(patronId, bookId, self.bookTree.find(bookId))
+    def returnBooks(self, patronId, bookIds):
+        # ReturnBook for each of bookIds, in order
+        return [
+            self.returnFound(patronId, bookId, node)
+            for bookId, node in zip(bookIds, self.changingNodes(bookIds))
+        ]
+    def returnFound(self, patronId, bookId, node):
         opLine = ""
         if (
             node is not None
             and node.value.availability == '"No"'
             and node.value.borrowedBy == patronId
         ):
-            if len(node.value.reservations.heap) > 0:
-                reservedPatronId = node.value.reservations.heap.pop(0)
-                node.value.borrowedBy = reservedPatronId[1]
+            patron = self.getPatron(patronId)
+            patron.borrowed.discard(bookId)
+            self.releasePatron(patron)
+            book = self.editBook(node)
+            book.version = next(BOOK_VERSIONS)
+            if len(book.reservations) > 0:
+                reservedPatronId = book.reservations.removeMin()
+                book.borrowedBy = reservedPatronId[1]
+                reservedPatron = self.getPatron(reservedPatronId[1])
+                reservedPatron.cancelReservation(bookId)
+                reservedPatron.borrowed.add(bookId)
                 opLine = (
                     f"Book {bookId} Returned by Patron {patronId} \n \n"
-                    f"Book {bookId} Allotted to Patron {node.value.borrowedBy}"
+                    f"Book {bookId} Allotted to Patron {book.borrowedBy}"
                 )
             else:
-                node.value.availability = '"Yes"'
-                node.value.borrowedBy = None
+                self.bookTree.setAvailability(node, AVAILABLE)
+                book.borrowedBy = None
                 opLine = f"Book {bookId} Returned by Patron {patronId}"
+            self.publishBook(book)
         else:
             opLine = f"Book {bookId} cannot be returned by Patron {patronId}."
         return opLine
@@ -524,155 +3247,1190 @@ class LibrarySystem:
         # Delete Book based on book Id
         node = self.bookTree.find(bookId)
         if node is not None:
-            if node.value.reservations.heap:
-                reservations = node.value.getReservations()
-                self.cancelReservations(bookId, reservations)
-                opLine = f"Book {bookId} is no longer available. Reservations made by Patrons {', '.join(str(reservation) for reservation in reservations)} have been cancelled!"
-            else:
-                opLine = f"Book {bookId} is no longer available."
+            opLine = self.retireBook(node.value)
             self.bookTree.delete(bookId)
         else:
             opLine = f"Book {bookId} not found."
         return opLine
+    def deleteBooks(self, bookId1, bookId2):
+        # DeleteBook for every book in range of given bookids, taking them
+        # out of the tree together
+        opLines = [
+            self.retireBook(node.value)
+            for node in self.bookTree.rangeSearch(bookId1, bookId2)
+        ]
+        if opLines:
+            self.bookTree.removeRange(bookId1, bookId2)
+        return opLines
+    def retireBook(self, book):
+        # Release a book about to be deleted from its borrower, waitlist and
+        # indexes, returning what DeleteBook reports
+        bookId = book.bookId
+        borrower = self.patrons.get(book.borrowedBy)
+        if borrower is not None:
+            borrower.borrowed.discard(bookId)
+            self.releasePatron(borrower)
+        if book.reservations.heap:
+            reservations = book.getReservations()
+            self.cancelReservations(bookId, reservations)
+            opLine = f"Book {bookId} is no longer available. Reservations made by Patrons {', '.join(str(reservation) for reservation in reservations)} have been cancelled!"
+        else:
+            opLine = f"Book {bookId} is no longer available."
+        self.unindexBook(book)
+        self.details.discard(bookId)
+        return opLine
+    def extractBooks(self, bookId1, bookId2):
+        # Move the books in range of given bookids into a new library of the
+        # same kind, their loans and reservations going with them
+        extracted = LibrarySystem()
+        extracted.bookTree = type(self.bookTree)()
+        for node in self.bookTree.rangeSearch(bookId1, bookId2):
+            self.forgetBook(node.value)
+        extracted.adoptBooks(self.bookTree.removeRange(bookId1, bookId2))
+        return extracted
+    def forgetBook(self, book):
+        # Drop a book leaving for another library from the indexes and from
+        # its patrons' records
+        bookId = book.bookId
+        borrower = self.patrons.get(book.borrowedBy)
+        if borrower is not None:
+            borrower.borrowed.discard(bookId)
+            self.releasePatron(borrower)
+        self.cancelReservations(bookId, [entry[1] for entry in book.reservations])
+        self.unindexBook(book)
+        self.details.discard(bookId)
+    def adoptBooks(self, books):
+        # Add BookNodes from another library, with their loans and
+        # reservations
+        added = self.bookTree.bulkLoad(books)
+        self.indexBooks(added)
+        for book in added:
+            if book.borrowedBy is not None:
+                self.getPatron(book.borrowedBy).borrowed.add(book.bookId)
+            for entry in book.reservations:
+                self.getPatron(entry[1]).addReservation(book.bookId)
     def cancelReservations(self, bookId, patrons):
         for patronId in patrons:
             patron = self.patrons.get(patronId, None)
             if patron is not None:
-                patron.cancel_reservation(bookId)
-    def findClosestBook(self, node, targetId):
-        closestLower, closestHigher = self.findClosestBookHelper(node, targetId)
-        detailsList = []
-        if closestLower is not None and closestHigher is not None:
-            distanceLower = abs(targetId - closestLower.value.bookId)
-            distanceHigher = abs(targetId - closestHigher.value.bookId)
-            if distanceLower < distanceHigher:
-                details = self.getBookDetails(closestLower)
-                detailsList.append(details)
-            elif distanceHigher < distanceLower:
-                details = self.getBookDetails(closestHigher)
-                detailsList.append(details)
-            else:
-                if closestLower.value.bookId == closestHigher.value.bookId:
-                    details = self.getBookDetails(closestLower)
-                    detailsList.append(details)
-                else:
-                    details1 = self.getBookDetails(closestLower)
-                    details2 = self.getBookDetails(closestHigher)
-                    detailsList.append(details1)
-                    detailsList.append(details2)
-        elif closestLower is not None:
-            details = self.getBookDetails(closestLower)
-            detailsList.append(details)
-        elif closestHigher is not None:
-            details = self.getBookDetails(closestHigher)
-            detailsList.append(details)
-        return detailsList
+                patron.cancelReservation(bookId)
+                self.releasePatron(patron)
+    def cancelReservation(self, patronId, bookId):
+        # Cancel one patron's reservation for a book
+        node = self.bookTree.find(bookId)
+        if node is None:
+            return f"Book {bookId} not found."
+        if patronId not in node.value.reservations:
+            return f"Patron {patronId} has no reservation for Book {bookId}."
+        book = self.editBook(node)
+        book.reservations.remove(patronId)
+        book.version = next(BOOK_VERSIONS)
+        self.publishBook(book)
+        patron = self.patrons.get(patronId)
+        if patron is not None:
+            patron.cancelReservation(bookId)
+            self.releasePatron(patron)
+        return f"Reservation made by Patron {patronId} for Book {bookId} has been cancelled!"
+    def updatePriority(self, patronId, bookId, patronPriority):
+        # Move a patron's reservation for a book to a new priority
+        node = self.bookTree.find(bookId)
+        if node is None:
+            return f"Book {bookId} not found."
+        if patronId not in node.value.reservations:
+            return f"Patron {patronId} has no reservation for Book {bookId}."
+        book = self.editBook(node)
+        book.reservations.updatePriority(patronId, patronPriority)
+        # The new priority can reorder the heap the details list
+        book.version = next(BOOK_VERSIONS)
+        self.publishBook(book)
+        return f"Priority of Patron {patronId} for Book {bookId} updated to {patronPriority}"
+    def printPatron(self, patronId):
+        # Print the books a patron holds and is waiting for
+        patron = self.patrons.get(patronId)
+        if patron is None:
+            return formatPatron(patronId, [], [])
+        return formatPatron(patronId, patron.borrowed, patron.reservations)
+    def cancelAllReservations(self, patronId):
+        # Remove the patron from the waitlist of every book they reserved
+        patron = self.patrons.get(patronId)
+        if patron is None or not patron.reservations:
+            return f"Patron {patronId} has no reservations."
+        bookIds = sorted(patron.reservations)
+        for bookId in bookIds:
+            node = self.bookTree.find(bookId)
+            if node is not None:
+                book = self.editBook(node)
+                book.reservations.remove(patronId)
+                book.version = next(BOOK_VERSIONS)
+                self.publishBook(book)
+        patron.reservations.clear()
+        self.releasePatron(patron)
+        return cancelledMessage(patronId, bookIds)
+    def findClosestBook(self, targetId):
+        return self.closestBooks(targetId, *self.bookTree.closest(targetId))
+    def closestAvailableBook(self, targetId):
+        # As findClosestBook, among the available books only
+        return self.closestBooks(targetId, *self.bookTree.closestAvailable(targetId))
+    def closestBooks(self, targetId, closestLower, closestHigher):
+        nodes = {
+            node.value.bookId: node
+            for node in (closestLower, closestHigher)
+            if node is not None
+        }
+        return [
+            nodes[bookId].value
+            for bookId in closestIds(
+                targetId,
+                None if closestLower is None else closestLower.value.bookId,
+                None if closestHigher is None else closestHigher.value.bookId,
+            )
+        ]
+    def findClosestBooks(self, targetId, k):
+        # The k books nearest targetId, nearest first
+        below, above = self.bookTree.nearest(targetId)
+        return [
+            node.value
+            for bookId, node in closestItems(
+                targetId,
+                k,
+                ((node.value.bookId, node) for node in below),
+                ((node.value.bookId, node) for node in above),
+            )
+        ]
+    def saveSnapshot(self, path):
+        # Write the whole library state to a binary snapshot file
+        strings = {None: 0}
+        def stringIndex(text):
+            index = strings.get(text)
+            if index is None:
+                index = strings[text] = len(strings)
+            return index
+        books = bytearray()
+        reservations = bytearray()
+        reservationCount = 0
+        positions = {}
+        for value, red, hasLeft, hasRight in self.bookTree.preorder():
+            positions[value.bookId] = len(positions)
+            flags = (
+                (SNAPSHOT_RED if red else 0)
+                | (SNAPSHOT_LEFT if hasLeft else 0)
+                | (SNAPSHOT_RIGHT if hasRight else 0)
+                | (SNAPSHOT_BORROWED if value.borrowedBy is not None else 0)
+            )
+            heap = value.reservations.heap
+            books += SNAPSHOT_BOOK.pack(
+                value.bookId,
+                flags,
+                stringIndex(value.bookName),
+                stringIndex(value.authorName),
+                stringIndex(value.availability),
+                value.borrowedBy if value.borrowedBy is not None else 0,
+                len(heap),
+            )
+            for reservation in heap:
+                reservations += SNAPSHOT_RESERVATION.pack(*reservation)
+            reservationCount += len(heap)
+        authorOrder = array("I", (positions[entry[1]] for entry in self.authorIndex))
+        titleOrder = array("I", (positions[entry[1]] for entry in self.titleIndex))
+        with open(path, "wb") as file:
+            file.write(
+                SNAPSHOT_HEADER.pack(
+                    SNAPSHOT_MAGIC,
+                    SNAPSHOT_VERSION,
+                    len(positions),
+                    reservationCount,
+                    self.bookTree.colorFlipCount,
+                    len(strings) - 1,
+                )
+            )
+            for text in list(strings)[1:]:
+                encoded = text.encode("utf-8")
+                file.write(SNAPSHOT_STRING.pack(len(encoded)))
+                file.write(encoded)
+            file.write(books)
+            file.write(reservations)
+            file.write(authorOrder.tobytes())
+            file.write(titleOrder.tobytes())
+    def loadSnapshot(self, path):
+        # Replace the library state with a snapshot written by saveSnapshot,
+        # relinking the saved tree shape instead of inserting book by book.
+        # The loader only creates live objects, so the cyclic garbage
+        # collector is paused while it runs.
+        gcEnabled = gc.isenabled()
+        gc.disable()
+        try:
+            with open(path, "rb") as file:
+                data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    self.loadSnapshotData(path, memoryview(data))
+                finally:
+                    try:
+                        data.close()
+                    except BufferError:
+                        # Views held by a failed load's traceback keep the
+                        # mapping open until they are freed
+                        pass
+        finally:
+            if gcEnabled:
+                gc.enable()
+    def loadSnapshotData(self, path, data):
+        # The whole snapshot is checked and loaded into locals first, so a
+        # truncated or corrupt file leaves the library as it was
+        if len(data) < SNAPSHOT_HEADER.size:
+            raise ValueError(f"{path} is not a version {SNAPSHOT_VERSION} snapshot")
+        header = SNAPSHOT_HEADER.unpack_from(data, 0)
+        magic, version, bookCount, reservationCount, colorFlipCount, stringCount = header
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError(f"{path} is not a version {SNAPSHOT_VERSION} snapshot")
+        offset = SNAPSHOT_HEADER.size
+        strings = [None]
+        for _ in range(stringCount):
+            if offset + SNAPSHOT_STRING.size > len(data):
+                raise ValueError(f"{path} is truncated")
+            (length,) = SNAPSHOT_STRING.unpack_from(data, offset)
+            offset += SNAPSHOT_STRING.size
+            if offset + length > len(data):
+                raise ValueError(f"{path} is truncated")
+            strings.append(str(data[offset : offset + length], "utf-8"))
+            offset += length
+        booksEnd = offset + bookCount * SNAPSHOT_BOOK.size
+        reservationsEnd = booksEnd + reservationCount * SNAPSHOT_RESERVATION.size
+        authorEnd = reservationsEnd + 4 * bookCount
+        titleEnd = authorEnd + 4 * bookCount
+        if titleEnd != len(data):
+            raise ValueError(f"{path} is truncated" if titleEnd > len(data) else f"{path} has trailing data")
+        authorOrder = array("I")
+        authorOrder.frombytes(data[reservationsEnd:authorEnd])
+        titleOrder = array("I")
+        titleOrder.frombytes(data[authorEnd:titleEnd])
+        # Index keys are computed once per distinct string
+        keys = [text if text is None else unquote(text) for text in strings]
+        books = SNAPSHOT_BOOK.iter_unpack(data[offset:booksEnd])
+        reservations = SNAPSHOT_RESERVATION.iter_unpack(data[booksEnd:reservationsEnd])
+        bookTree = type(self.bookTree)()
+        patrons = {}
+        def getPatron(patronId):
+            patron = patrons.get(patronId)
+            if patron is None:
+                patron = patrons[patronId] = Patron(patronId)
+            return patron
+        titleKeys = []
+        authorKeys = []
+        def records():
+            for bookId, flags, title, author, availability, borrowedBy, count in books:
+                titleKeys.append(keys[title])
+                authorKeys.append(keys[author])
+                book = BookNode(bookId, strings[title], strings[author], strings[availability])
+                if flags & SNAPSHOT_BORROWED:
+                    book.borrowedBy = borrowedBy
+                    getPatron(borrowedBy).borrowed.add(bookId)
+                if count:
+                    book.reservations = BinaryMinHeap(self.stats)
+                    heap = list(islice(reservations, count))
+                    if len(heap) != count:
+                        raise ValueError(f"{path} has a corrupt reservation section")
+                    book.reservations.load(heap)
+                    for reservation in book.reservations.heap:
+                        getPatron(reservation[1]).addReservation(bookId)
+                yield (
+                    book,
+                    flags & SNAPSHOT_RED != 0,
+                    flags & SNAPSHOT_LEFT,
+                    flags & SNAPSHOT_RIGHT,
+                )
+        try:
+            values = bookTree.loadPreorder(records())
+            if next(reservations, None) is not None:
+                raise ValueError(f"{path} has a corrupt reservation section")
+            bookTree.colorFlipCount = colorFlipCount
+            # Index orders were saved sorted, so the indexes need no sorting.
+            # Entries of a compact tree keep no book, as in indexEntry.
+            width = 2 if isinstance(bookTree, CompactRedBlackTree) else 3
+            authorIndex = SortedBlockList(
+                ((authorKeys[i], values[i].bookId, values[i])[:width] for i in authorOrder),
+                presorted=True,
+            )
+            titleIndex = SortedBlockList(
+                ((titleKeys[i], values[i].bookId, values[i])[:width] for i in titleOrder),
+                presorted=True,
+            )
+        except IndexError:
+            raise ValueError(f"{path} is corrupt") from None
+        if self.stats is not None:
+            bookTree.instrument(self.stats)
+        self.bookTree = bookTree
+        self.patrons = patrons
+        self.authorIndex = authorIndex
+        self.titleIndex = titleIndex
+        self.details.clear()
     def getBookDetails(self, node):
-        patron_ids = [patronId[1] for patronId in node.value.reservations.heap]
-        return (
-            f"BookID = {node.value.bookId}\n"
-            f"Title = {node.value.bookName}\n"
-            f"Author = {node.value.authorName}\n"
-            f"Availability = {node.value.availability}\n"
-            f"BorrowedBy = {node.value.borrowedBy}\n"
-            f"Reservations = {patron_ids}"
+        return self.details.get(node.value)
+    def formatBook(self, book):
+        return self.details.get(book)
+    def scanDetails(self, books):
+        # Details of a run of books, taken from the cache where current but
+        # never added to it, so one wide scan cannot flush the polled books
+        entries = self.details.entries
+        for book in books:
+            entry = entries.get(book.bookId)
+            if entry is not None and entry[0] == book.version:
+                yield entry[1]
+            else:
+                yield formatBook(book)
+    def findBooksByAuthor(self, authorName):
+        # Lazily yield an author's books in order of bookId
+        return (book for name, bookId, book in self.authorEntries(authorName))
+    def findBooksByTitlePrefix(self, prefix):
+        # Lazily yield books whose title starts with prefix, in title order
+        return (book for title, bookId, book in self.titleEntries(prefix))
+    def authorEntries(self, authorName):
+        # (name, bookId, book) for an author's books, in order of bookId
+        return self.indexedBooks(self.authorMatches(unquote(authorName)))
+    def titleEntries(self, prefix):
+        # (title, bookId, book) for titles starting with prefix, in title order
+        return self.indexedBooks(self.titleMatches(unquote(prefix)))
+    def authorMatches(self, authorName):
+        for entry in self.authorIndex.irange((authorName,)):
+            if entry[0] != authorName:
+                break
+            yield entry
+    def titleMatches(self, prefix):
+        for entry in self.titleIndex.irange((prefix,)):
+            if not entry[0].startswith(prefix):
+                break
+            yield entry
+
+def closestIds(targetId, lowerId, higherId):
+    # bookIds FindClosestBook reports, given the nearest IDs at or below and
+    # at or above targetId (None when there is none). Ties report both.
+    if lowerId is None or higherId is None:
+        return [bookId for bookId in (lowerId, higherId) if bookId is not None]
+    if lowerId == higherId or targetId - lowerId < higherId - targetId:
+        return [lowerId]
+    if higherId - targetId < targetId - lowerId:
+        return [higherId]
+    return [lowerId, higherId]
+
+def closestItems(targetId, k, below, above):
+    # The k (bookId, item) pairs nearest targetId, nearest first, taken from
+    # iterators walking down from targetId and up from just above it. As in
+    # closestIds, ties go lower first and a pair as near as the last one
+    # taken is taken too.
+    taken = []
+    if k < 1:
+        return taken
+    lower = next(below, None)
+    higher = next(above, None)
+    while lower is not None or higher is not None:
+        if higher is None or (
+            lower is not None and targetId - lower[0] <= higher[0] - targetId
+        ):
+            pair = lower
+            lower = next(below, None)
+        else:
+            pair = higher
+            higher = next(above, None)
+        if len(taken) >= k and abs(pair[0] - targetId) != abs(taken[-1][0] - targetId):
+            break
+        taken.append(pair)
+    return taken
+
+def formatPatron(patronId, borrowed, reserved):
+    return (
+        f"PatronID = {patronId}\n"
+        f"Borrowed = {sorted(borrowed)}\n"
+        f"Reservations = {sorted(reserved)}"
+    )
+
+def cancelledMessage(patronId, bookIds):
+    return f"Reservations made by Patron {patronId} for Books {', '.join(str(bookId) for bookId in bookIds)} have been cancelled!"
+
+def printBooksCommand(library, bookId1, bookId2, offset=0, limit=None):
+    if offset < 0 or (limit is not None and limit < 0):
+        return "PrintBooks offset and limit cannot be negative."
+    return BookOutput(library.printBooks(bookId1, bookId2, offset, limit), scanned=True)
+
+def batchOutput(outputs):
+    # A batch command's per-book outputs, spaced as the runner spaces the
+    # outputs of separate commands
+    return "\n\n\n".join(outputs)
+
+def borrowBooksCommand(library, patronId, patronPriority, bookIds):
+    # Per-book results, kept apart for the output format to encode
+    return library.borrowBooks(patronId, patronPriority, bookIds)
+
+def returnBooksCommand(library, patronId, bookIds):
+    return library.returnBooks(patronId, bookIds)
+
+def printBookSetCommand(library, bookIds):
+    return library.printBookSet(bookIds)
+
+def countBooksCommand(library, bookId1, bookId2):
+    return f"Book Count: {library.countBooks(bookId1, bookId2)}"
+
+def findClosestBookCommand(library, targetId):
+    return BookOutput(library.findClosestBook(targetId))
+
+def countAvailableCommand(library, bookId1, bookId2):
+    return f"Available Book Count: {library.countAvailable(bookId1, bookId2)}"
+
+def closestAvailableBookCommand(library, targetId):
+    books = library.closestAvailableBook(targetId)
+    if not books:
+        return "No available books found in the library."
+    return BookOutput(books)
+
+def findClosestBooksCommand(library, targetId, k):
+    if k < 0:
+        return "FindClosestBooks k cannot be negative."
+    return BookOutput(library.findClosestBooks(targetId, k))
+
+def findBooksByAuthorCommand(library, authorName):
+    books = list(library.findBooksByAuthor(authorName))
+    if books:
+        return BookOutput(books, scanned=True)
+    return f"No books found by author {authorName}."
+
+def findBooksByTitlePrefixCommand(library, prefix):
+    books = list(library.findBooksByTitlePrefix(prefix))
+    if books:
+        return BookOutput(books, scanned=True)
+    return f"No books found with title prefix {prefix}."
+
+def saveSnapshotCommand(library, path):
+    try:
+        library.saveSnapshot(path)
+        return f"Snapshot saved to {path}"
+    except OSError as e:
+        return f"Snapshot could not be saved to {path}: {e}"
+
+def loadSnapshotCommand(library, path):
+    try:
+        library.loadSnapshot(path)
+        return f"Snapshot loaded from {path}"
+    except (OSError, ValueError, struct.error) as e:
+        return f"Snapshot could not be loaded from {path}: {e}"
+
+def deleteBooksCommand(library, bookId1, bookId2):
+    opLines = library.deleteBooks(bookId1, bookId2)
+    if not opLines:
+        return f"No books found between {bookId1} and {bookId2}."
+    return opLines
+
+def extractBooksCommand(library, bookId1, bookId2, path):
+    extracted = library.extractBooks(bookId1, bookId2)
+    count = extracted.bookTree.size
+    try:
+        extracted.saveSnapshot(path)
+    except OSError as e:
+        # Take the books back rather than lose them
+        library.adoptBooks(extracted.bookTree.removeRange(bookId1, bookId2))
+        return f"Books could not be extracted to {path}: {e}"
+    return f"{count} book(s) extracted to {path}"
+
+# ColorFlipCount output of the backends that do not recolour nodes
+UNCOUNTED_COLOR_FLIPS = "Colour flips are only counted by the redblack backend"
+
+def colorFlipCountCommand(library):
+    if isinstance(library.bookTree, OrderedIndex):
+        return UNCOUNTED_COLOR_FLIPS
+    return f"Colour Flip Count: {library.bookTree.colorFlipCount}"
+
+# Pieces of a command's argument text: a double-quoted name or a [list],
+# either running to the end if left open, a comma, or other text
+ARGUMENT_TOKEN = re.compile(r'"[^"]*"?|\[[^\]]*\]?|,|[^,"\[]+')
+
+def splitArguments(rest):
+    # Split a command's argument text on the commas outside double quotes
+    # and [lists]
+    if "[" not in rest:
+        parts = rest.split(",")
+        for part in parts:
+            if part.count('"') & 1:
+                break
+        else:
+            # No quoted name holds a comma
+            return parts
+    elif '"' not in rest:
+        # IDs then a [list]
+        head, bracket, tail = rest.partition("[")
+        parts = head.split(",")
+        if (
+            not parts[-1].strip()
+            and tail.count("]") == 1
+            and tail.rstrip()[-1:] == "]"
+        ):
+            parts[-1] = bracket + tail
+            return parts
+    parts = [""]
+    for token in ARGUMENT_TOKEN.findall(rest):
+        if token == ",":
+            parts.append("")
+        else:
+            parts[-1] += token
+    return parts
+
+class MalformedArguments(ValueError):
+    # Raised by argument decoders, naming what is wrong with the arguments
+    pass
+
+# Argument decoders, turning the argument strings of a command into the
+# values its handler takes
+def idArguments(parts):
+    # int() skips the spaces around each number itself
+    return tuple(map(int, parts))
+
+def insertArguments(parts):
+    bookId, bookName, authorName, availability = parts
+    return int(bookId), bookName.strip(), authorName.strip(), availability.strip()
+
+def idListArguments(leading):
+    # Decoder for a number of leading IDs followed by a bracketed list of
+    # IDs, e.g. BorrowBooks(patronId, priority, [bookId, bookId, ...]). The
+    # list is passed to the handler as one argument.
+    def decode(parts):
+        items = parts[leading].strip()
+        if not items.startswith("["):
+            raise MalformedArguments(f"{items!r} where a [list] of IDs belongs")
+        if not items.endswith("]"):
+            raise MalformedArguments(f"an unclosed [list] of IDs {items!r}")
+        items = items[1:-1]
+        bookIds = list(map(int, items.split(","))) if items.strip() else []
+        return (*map(int, parts[:leading]), bookIds)
+    return decode
+
+def extractArguments(parts):
+    bookId1, bookId2, path = parts
+    return int(bookId1), int(bookId2), unquote(path.strip())
+
+def textArguments(parts):
+    return tuple([part.strip() for part in parts])
+
+def pathArguments(parts):
+    return tuple([unquote(part.strip()) for part in parts])
+
+# Command name -> (handler, argument count, argument decoder). Handlers take
+# the library and the decoded arguments and return the command's output or
+# None. Commands with optional arguments give a tuple of the counts they
+# take; a [list] counts as one argument. A command's opcode is its position
+# in this table.
+COMMAND_TABLE = {
+    "InsertBook": (LibrarySystem.insertBook, 4, insertArguments),
+    "PrintBook": (LibrarySystem.printBook, 1, idArguments),
+    # PrintBooks(id1, id2) or the page PrintBooks(id1, id2, offset, limit)
+    "PrintBooks": (printBooksCommand, (2, 4), idArguments),
+    "CountBooks": (countBooksCommand, 2, idArguments),
+    "KthBook": (LibrarySystem.kthBook, 1, idArguments),
+    "FindClosestBook": (findClosestBookCommand, 1, idArguments),
+    "FindClosestBooks": (findClosestBooksCommand, 2, idArguments),
+    "NextAvailableBook": (LibrarySystem.nextAvailableBook, 1, idArguments),
+    "ClosestAvailableBook": (closestAvailableBookCommand, 1, idArguments),
+    "CountAvailable": (countAvailableCommand, 2, idArguments),
+    "BorrowBook": (LibrarySystem.borrowBook, 3, idArguments),
+    "ReturnBook": (LibrarySystem.returnBook, 2, idArguments),
+    # BorrowBooks(patronId, priority, [ids]), ReturnBooks(patronId, [ids]) and
+    # PrintBookSet([ids]) output what one command per bookId would
+    "BorrowBooks": (borrowBooksCommand, 3, idListArguments(2)),
+    "ReturnBooks": (returnBooksCommand, 2, idListArguments(1)),
+    "PrintBookSet": (printBookSetCommand, 1, idListArguments(0)),
+    "DeleteBook": (LibrarySystem.deleteBook, 1, idArguments),
+    "DeleteBooks": (deleteBooksCommand, 2, idArguments),
+    # ExtractBooks(id1, id2, path) saves the books taken out as a snapshot
+    "ExtractBooks": (extractBooksCommand, 3, extractArguments),
+    "FindBooksByAuthor": (findBooksByAuthorCommand, 1, textArguments),
+    "FindBooksByTitlePrefix": (findBooksByTitlePrefixCommand, 1, textArguments),
+    "CancelReservation": (LibrarySystem.cancelReservation, 2, idArguments),
+    "UpdatePriority": (LibrarySystem.updatePriority, 3, idArguments),
+    "PrintPatron": (LibrarySystem.printPatron, 1, idArguments),
+    "CancelAllReservations": (LibrarySystem.cancelAllReservations, 1, idArguments),
+    "SaveSnapshot": (saveSnapshotCommand, 1, pathArguments),
+    "LoadSnapshot": (loadSnapshotCommand, 1, pathArguments),
+    "ColorFlipCount": (colorFlipCountCommand, 0, textArguments),
+    "Stats": (LibrarySystem.printStats, 0, textArguments),
+    # Handled by runCommands
+    "Quit": (None, 0, textArguments),
+}
+COMMAND_NAMES = list(COMMAND_TABLE)
+OPCODES = {name: opcode for opcode, name in enumerate(COMMAND_NAMES)}
+HANDLERS = [handler for handler, count, decode in COMMAND_TABLE.values()]
+ARGUMENT_COUNTS = [
+    count if isinstance(count, tuple) else (count,)
+    for handler, count, decode in COMMAND_TABLE.values()
+]
+DECODERS = [decode for handler, count, decode in COMMAND_TABLE.values()]
+INSERT_BOOK = OPCODES["InsertBook"]
+QUIT = OPCODES["Quit"]
+
+def compileCommand(line):
+    # Compile a stripped command line into (opcode, decoded arguments),
+    # raising ValueError if it is malformed
+    name, paren, rest = line.partition("(")
+    if not paren or rest[-1:] != ")":
+        raise ValueError(f"expected Command(arguments), got {line!r}")
+    opcode = OPCODES.get(name)
+    if opcode is None:
+        opcode = OPCODES.get(name.strip())
+        if opcode is None:
+            raise ValueError(f"unknown command {name.strip()!r}")
+    rest = rest[:-1]
+    parts = splitArguments(rest) if rest and not rest.isspace() else []
+    if len(parts) not in ARGUMENT_COUNTS[opcode]:
+        counts = " or ".join(map(str, ARGUMENT_COUNTS[opcode]))
+        raise ValueError(
+            f"{COMMAND_NAMES[opcode]} takes {counts} argument(s) "
+            f"but was given {len(parts)}"
         )
-    def findClosestBookHelper(
-        self, node, targetId, closestLower=None, closestHigher=None
+    try:
+        return opcode, DECODERS[opcode](parts)
+    except MalformedArguments as e:
+        raise ValueError(f"{COMMAND_NAMES[opcode]} was given {e}") from None
+    except ValueError:
+        raise ValueError(
+            f"{COMMAND_NAMES[opcode]} was given a non-numeric ID or priority"
+        ) from None
+
+def executeCommand(library, opcode, args):
+    # Run one compiled command and return its output, or None if it has
+    # none. Outputs reporting books are BookOutputs, left for the library's
+    # output format to encode.
+    return HANDLERS[opcode](library, *args)
+
+# Shortest run of consecutive InsertBook commands that is bulk loaded
+BULK_LOAD_MIN_RUN = 1000
+
+# Commands that change library state and so are written to the journal
+JOURNALED_COMMANDS = {
+    "InsertBook",
+    "BorrowBook",
+    "ReturnBook",
+    "BorrowBooks",
+    "ReturnBooks",
+    "DeleteBook",
+    "DeleteBooks",
+    "ExtractBooks",
+    "CancelReservation",
+    "CancelAllReservations",
+    "UpdatePriority",
+    "LoadSnapshot",
+}
+JOURNALED_OPCODES = {OPCODES[name] for name in JOURNALED_COMMANDS}
+# Journal entries written between fsyncs
+JOURNAL_GROUP_SIZE = 256
+# Journal entries between checkpoints
+CHECKPOINT_INTERVAL = 100000
+
+class CommandJournal:
+    # Append-only log of mutating commands. Entries are fsynced in groups and
+    # the library is checkpointed to a snapshot every so often, after which
+    # the log starts again. Each entry is "seq, input line number, bulk batch
+    # (the seq of its first entry, or 0), bytes of output before the line,
+    # command line", tab separated. A checkpoint is named after the seq,
+    # input line number and output size it covers. Results written through
+    # the journal reach the disk before any entry that follows them, so
+    # recovery can cut the output back to where an entry left it.
+    def __init__(
+        self,
+        path,
+        seq=0,
+        groupSize=JOURNAL_GROUP_SIZE,
+        checkpointInterval=CHECKPOINT_INTERVAL,
     ):
-        while node.value.bookId != 0:
-            if node.value.bookId == targetId:
-                return node, node
-            elif node.value.bookId < targetId:
-                closestLower = node
-                node = node.r
-            else:
-                closestHigher = node
-                node = node.l
-        return closestLower, closestHigher
+        self.path = path
+        self.seq = seq
+        self.groupSize = groupSize
+        self.checkpointInterval = checkpointInterval
+        self.file = open(path, "a")
+        # Entries waiting for the next fsync, and the number written since
+        # the last checkpoint
+        self.pending = []
+        self.sinceCheckpoint = 0
+        # Output file opened by openOutput, and the bytes written to it
+        self.output = None
+        self.outputOffset = 0
+    def openOutput(self, path, offset=0):
+        # Write results through the journal, keeping what a recovered run
+        # inherits of the output: its first offset bytes
+        if offset:
+            if not os.path.exists(path) or os.path.getsize(path) < offset:
+                raise ValueError(f"{path} is shorter than the journal records")
+            self.output = open(path, "r+b", buffering=STREAM_BUFFER_SIZE)
+            self.output.truncate(offset)
+            self.output.seek(offset)
+        else:
+            self.output = open(path, "wb", buffering=STREAM_BUFFER_SIZE)
+        self.outputOffset = offset
+    def write(self, result):
+        if not isinstance(result, bytes):
+            result = result.encode()
+        self.output.write(result)
+        self.outputOffset += len(result)
+    def append(self, lineNumber, line, batch=0, outputOffset=None):
+        # Journal the command on an input line, which follows outputOffset
+        # bytes of output (by default all written so far)
+        if outputOffset is None:
+            outputOffset = self.outputOffset
+        self.seq += 1
+        self.pending.append(f"{self.seq}\t{lineNumber}\t{batch}\t{outputOffset}\t{line}\n")
+        self.sinceCheckpoint += 1
+        if len(self.pending) >= self.groupSize:
+            self.commit()
+        return self.seq
+    def commit(self):
+        # Make every pending entry durable with a single fsync, once the
+        # output they follow is
+        if self.pending:
+            self.syncOutput()
+            self.file.write("".join(self.pending))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.pending = []
+    def syncOutput(self):
+        if self.output is not None:
+            self.output.flush()
+            os.fsync(self.output.fileno())
+    def checkpointDue(self):
+        return self.sinceCheckpoint >= self.checkpointInterval
+    def checkpoint(self, library, lineNumber):
+        # Snapshot the library, which has run the input up to lineNumber,
+        # then drop older checkpoints and the log
+        self.commit()
+        self.syncOutput()
+        path = f"{self.path}.checkpoint.{self.seq}.{lineNumber}.{self.outputOffset}"
+        library.saveSnapshot(path + ".tmp")
+        with open(path + ".tmp", "rb") as file:
+            os.fsync(file.fileno())
+        os.replace(path + ".tmp", path)
+        for seq, checkpointLine, outputOffset, oldPath in checkpointFiles(self.path):
+            if seq < self.seq:
+                os.remove(oldPath)
+        # Entries up to self.seq are in the checkpoint, so the log can restart
+        self.file.close()
+        self.file = open(self.path, "w")
+        self.sinceCheckpoint = 0
+    def close(self):
+        self.commit()
+        self.file.close()
+        if self.output is not None:
+            self.output.close()
 
-def main(inputFilename):
-    # Main Driver Function
-    library = LibrarySystem()
-    with open(inputFilename, "r") as file:
-        lines = file.readlines()
-        outputLines = []
-        def parseCommand(command_string):
-            string_parts = command_string.split("(")
-            command = string_parts[0].strip()
-            if len(string_parts) > 1:
-                arguments = string_parts[1].rstrip(")").split(",")
-                arguments = [arg.strip() for arg in arguments]
-                return command, arguments
-            else:
-                return command, []
-        for line in lines:
-            line = line.strip()
-            outputLine = None
-            if line == "Quit()":
+def checkpointFiles(journalPath):
+    # (seq, input line number, output size, path) of every checkpoint
+    # written for a journal, in order of seq
+    files = []
+    prefix = journalPath + ".checkpoint."
+    for path in glob.glob(glob.escape(prefix) + "*"):
+        parts = path[len(prefix) :].split(".")
+        if len(parts) == 3 and all(part.isdigit() for part in parts):
+            files.append((int(parts[0]), int(parts[1]), int(parts[2]), path))
+    return sorted(files)
+
+def resetJournal(journalPath):
+    # Start a fresh journal, discarding any earlier log and checkpoints
+    for seq, lineNumber, outputOffset, path in checkpointFiles(journalPath):
+        os.remove(path)
+    open(journalPath, "w").close()
+
+def recoverJournal(library, journalPath):
+    # Load the latest checkpoint and replay the journal entries after it,
+    # all but the last. The crash may have come before that command, or
+    # the output of the lines up to it, was done, so the log is cut back to
+    # before it and the resumed run does it again. Returns the seq, input
+    # line number and output size to resume from.
+    seq = lineNumber = outputOffset = 0
+    checkpoints = checkpointFiles(journalPath)
+    if checkpoints:
+        seq, lineNumber, outputOffset, path = checkpoints[-1]
+        library.loadSnapshot(path)
+    # (seq, input line number, batch, output offset, command line, position
+    # of the entry in the log)
+    entries = []
+    logSize = 0
+    if os.path.exists(journalPath):
+        with open(journalPath, "rb") as file:
+            for entry in file:
+                parts = entry.decode().rstrip("\n").split("\t", 4)
+                if not entry.endswith(b"\n") or len(parts) != 5:
+                    # A torn final entry was never committed
+                    break
+                entrySeq, entryLine, batch, entryOffset = map(int, parts[:4])
+                if entrySeq > seq:
+                    entries.append((entrySeq, entryLine, batch, entryOffset, parts[4], logSize))
+                logSize += len(entry)
+    last = len(entries)
+    if entries:
+        # A bulk batch is run again as a whole
+        last -= 1
+        batch = entries[last][2]
+        while batch and last > 0 and entries[last - 1][2] == batch:
+            last -= 1
+    i = 0
+    while i < last:
+        batch = entries[i][2]
+        j = i + 1
+        if batch:
+            # Replay a bulk-loaded run as one batch so the tree comes out the same
+            while j < last and entries[j][2] == batch:
+                j += 1
+            library.insertBooks(compileCommand(entry[4])[1] for entry in entries[i:j])
+        else:
+            opcode, args = compileCommand(entries[i][4])
+            executeCommand(library, opcode, args)
+        i = j
+    if last < len(entries):
+        entrySeq, entryLine, batch, outputOffset, line, logSize = entries[last]
+        seq, lineNumber = entrySeq - 1, entryLine - 1
+    if os.path.exists(journalPath):
+        os.truncate(journalPath, logSize)
+    return seq, lineNumber, outputOffset
+
+def flushInserts(library, pendingInserts, journal=None):
+    # Insert a buffered run of (line number, line, arguments, output offset)
+    # InsertBook commands, in bulk if it is long
+    if len(pendingInserts) >= BULK_LOAD_MIN_RUN:
+        if journal is not None:
+            batch = journal.seq + 1
+            for lineNumber, line, args, outputOffset in pendingInserts:
+                journal.append(lineNumber, line, batch, outputOffset)
+        started = time.perf_counter_ns()
+        library.insertBooks(insert[2] for insert in pendingInserts)
+        if library.stats is not None:
+            # A bulk load is timed as a whole
+            library.stats.recordLatency("InsertBook (bulk)", time.perf_counter_ns() - started)
+    else:
+        for lineNumber, line, args, outputOffset in pendingInserts:
+            if journal is not None:
+                journal.append(lineNumber, line, 0, outputOffset)
+            started = time.perf_counter_ns()
+            library.insertBook(*args)
+            if library.stats is not None:
+                library.stats.recordLatency("InsertBook", time.perf_counter_ns() - started)
+    pendingInserts.clear()
+
+def compileLines(lines, stats=None):
+    # Compile command lines into (line number, line, opcode, arguments)
+    # records, skipping blank lines. A malformed line gets an opcode of None
+    # and the error message as its arguments.
+    for lineNumber, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        if stats is not None:
+            started = time.perf_counter_ns()
+        try:
+            opcode, args = compileCommand(line)
+        except ValueError as e:
+            yield lineNumber, line, None, str(e)
+            continue
+        if stats is not None:
+            stats.recordLatency("(parse)", time.perf_counter_ns() - started)
+        yield lineNumber, line, opcode, args
+
+# Bytes of input each parse worker compiles at a time
+PARSE_CHUNK_SIZE = 4 << 20
+# Chunks per parse worker compiled ahead of the executor, which bounds the
+# memory held by compiled records
+PARSE_QUEUE_DEPTH = 2
+
+def compileChunk(path, start, end):
+    # Compile bytes start to end of a command file, which begin and end at
+    # line boundaries. Returns the number of lines and their records, with
+    # line numbers counted from the start of the chunk.
+    with open(path, "rb") as file, mmap.mmap(
+        file.fileno(), 0, access=mmap.ACCESS_READ
+    ) as view:
+        lines = view[start:end].decode("utf-8").split("\n")
+    if not lines[-1]:
+        # Text after the chunk's last newline
+        lines.pop()
+    return len(lines), list(compileLines(lines))
+
+def parseFile(path, workers):
+    # Compile a command file in worker processes, yielding the records of
+    # compileLines in order. The file is memory-mapped and cut at line
+    # boundaries into chunks of about PARSE_CHUNK_SIZE bytes, and at most
+    # PARSE_QUEUE_DEPTH chunks per worker are queued ahead of the caller, so
+    # parsing overlaps execution without reading far ahead of it.
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            def chunks():
+                start = 0
+                while start < len(view):
+                    end = view.find(b"\n", start + PARSE_CHUNK_SIZE)
+                    end = len(view) if end == -1 else end + 1
+                    yield start, end
+                    start = end
+            context = multiprocessing.get_context("spawn")
+            with context.Pool(workers) as pool:
+                bounds = chunks()
+                queued = deque(
+                    pool.apply_async(compileChunk, (path, start, end))
+                    for start, end in islice(bounds, workers * PARSE_QUEUE_DEPTH)
+                )
+                # Lines in the chunks already yielded
+                lineBase = 0
+                while queued:
+                    lineCount, records = queued.popleft().get()
+                    for start, end in islice(bounds, 1):
+                        queued.append(pool.apply_async(compileChunk, (path, start, end)))
+                    for lineNumber, line, opcode, args in records:
+                        yield lineBase + lineNumber, line, opcode, args
+                    lineBase += lineCount
+
+def runCommands(
+    library, records, write, echo=True, bulkLoad=False, journal=None, skipLines=0
+):
+    # Execute records from compileLines or parseFile in order, passing each
+    # result to write. Commands are dispatched through HANDLERS; malformed lines are
+    # reported with their line number. Mutating commands are journaled
+    # before they run, and the first skipLines lines (already applied by
+    # recovery) are skipped.
+    pendingInserts = []
+    stats = library.stats
+    output = library.output
+    for lineNumber, line, opcode, args in records:
+        if lineNumber <= skipLines:
+            continue
+        if opcode is None:
+            write(output.invalid(lineNumber, args))
+            continue
+        if opcode == QUIT:
+            flushInserts(library, pendingInserts, journal)
+            if echo:
                 print("Quit")
-                print("Output printed to file")
-                outputLine = f"Program Terminated!!"
-                outputLines.append(outputLine)
-                break
-            else:
-                command, *args = parseCommand(line)
-                print(command)
-                args = args[0]
-                if command == "InsertBook":
-                    bookId, title, author, availability = (
-                        args[0],
-                        args[1],
-                        args[2],
-                        args[3],
-                    )
-                    library.insertBook(
-                        int(bookId), title, author, availability, None, None
-                    )
-                elif command == "PrintBook":
-                    bookId = args[0]
-                    outputLine = library.printBook(bookId)
-                elif command == "PrintBooks":
-                    bookId1, bookId2 = args[0], args[1]
-                    books = library.printBooks(
-                        library.bookTree.root, int(bookId1), int(bookId2)
-                    )
-                    all_books = [f"{book}\n" for book in books]
-                    outputLine = "\n".join(all_books)
-                elif command == "FindClosestBook":
-                    targetId = args[0]
-                    closest_books = library.findClosestBook(
-                        library.bookTree.root, int(targetId)
-                    )
-                    allClosestBooks = [f"{book}\n" for book in closest_books]
-                    outputLine = "\n".join(allClosestBooks)
-                elif command == "BorrowBook":
-                    patronId, bookId, priority = args[0], args[1], args[2]
-                    outputLine = library.borrowBook(
-                        int(patronId), int(bookId), int(priority)
-                    )
-                elif command == "ReturnBook":
-                    patronId, bookId = args
-                    outputLine = library.returnBook(int(patronId), int(bookId))
-                elif command == "DeleteBook":
-                    bookId = args[0]
-                    outputLine = library.deleteBook(int(bookId))
-                elif command == "ColorFlipCount":
-                    outputLine = f"Colour Flip Count: {library.bookTree.colorFlipCount}"
-            if outputLine is not None:
-                outputLines.append(outputLine)
-                outputLines.append("\n")
+            print("Output printed to file")
+            write(output.quit())
+            break
+        if echo:
+            print(COMMAND_NAMES[opcode])
+        if bulkLoad and opcode == INSERT_BOOK:
+            # Inserts have no output, so they can wait for the end of the run.
+            # A journaled insert keeps the output size at its own line.
+            outputOffset = 0 if journal is None else journal.outputOffset
+            pendingInserts.append((lineNumber, line, args, outputOffset))
+            continue
+        if pendingInserts:
+            flushInserts(library, pendingInserts, journal)
+        if journal is not None and opcode in JOURNALED_OPCODES:
+            journal.append(lineNumber, line)
+        if stats is not None:
+            # Time the command and the writing of its result, which listings
+            # render as they go, but not the journaling or bulk flush
+            started = time.perf_counter_ns()
+        outputLine = HANDLERS[opcode](library, *args)
+        if outputLine is not None:
+            output.writeResult(opcode, outputLine, write)
+        if stats is not None:
+            stats.recordLatency(COMMAND_NAMES[opcode], time.perf_counter_ns() - started)
+        if journal is not None and journal.checkpointDue():
+            journal.checkpoint(library, lineNumber)
+    flushInserts(library, pendingInserts, journal)
+
+# Write buffer used when streaming results straight to the output file
+STREAM_BUFFER_SIZE = 1 << 20
+
+def main(
+    inputFilename,
+    stream=False,
+    echo=True,
+    bulkLoad=False,
+    compact=False,
+    loadSnapshot=None,
+    saveSnapshot=None,
+    journalPath=None,
+    recover=False,
+    stats=False,
+    persistent=False,
+    backend="redblack",
+    parseWorkers=0,
+    outputFormat="text",
+):
+    # Main Driver Function
+    library = LibrarySystem(compact, persistent, backend, outputFormat)
+    if stats:
+        library.enableStats()
+    if loadSnapshot is not None:
+        library.loadSnapshot(loadSnapshot)
+    journal = None
+    resumeLine = outputOffset = 0
+    if journalPath is not None:
+        seq = 0
+        if recover:
+            # Rebuild the state of the crashed run, and keep the output it
+            # wrote up to there, then carry on from the next input line
+            seq, resumeLine, outputOffset = recoverJournal(library, journalPath)
+        else:
+            resetJournal(journalPath)
+        journal = CommandJournal(journalPath, seq)
+    outputFilename = splitext(inputFilename)[0] + "_output_file" + library.output.extension
+    outputMode = "wb" if library.output.binary else "w"
+    records = None
     try:
-        outputFilename = splitext(inputFilename)[0] + "_output_file.txt"
-        with open(outputFilename, "w") as outputFile:
-            for line in outputLines:
-                outputFile.write(str(line) + "\n")
-    except Exception as e:
-        print(f"Error: {e}")
-        
+        if parseWorkers:
+            # Parse in worker processes while this one executes
+            records = parseFile(inputFilename, parseWorkers)
+        if journal is not None:
+            # A journaled run always streams, writing its results through
+            # the journal so the output keeps pace with the entries
+            journal.openOutput(outputFilename, outputOffset)
+            with open(inputFilename, "r") as file:
+                if records is None:
+                    records = compileLines(file, library.stats)
+                runCommands(
+                    library, records, journal.write, echo, bulkLoad, journal, resumeLine
+                )
+        elif stream:
+            # Read commands lazily and write each result as it is produced
+            with open(inputFilename, "r") as file, open(
+                outputFilename, outputMode, buffering=STREAM_BUFFER_SIZE
+            ) as outputFile:
+                if records is None:
+                    records = compileLines(file, library.stats)
+                runCommands(library, records, outputFile.write, echo, bulkLoad)
+        else:
+            if records is None:
+                with open(inputFilename, "r") as file:
+                    records = compileLines(file.readlines(), library.stats)
+            outputLines = []
+            runCommands(library, records, outputLines.append, echo, bulkLoad)
+            try:
+                with open(outputFilename, outputMode) as outputFile:
+                    outputFile.writelines(outputLines)
+            except Exception as e:
+                print(f"Error: {e}")
+    finally:
+        if records is not None:
+            # Stop the parse workers if the commands ended with Quit()
+            records.close()
+        if journal is not None:
+            journal.close()
+    if saveSnapshot is not None:
+        library.saveSnapshot(saveSnapshot)
+
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python3 gator.py inputFilename")
-        sys.exit(1)
-    inputFilename = sys.argv[1]
-    main(inputFilename)
+    parser = argparse.ArgumentParser(description="Gator Library command runner")
+    parser.add_argument("inputFilename")
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="read commands lazily and write results as they are produced",
+    )
+    parser.add_argument(
+        "--quiet", action="store_true", help="do not echo each command to stdout"
+    )
+    parser.add_argument(
+        "--bulk-load",
+        action="store_true",
+        help="hold back InsertBook runs and build them into the tree in one "
+        "pass; faster, but the tree shape and Colour Flip Count differ from "
+        "one-at-a-time inserts",
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="store the book tree in parallel arrays to save memory",
+    )
+    parser.add_argument(
+        "--persistent",
+        action="store_true",
+        help="use the path-copying tree that readers can share while it changes",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=list(BOOK_INDEXES),
+        default="redblack",
+        help="ordered index to keep the books in (only redblack counts colour flips)",
+    )
+    parser.add_argument(
+        "--output-format",
+        choices=list(OUTPUT_FORMATS),
+        default="text",
+        help="write results as text, JSON Lines or length-prefixed binary records",
+    )
+    parser.add_argument(
+        "--load-snapshot",
+        metavar="PATH",
+        help="start from a library snapshot instead of an empty library",
+    )
+    parser.add_argument(
+        "--save-snapshot",
+        metavar="PATH",
+        help="save a library snapshot after the commands have run",
+    )
+    parser.add_argument(
+        "--journal",
+        metavar="PATH",
+        help="journal mutating commands and checkpoint the library to PATH",
+    )
+    parser.add_argument(
+        "--recover",
+        action="store_true",
+        help="restore the state journaled by a crashed run and resume its input",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="collect latency histograms and search statistics for Stats()",
+    )
+    parser.add_argument(
+        "--parse-workers",
+        type=int,
+        default=0,
+        metavar="N",
+        help="memory-map the input and parse it on N worker processes while "
+        "commands run",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        metavar="N",
+        help="split the library by bookId range across N worker processes",
+    )
+    options = parser.parse_args()
+    if options.recover and options.journal is None:
+        parser.error("--recover requires --journal")
+    if options.backend != "redblack" and (options.compact or options.persistent):
+        parser.error("--compact and --persistent need the redblack backend")
+    if options.shards > 1:
+        if (
+            options.journal
+            or options.load_snapshot
+            or options.save_snapshot
+            or options.persistent
+            or options.parse_workers
+            or options.output_format != "text"
+        ):
+            parser.error(
+                "--shards cannot be combined with journaling, snapshots, "
+                "--persistent, --parse-workers or --output-format"
+            )
+        from shardedLibrary import runSharded
+
+        runSharded(
+            options.inputFilename,
+            options.shards,
+            echo=not options.quiet,
+            bulkLoad=options.bulk_load,
+            compact=options.compact,
+            stats=options.stats,
+            backend=options.backend,
+        )
+        sys.exit()
+    main(
+        options.inputFilename,
+        stream=options.stream,
+        echo=not options.quiet,
+        bulkLoad=options.bulk_load,
+        compact=options.compact,
+        loadSnapshot=options.load_snapshot,
+        saveSnapshot=options.save_snapshot,
+        journalPath=options.journal,
+        recover=options.recover,
+        stats=options.stats,
+        persistent=options.persistent,
+        backend=options.backend,
+        parseWorkers=options.parse_workers,
+        outputFormat=options.output_format,
+    )
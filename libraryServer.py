@@ -0,0 +1,242 @@
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from gatorLibrary import (
+    BOOK_INDEXES,
+    COMMAND_NAMES,
+    HANDLERS,
+    OPCODES,
+    QUIT,
+    LibrarySystem,
+    PersistentRedBlackTree,
+    compileCommand,
+)
+
+# Commands a connection runs before yielding to the event loop, so a long
+# pipeline from one client cannot starve the others
+YIELD_INTERVAL = 64
+# Pending connections the listening socket queues
+LISTEN_BACKLOG = 4096
+# Commands that touch files on the server, refused unless allowed
+FILE_OPCODES = {
+    OPCODES["SaveSnapshot"],
+    OPCODES["LoadSnapshot"],
+    OPCODES["ExtractBooks"],
+}
+# Read-only commands that can run on reader threads
+READ_OPCODES = {
+    OPCODES["PrintBook"],
+    OPCODES["PrintBooks"],
+    OPCODES["PrintBookSet"],
+    OPCODES["FindClosestBook"],
+    OPCODES["FindClosestBooks"],
+    OPCODES["CountBooks"],
+    OPCODES["KthBook"],
+    OPCODES["NextAvailableBook"],
+    OPCODES["ClosestAvailableBook"],
+    OPCODES["CountAvailable"],
+}
+# Responses a connection can have queued before it stops reading commands
+RESPONSE_QUEUE_SIZE = 256
+
+class LibraryServer:
+    # Serves one LibrarySystem to many connections. Each connection sends
+    # command lines and gets one response per line, in order, framed as
+    # "<byte count>\n<output>" (an empty output for commands without one).
+    # Mutations run to completion on the event loop thread, so those from
+    # all connections are applied one at a time in the order they are read.
+    # With reader threads, read-only commands run on a thread pool against
+    # the persistent tree's latest published version instead. A connection
+    # waits for its outstanding reads before running another command inline,
+    # so its reads never see its own later writes.
+    def __init__(self, library, allowFiles=False, readerThreads=0):
+        self.library = library
+        self.allowFiles = allowFiles
+        self.connections = 0
+        self.readers = None
+        if readerThreads:
+            if not isinstance(library.bookTree, PersistentRedBlackTree):
+                raise ValueError("reader threads need the persistent tree")
+            self.readers = ThreadPoolExecutor(readerThreads)
+
+    async def execute(self, line, pendingReads):
+        # Run one command line, returning (output, close connection). The
+        # output is a future when the command was handed to a reader thread,
+        # in which case it is also added to pendingReads.
+        stats = self.library.stats
+        if stats is not None:
+            started = time.perf_counter_ns()
+        try:
+            opcode, args = compileCommand(line)
+        except ValueError as e:
+            return f"Invalid command: {e}", False
+        if opcode == QUIT:
+            return "Program Terminated!!", True
+        if opcode in FILE_OPCODES and not self.allowFiles:
+            return f"{COMMAND_NAMES[opcode]} is disabled on this server", False
+        if self.readers is not None and opcode in READ_OPCODES:
+            future = asyncio.get_running_loop().run_in_executor(
+                self.readers, self.run, opcode, args
+            )
+            pendingReads.append(future)
+            return future, False
+        if pendingReads:
+            await asyncio.wait(pendingReads)
+            pendingReads.clear()
+        if stats is not None:
+            parsed = time.perf_counter_ns()
+            stats.recordLatency("(parse)", parsed - started)
+        output = self.run(opcode, args)
+        if stats is not None:
+            stats.recordLatency(COMMAND_NAMES[opcode], time.perf_counter_ns() - parsed)
+        return output, False
+
+    def run(self, opcode, args):
+        # Output of one command as text. It is rendered on the thread that
+        # ran the command, before later commands can change the books.
+        output = self.library.output.render(HANDLERS[opcode](self.library, *args))
+        return "" if output is None else output
+
+    async def handle(self, reader, writer):
+        # Read and run commands, queueing their outputs for send() to write
+        # in order as each becomes ready
+        self.connections += 1
+        responses = asyncio.Queue(RESPONSE_QUEUE_SIZE)
+        sender = asyncio.create_task(self.send(responses, writer))
+        handled = 0
+        # Reads of this connection still running on reader threads
+        pendingReads = []
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # Line longer than the stream limit
+                    await responses.put("Invalid command: line too long")
+                    break
+                if not line:
+                    break
+                line = line.decode("utf-8", "replace").strip()
+                if not line:
+                    continue
+                output, close = await self.execute(line, pendingReads)
+                await responses.put(output)
+                if close:
+                    break
+                handled += 1
+                if handled % YIELD_INTERVAL == 0:
+                    await asyncio.sleep(0)
+        except ConnectionError:
+            pass
+        finally:
+            await responses.put(None)
+            await sender
+            self.connections -= 1
+            writer.close()
+
+    async def send(self, responses, writer):
+        # Write queued outputs in order. Once the connection breaks, keep
+        # emptying the queue so handle() never waits on it.
+        broken = False
+        while True:
+            output = await responses.get()
+            if output is None:
+                break
+            if broken:
+                continue
+            if not isinstance(output, str):
+                output = await output
+            try:
+                writer.write(respond(output))
+                if responses.empty():
+                    await writer.drain()
+            except ConnectionError:
+                broken = True
+
+def respond(output):
+    data = output.encode("utf-8")
+    return b"%d\n%b" % (len(data), data)
+
+async def serve(server, host, port, unixPath=None):
+    if unixPath is not None:
+        listener = await asyncio.start_unix_server(
+            server.handle, unixPath, backlog=LISTEN_BACKLOG
+        )
+    else:
+        listener = await asyncio.start_server(
+            server.handle, host, port, backlog=LISTEN_BACKLOG
+        )
+    names = ", ".join(str(sock.getsockname()) for sock in listener.sockets)
+    print(f"Serving the library on {names}", flush=True)
+    async with listener:
+        await listener.serve_forever()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gator Library network server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", metavar="PATH", help="listen on a Unix socket instead")
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="store the book tree in parallel arrays to save memory",
+    )
+    parser.add_argument(
+        "--persistent",
+        action="store_true",
+        help="use the path-copying tree that readers can share while it changes",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=list(BOOK_INDEXES),
+        default="redblack",
+        help="ordered index to keep the books in (only redblack counts colour flips)",
+    )
+    parser.add_argument(
+        "--reader-threads",
+        type=int,
+        default=0,
+        metavar="N",
+        help="run PrintBook, PrintBooks, PrintBookSet, FindClosestBook(s), "
+        "CountBooks, KthBook and the available book queries on N threads "
+        "(implies --persistent)",
+    )
+    parser.add_argument(
+        "--load-snapshot",
+        metavar="PATH",
+        help="start from a library snapshot instead of an empty library",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="collect latency histograms and search statistics for Stats()",
+    )
+    parser.add_argument(
+        "--allow-snapshots",
+        action="store_true",
+        help="let clients run SaveSnapshot, LoadSnapshot and ExtractBooks on server paths",
+    )
+    options = parser.parse_args()
+    if options.reader_threads and options.compact:
+        parser.error("--reader-threads cannot be used with --compact")
+    persistent = options.persistent or options.reader_threads > 0
+    if options.backend != "redblack" and (options.compact or persistent):
+        parser.error("--compact, --persistent and --reader-threads need the redblack backend")
+    library = LibrarySystem(options.compact, persistent, options.backend)
+    if options.load_snapshot is not None:
+        library.loadSnapshot(options.load_snapshot)
+    if options.stats:
+        library.enableStats()
+    try:
+        asyncio.run(
+            serve(
+                LibraryServer(library, options.allow_snapshots, options.reader_threads),
+                options.host,
+                options.port,
+                options.unix,
+            )
+        )
+    except KeyboardInterrupt:
+        pass
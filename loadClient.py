@@ -0,0 +1,80 @@
+import argparse
+import asyncio
+import time
+from collections import deque
+
+from benchmark import WORKLOAD_MIXES, generateWorkload, percentile
+
+async def readResponse(reader):
+    # Read one "<byte count>\n<output>" response
+    header = await reader.readline()
+    if not header:
+        raise ConnectionError("server closed the connection")
+    return (await reader.readexactly(int(header))).decode("utf-8")
+
+async def runClient(connect, lines, depth, latencies):
+    # Send lines over one connection, keeping up to depth requests in
+    # flight, and record each request's round trip time
+    reader, writer = await connect()
+    sentAt = deque()
+    window = asyncio.Semaphore(depth)
+
+    async def receive():
+        for _ in lines:
+            await readResponse(reader)
+            latencies.append(time.perf_counter() - sentAt.popleft())
+            window.release()
+
+    receiver = asyncio.create_task(receive())
+    for line in lines:
+        await window.acquire()
+        sentAt.append(time.perf_counter())
+        writer.write(f"{line}\n".encode("utf-8"))
+        await writer.drain()
+    await receiver
+    writer.close()
+    await writer.wait_closed()
+
+async def runLoad(options):
+    if options.unix is not None:
+        connect = lambda: asyncio.open_unix_connection(options.unix)
+    else:
+        connect = lambda: asyncio.open_connection(options.host, options.port)
+    setup, measured = generateWorkload(options.mix, options.size, options.seed)
+    if setup and not options.no_setup:
+        # Load the catalogue over a single connection first
+        await runClient(connect, setup, options.depth, [])
+    # Deal the measured commands out to the clients round robin
+    shares = [measured[i :: options.clients] for i in range(options.clients)]
+    latencies = []
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(runClient(connect, share, options.depth, latencies) for share in shares if share)
+    )
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    print(
+        f"{len(latencies)} commands from {options.clients} clients in {elapsed:.2f}s: "
+        f"{len(latencies) / elapsed:.0f} ops/s, "
+        f"p50 {percentile(latencies, 0.5) * 1e3:.2f}ms, "
+        f"p99 {percentile(latencies, 0.99) * 1e3:.2f}ms"
+    )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load generator for libraryServer.py")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", metavar="PATH", help="connect to a Unix socket instead")
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument(
+        "--depth", type=int, default=8, help="requests each client keeps in flight"
+    )
+    parser.add_argument("--mix", choices=sorted(WORKLOAD_MIXES), default="churn")
+    parser.add_argument("--size", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--no-setup",
+        action="store_true",
+        help="do not preload the catalogue (the server already has it)",
+    )
+    asyncio.run(runLoad(parser.parse_args()))
@@ -0,0 +1,599 @@
+import heapq
+import multiprocessing
+from bisect import bisect_right
+from os.path import splitext
+
+from gatorLibrary import (
+    BULK_LOAD_MIN_RUN,
+    COMMAND_NAMES,
+    HANDLERS,
+    INSERT_BOOK,
+    OPCODES,
+    QUIT,
+    STREAM_BUFFER_SIZE,
+    UNCOUNTED_COLOR_FLIPS,
+    LibrarySystem,
+    OrderedIndex,
+    batchOutput,
+    cancelledMessage,
+    closestIds,
+    closestItems,
+    compileCommand,
+    formatPatron,
+)
+
+# Command lines the coordinator routes before waiting for the shards, not
+# counting a run of inserts at the end of the chunk
+SHARD_CHUNK_SIZE = 4096
+# A shard is hot when it gets this many times its fair share of a chunk's
+# point commands other than inserts...
+REBALANCE_FACTOR = 2.0
+# ...and the chunk had at least this many point commands
+REBALANCE_MIN_LOAD = 1024
+
+# Commands that act on one book, and the position of its bookId argument
+BOOK_ARGUMENT = {
+    OPCODES["InsertBook"]: 0,
+    OPCODES["PrintBook"]: 0,
+    OPCODES["BorrowBook"]: 1,
+    OPCODES["ReturnBook"]: 1,
+    OPCODES["DeleteBook"]: 0,
+    OPCODES["CancelReservation"]: 1,
+    OPCODES["UpdatePriority"]: 1,
+}
+# Commands that act on a list of books, the position of the list and the
+# shard operation returning the output for each of its books
+BOOK_LIST_ARGUMENT = {
+    OPCODES["BorrowBooks"]: (2, "borrowBooks"),
+    OPCODES["ReturnBooks"]: (1, "returnBooks"),
+    OPCODES["PrintBookSet"]: (0, "printBookSet"),
+}
+KTH_BOOK = OPCODES["KthBook"]
+PRINT_BOOKS = OPCODES["PrintBooks"]
+
+# Operations shards run for the coordinator besides the usual commands.
+# Each returns its shard's part of a scatter-gather command.
+def closestPart(library, targetId):
+    # (bookId, details) of the shard's nearest books below and above
+    # targetId, or None where it has none
+    return tuple(
+        None if node is None else (node.value.bookId, library.getBookDetails(node))
+        for node in library.bookTree.closest(targetId)
+    )
+
+def closestAvailablePart(library, targetId):
+    # As closestPart, among the shard's available books
+    return tuple(
+        None if node is None else (node.value.bookId, library.getBookDetails(node))
+        for node in library.bookTree.closestAvailable(targetId)
+    )
+
+def nextAvailablePart(library, bookId):
+    # Details of the shard's first available book at or after bookId, or None
+    node = library.bookTree.nextAvailable(bookId)
+    return None if node is None else library.getBookDetails(node)
+
+def closestBooksPart(library, targetId, k):
+    # (bookId, details) of the shard's k books nearest targetId
+    below, above = library.bookTree.nearest(targetId)
+    return [
+        (bookId, library.getBookDetails(node))
+        for bookId, node in closestItems(
+            targetId,
+            k,
+            ((node.value.bookId, node) for node in below),
+            ((node.value.bookId, node) for node in above),
+        )
+    ]
+
+def countPart(library, low, high):
+    return library.countBooks(low, high)
+
+def countAvailablePart(library, low, high):
+    return library.countAvailable(low, high)
+
+def deletePart(library, low, high):
+    return library.deleteBooks(low, high)
+
+def patronPart(library, patronId):
+    patron = library.patrons.get(patronId)
+    if patron is None:
+        return [], []
+    return list(patron.borrowed), list(patron.reservations)
+
+def cancelAllPart(library, patronId):
+    # Cancel the patron's reservations in this shard, returning the bookIds
+    patron = library.patrons.get(patronId)
+    if patron is None or not patron.reservations:
+        return []
+    bookIds = sorted(patron.reservations)
+    library.cancelAllReservations(patronId)
+    return bookIds
+
+def authorPart(library, authorName):
+    return [
+        (name, bookId, library.formatBook(book))
+        for name, bookId, book in library.authorEntries(authorName)
+    ]
+
+def titlePart(library, prefix):
+    return [
+        (title, bookId, library.formatBook(book))
+        for title, bookId, book in library.titleEntries(prefix)
+    ]
+
+def printBookSetPart(library, bookIds):
+    return [library.output.render(output) for output in library.printBookSet(bookIds)]
+
+def colorFlipPart(library):
+    if isinstance(library.bookTree, OrderedIndex):
+        return None
+    return library.bookTree.colorFlipCount
+
+def exportBooks(library, low, high):
+    # Remove the books with low <= bookId < high, returning them as
+    # insertBook arguments. Moving books is not counted as colour flips.
+    tree = library.bookTree
+    colorFlipCount = tree.colorFlipCount
+    records = []
+    for node in list(tree.rangeSearch(low, high)):
+        book = node.value
+        if book.bookId == high:
+            break
+        records.append(
+            (
+                book.bookId,
+                book.bookName,
+                book.authorName,
+                book.availability,
+                book.borrowedBy,
+                list(book.reservations.heap),
+            )
+        )
+    for record in records:
+        library.deleteBook(record[0])
+    tree.colorFlipCount = colorFlipCount
+    return records
+
+def importBooks(library, records):
+    colorFlipCount = library.bookTree.colorFlipCount
+    for record in records:
+        library.insertBook(*record)
+    library.bookTree.colorFlipCount = colorFlipCount
+
+SHARD_OPERATIONS = {
+    "closest": closestPart,
+    "closestBooks": closestBooksPart,
+    "count": countPart,
+    "closestAvailable": closestAvailablePart,
+    "nextAvailable": nextAvailablePart,
+    "countAvailable": countAvailablePart,
+    "delete": deletePart,
+    "patron": patronPart,
+    "cancelAll": cancelAllPart,
+    "author": authorPart,
+    "title": titlePart,
+    "colorFlips": colorFlipPart,
+    "export": exportBooks,
+    "import": importBooks,
+    "borrowBooks": LibrarySystem.borrowBooks,
+    "returnBooks": LibrarySystem.returnBooks,
+    "printBookSet": printBookSetPart,
+}
+
+def runBatch(library, batch, bulkLoad):
+    # Run a shard's (operation, arguments) list in order, returning the
+    # outputs. Operations are opcodes or SHARD_OPERATIONS names.
+    outputs = []
+    pendingInserts = []
+    for operation, args in batch:
+        if operation == INSERT_BOOK and bulkLoad:
+            pendingInserts.append(args)
+            outputs.append(None)
+            continue
+        if pendingInserts:
+            flushShardInserts(library, pendingInserts)
+        if isinstance(operation, str):
+            outputs.append(SHARD_OPERATIONS[operation](library, *args))
+        else:
+            outputs.append(library.output.render(HANDLERS[operation](library, *args)))
+    if pendingInserts:
+        flushShardInserts(library, pendingInserts)
+    return outputs
+
+def flushShardInserts(library, pendingInserts):
+    if len(pendingInserts) >= BULK_LOAD_MIN_RUN:
+        library.insertBooks(pendingInserts)
+    else:
+        for args in pendingInserts:
+            library.insertBook(*args)
+    pendingInserts.clear()
+
+def shardWorker(connection, compact, stats, bulkLoad, backend):
+    # Serve batches from the coordinator until it sends None
+    library = LibrarySystem(compact, backend=backend)
+    if stats:
+        library.enableStats()
+    while True:
+        batch = connection.recv()
+        if batch is None:
+            break
+        connection.send(runBatch(library, batch, bulkLoad))
+    connection.close()
+
+class ShardedLibrary:
+    # Coordinator for a library split by bookId range across worker
+    # processes, each with its own LibrarySystem. Shard i owns the bookIds
+    # from lows[i] up to lows[i + 1]. Commands are routed a chunk at a time:
+    # point commands go to the owning shard, the rest are scattered to the
+    # shards that may hold an answer, and every shard runs its part of the
+    # chunk in input order, so gathering the parts gives the same output as
+    # one process. Only ColorFlipCount differs, being the sum of the shards'
+    # counts. After each chunk a hot shard hands part of its range to its
+    # less busy neighbour.
+    def __init__(
+        self, shards, compact=False, stats=False, bulkLoad=False, backend="redblack"
+    ):
+        context = multiprocessing.get_context("spawn")
+        self.connections = []
+        self.workers = []
+        for _ in range(shards):
+            connection, workerConnection = context.Pipe()
+            worker = context.Process(
+                target=shardWorker,
+                args=(workerConnection, compact, stats, bulkLoad, backend),
+                daemon=True,
+            )
+            worker.start()
+            workerConnection.close()
+            self.connections.append(connection)
+            self.workers.append(worker)
+        # Set from the first chunk's bookIds
+        self.lows = None
+        self.moves = 0
+
+    def close(self):
+        for connection in self.connections:
+            connection.send(None)
+        for worker in self.workers:
+            worker.join()
+
+    def route(self, bookId):
+        return bisect_right(self.lows, bookId) - 1
+
+    def partition(self, bookIds):
+        # Split the bookId space at quantiles of bookIds
+        bookIds = sorted(set(bookIds))
+        shards = len(self.connections)
+        self.lows = [float("-inf")] + [
+            bookIds[len(bookIds) * i // shards] if bookIds else i
+            for i in range(1, shards)
+        ]
+
+    def scatter(self, opcode, args):
+        # (shard operation, arguments, shards) for a command that is not
+        # routed by bookId
+        everyShard = range(len(self.connections))
+        name = COMMAND_NAMES[opcode]
+        if name == "PrintBooks":
+            if args[0] > args[1]:
+                return opcode, args, []
+            return opcode, args, range(self.route(args[0]), self.route(args[1]) + 1)
+        if name == "CountBooks":
+            if args[0] > args[1]:
+                return "count", args, []
+            return "count", args, range(self.route(args[0]), self.route(args[1]) + 1)
+        if name == "CountAvailable":
+            if args[0] > args[1]:
+                return "countAvailable", args, []
+            return "countAvailable", args, range(self.route(args[0]), self.route(args[1]) + 1)
+        if name == "DeleteBooks":
+            if args[0] > args[1]:
+                return "delete", args, []
+            return "delete", args, range(self.route(args[0]), self.route(args[1]) + 1)
+        if name == "NextAvailableBook":
+            return "nextAvailable", args, range(self.route(args[0]), len(self.connections))
+        if name == "FindClosestBook":
+            return "closest", args, everyShard
+        if name == "ClosestAvailableBook":
+            return "closestAvailable", args, everyShard
+        if name == "FindClosestBooks":
+            return "closestBooks", args, everyShard if args[1] >= 0 else []
+        if name == "FindBooksByAuthor":
+            return "author", args, everyShard
+        if name == "FindBooksByTitlePrefix":
+            return "title", args, everyShard
+        if name == "PrintPatron":
+            return "patron", args, everyShard
+        if name == "CancelAllReservations":
+            return "cancelAll", args, everyShard
+        if name == "ColorFlipCount":
+            return "colorFlips", args, everyShard
+        if name == "Stats":
+            return opcode, args, everyShard
+        # SaveSnapshot, LoadSnapshot and ExtractBooks
+        return None, args, []
+
+    def gather(self, opcode, args, parts):
+        # Combine the shards' parts of a scattered command into its output
+        name = COMMAND_NAMES[opcode]
+        if name == "PrintBooks":
+            return "\n".join(part for part in parts if part)
+        if name == "CountBooks":
+            return f"Book Count: {sum(parts)}"
+        if name == "CountAvailable":
+            return f"Available Book Count: {sum(parts)}"
+        if name == "DeleteBooks":
+            # Shards are in bookId order, as are their parts
+            opLines = [opLine for part in parts for opLine in part]
+            if not opLines:
+                return f"No books found between {args[0]} and {args[1]}."
+            return batchOutput(opLines)
+        if name == "NextAvailableBook":
+            # Shards are in bookId order, so the first one with a book wins
+            for part in parts:
+                if part is not None:
+                    return part
+            return f"No available books found at or after {args[0]}."
+        if name in ("FindClosestBook", "ClosestAvailableBook"):
+            lowers = [part[0] for part in parts if part[0] is not None]
+            highers = [part[1] for part in parts if part[1] is not None]
+            lower = max(lowers) if lowers else None
+            higher = min(highers) if highers else None
+            details = dict(book for book in (lower, higher) if book is not None)
+            bookIds = closestIds(
+                args[0],
+                None if lower is None else lower[0],
+                None if higher is None else higher[0],
+            )
+            if not bookIds and name == "ClosestAvailableBook":
+                return "No available books found in the library."
+            return "\n".join(f"{details[bookId]}\n" for bookId in bookIds)
+        if name == "FindClosestBooks":
+            if args[1] < 0:
+                return "FindClosestBooks k cannot be negative."
+            targetId = args[0]
+            books = [book for part in parts for book in part]
+            below = sorted((book for book in books if book[0] <= targetId), reverse=True)
+            above = sorted(book for book in books if book[0] > targetId)
+            return "\n".join(
+                f"{details}\n"
+                for bookId, details in closestItems(targetId, args[1], iter(below), iter(above))
+            )
+        if name in ("FindBooksByAuthor", "FindBooksByTitlePrefix"):
+            books = [details for key, bookId, details in heapq.merge(*parts)]
+            if books:
+                return "\n".join(f"{book}\n" for book in books)
+            if name == "FindBooksByAuthor":
+                return f"No books found by author {args[0]}."
+            return f"No books found with title prefix {args[0]}."
+        if name == "PrintPatron":
+            return formatPatron(
+                args[0],
+                [bookId for borrowed, reserved in parts for bookId in borrowed],
+                [bookId for borrowed, reserved in parts for bookId in reserved],
+            )
+        if name == "CancelAllReservations":
+            bookIds = sorted(bookId for part in parts for bookId in part)
+            if not bookIds:
+                return f"Patron {args[0]} has no reservations."
+            return cancelledMessage(args[0], bookIds)
+        if name == "ColorFlipCount":
+            if None in parts:
+                return UNCOUNTED_COLOR_FLIPS
+            return f"Colour Flip Count: {sum(parts)}"
+        if name == "Stats":
+            return "\n".join(f"Shard {i}:\n{part}" for i, part in enumerate(parts))
+        return f"{name} is not supported in sharded mode"
+
+    def runChunk(self, commands):
+        # Run a list of (opcode, arguments) commands across the shards and
+        # return their outputs in order. KthBook and PrintBooks pages need
+        # book positions across the shards, so they split the chunk and run
+        # on their own.
+        if self.lows is None:
+            self.partition(
+                [args[BOOK_ARGUMENT[opcode]] for opcode, args in commands if opcode in BOOK_ARGUMENT]
+            )
+        outputs = []
+        start = 0
+        for i, (opcode, args) in enumerate(commands):
+            if opcode == KTH_BOOK or (opcode == PRINT_BOOKS and len(args) == 4):
+                outputs.extend(self.runRound(commands[start:i]))
+                outputs.append(self.runPositional(opcode, args))
+                start = i + 1
+        outputs.extend(self.runRound(commands[start:] if start else commands))
+        return outputs
+
+    def runRound(self, commands):
+        # Run commands that each need one exchange with the shards
+        batches = [[] for _ in self.connections]
+        # Per command, the (shard, batch position) of each of its parts
+        plans = []
+        loads = [0] * len(batches)
+        routedIds = [[] for _ in batches]
+        for opcode, args in commands:
+            position = BOOK_ARGUMENT.get(opcode)
+            if position is not None:
+                shard = self.route(args[position])
+                plans.append([(shard, len(batches[shard]))])
+                batches[shard].append((opcode, args))
+                # Appended ids always land past the last shard's low, so
+                # moving ranges around would not spread a run of inserts
+                if opcode != INSERT_BOOK:
+                    loads[shard] += 1
+                    routedIds[shard].append(args[position])
+            elif opcode in BOOK_LIST_ARGUMENT:
+                # Each shard gets the books of the list it owns, in order,
+                # and the plan has one part per book
+                position, operation = BOOK_LIST_ARGUMENT[opcode]
+                bookShards = [self.route(bookId) for bookId in args[position]]
+                shardIds = {}
+                for bookId, shard in zip(args[position], bookShards):
+                    shardIds.setdefault(shard, []).append(bookId)
+                    loads[shard] += 1
+                    routedIds[shard].append(bookId)
+                indexes = {}
+                for shard, bookIds in shardIds.items():
+                    indexes[shard] = len(batches[shard])
+                    batches[shard].append((operation, args[:position] + (bookIds,)))
+                plans.append([(shard, indexes[shard]) for shard in bookShards])
+            else:
+                operation, operationArgs, shards = self.scatter(opcode, args)
+                plan = []
+                for shard in shards:
+                    plan.append((shard, len(batches[shard])))
+                    batches[shard].append((operation, operationArgs))
+                plans.append(plan)
+        for connection, batch in zip(self.connections, batches):
+            if batch:
+                connection.send(batch)
+        results = [
+            connection.recv() if batch else []
+            for connection, batch in zip(self.connections, batches)
+        ]
+        outputs = []
+        for (opcode, args), plan in zip(commands, plans):
+            if opcode in BOOK_LIST_ARGUMENT:
+                parts = {part: iter(results[part[0]][part[1]]) for part in plan}
+                outputs.append(batchOutput([next(parts[part]) for part in plan]))
+                continue
+            parts = [results[shard][index] for shard, index in plan]
+            if opcode in BOOK_ARGUMENT:
+                outputs.append(parts[0])
+            else:
+                outputs.append(self.gather(opcode, args, parts))
+        self.rebalance(loads, routedIds)
+        return outputs
+
+    def runPositional(self, opcode, args):
+        # Ask the shards overlapping the range how many of its books they
+        # hold, then ask those holding the wanted positions for their part
+        if opcode == KTH_BOOK:
+            if args[0] < 1:
+                return f"Book number {args[0]} not found in the library."
+            low, high, offset, limit = float("-inf"), float("inf"), args[0] - 1, 1
+        else:
+            low, high, offset, limit = args
+            if offset < 0 or limit < 0:
+                return "PrintBooks offset and limit cannot be negative."
+        shards = range(self.route(low), self.route(high) + 1) if low <= high else []
+        counts = self.call({shard: [("count", (low, high))] for shard in shards})
+        requests = {}
+        for shard in shards:
+            count = counts[shard][0]
+            if offset >= count:
+                offset -= count
+                continue
+            if limit == 0:
+                break
+            take = min(count - offset, limit)
+            if opcode == KTH_BOOK:
+                requests[shard] = [(opcode, (offset + 1,))]
+            else:
+                requests[shard] = [(opcode, (low, high, offset, take))]
+            offset = 0
+            limit -= take
+        results = self.call(requests)
+        if opcode == KTH_BOOK and not results:
+            return f"Book number {args[0]} not found in the library."
+        return "\n".join(
+            results[shard][0] for shard in sorted(results) if results[shard][0]
+        )
+
+    def call(self, requests):
+        # Send shards their batches, returning each one's outputs by shard
+        for shard, batch in requests.items():
+            self.connections[shard].send(batch)
+        return {shard: self.connections[shard].recv() for shard in requests}
+
+    def rebalance(self, loads, routedIds):
+        # Give half of the hottest shard's traffic to its quieter neighbour
+        total = sum(loads)
+        shards = len(loads)
+        if shards < 2 or total < REBALANCE_MIN_LOAD:
+            return
+        hot = max(range(shards), key=loads.__getitem__)
+        if loads[hot] * shards < REBALANCE_FACTOR * total:
+            return
+        bookIds = sorted(routedIds[hot])
+        split = bookIds[len(bookIds) // 2]
+        if split == bookIds[0]:
+            # One book takes all the traffic; splitting would not help
+            return
+        high = self.lows[hot + 1] if hot + 1 < shards else float("inf")
+        if hot > 0 and (hot == shards - 1 or loads[hot - 1] <= loads[hot + 1]):
+            self.move(hot, hot - 1, self.lows[hot], split)
+            self.lows[hot] = split
+        else:
+            self.move(hot, hot + 1, split, high)
+            self.lows[hot + 1] = split
+
+    def move(self, source, target, low, high):
+        # Move the books with low <= bookId < high between shards
+        self.connections[source].send([("export", (low, high))])
+        records = self.connections[source].recv()[0]
+        self.connections[target].send([("import", (records,))])
+        self.connections[target].recv()
+        self.moves += 1
+
+def runShardedCommands(library, lines, write, echo=True):
+    # As runCommands, routing chunks of commands through a ShardedLibrary
+    commands = []
+    # Output for each command in commands: an index into the chunk's
+    # outputs, or the text of an invalid command report
+    slots = []
+    quit = False
+    for lineNumber, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            opcode, args = compileCommand(line)
+        except ValueError as e:
+            slots.append(f"Invalid command on line {lineNumber}: {e}")
+            continue
+        if opcode == QUIT:
+            quit = True
+            break
+        if echo:
+            print(COMMAND_NAMES[opcode])
+        slots.append(len(commands))
+        commands.append((opcode, args))
+        # A run of inserts stays in one chunk so the shards can bulk load it
+        if len(commands) >= SHARD_CHUNK_SIZE and opcode != INSERT_BOOK:
+            writeChunk(library, commands, slots, write)
+    writeChunk(library, commands, slots, write)
+    if quit:
+        if echo:
+            print("Quit")
+        print("Output printed to file")
+        write("Program Terminated!!\n")
+
+def writeChunk(library, commands, slots, write):
+    outputs = library.runChunk(commands) if commands else []
+    for slot in slots:
+        outputLine = slot if isinstance(slot, str) else outputs[slot]
+        if outputLine is not None:
+            write(f"{outputLine}\n\n\n")
+    commands.clear()
+    slots.clear()
+
+def runSharded(
+    inputFilename,
+    shards,
+    echo=True,
+    bulkLoad=False,
+    compact=False,
+    stats=False,
+    backend="redblack",
+):
+    library = ShardedLibrary(shards, compact, stats, bulkLoad, backend)
+    outputFilename = splitext(inputFilename)[0] + "_output_file.txt"
+    try:
+        with open(inputFilename, "r") as file, open(
+            outputFilename, "w", buffering=STREAM_BUFFER_SIZE
+        ) as outputFile:
+            runShardedCommands(library, file, outputFile.write, echo)
+    finally:
+        library.close()
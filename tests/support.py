@@ -0,0 +1,147 @@
+import random
+
+from gatorLibrary import (
+    AVAILABLE,
+    BTreeIndex,
+    SortedArrayIndex,
+    compileLines,
+    runCommands,
+)
+
+# Constructor options of every kind of library, for tests to run in each
+LIBRARY_MODES = [
+    {},
+    {"compact": True},
+    {"persistent": True},
+    {"backend": "btree"},
+    {"backend": "sortedarray"},
+]
+
+def run(library, lines, **options):
+    # Run command lines against library and return everything written
+    written = []
+    options.setdefault("echo", False)
+    runCommands(library, compileLines(lines), written.append, **options)
+    return "".join(written)
+
+def libraryState(library):
+    # Everything a library holds that commands can observe
+    books = [
+        (
+            node.value.bookId,
+            node.value.bookName,
+            node.value.authorName,
+            node.value.availability,
+            node.value.borrowedBy,
+            node.value.getReservations(),
+        )
+        for node in library.bookTree.inorder()
+    ]
+    patrons = {
+        patronId: (sorted(patron.borrowed), sorted(patron.reservations))
+        for patronId, patron in library.patrons.items()
+    }
+    return books, patrons
+
+def randomCommands(seed, count=600, idSpace=200):
+    # Reproducible mix of every command type over a small bookId space, so
+    # books are reinserted, borrowed, reserved and deleted many times
+    rng = random.Random(seed)
+    lines = []
+    for _ in range(count):
+        bookId = rng.randint(1, idSpace)
+        other = rng.randint(1, idSpace)
+        low, high = min(bookId, other), max(bookId, other)
+        patronId = rng.randint(1, 12)
+        ids = ", ".join(str(rng.randint(1, idSpace)) for _ in range(rng.randint(1, 4)))
+        lines.append(
+            rng.choice(
+                [
+                    f'InsertBook({bookId}, "Book{bookId}", "Author{bookId % 7}", "Yes")',
+                    f'InsertBook({bookId}, "Book{bookId}", "Author{bookId % 7}", "Yes")',
+                    f"PrintBook({bookId})",
+                    f"PrintBooks({low}, {high})",
+                    f"PrintBooks({low}, {high}, {rng.randint(0, 3)}, {rng.randint(0, 5)})",
+                    f"BorrowBook({patronId}, {bookId}, {rng.randint(1, 5)})",
+                    f"BorrowBook({patronId}, {bookId}, {rng.randint(1, 5)})",
+                    f"ReturnBook({patronId}, {bookId})",
+                    f"DeleteBook({bookId})",
+                    f"FindClosestBook({bookId})",
+                    f"FindClosestBooks({bookId}, {rng.randint(0, 4)})",
+                    f"CountBooks({low}, {high})",
+                    f"KthBook({rng.randint(0, 60)})",
+                    f"NextAvailableBook({bookId})",
+                    f"ClosestAvailableBook({bookId})",
+                    f"CountAvailable({low}, {high})",
+                    f"BorrowBooks({patronId}, {rng.randint(1, 5)}, [{ids}])",
+                    f"ReturnBooks({patronId}, [{ids}])",
+                    f"PrintBookSet([{ids}])",
+                    f"DeleteBooks({low}, {min(high, low + 10)})",
+                    f"CancelReservation({patronId}, {bookId})",
+                    f"UpdatePriority({patronId}, {bookId}, {rng.randint(1, 5)})",
+                    f"PrintPatron({patronId})",
+                    f"CancelAllReservations({patronId})",
+                    f'FindBooksByAuthor("Author{bookId % 7}")',
+                    f'FindBooksByTitlePrefix("Book{bookId % 10}")',
+                ]
+            )
+        )
+    return lines
+
+def withoutColourFlips(output):
+    # Output with the ColorFlipCount results dropped, for comparing trees
+    # that balance differently
+    return "\n".join(
+        line for line in output.split("\n") if not line.startswith("Colour")
+    )
+
+def isAvailable(book):
+    return int(book.availability == AVAILABLE)
+
+def checkTree(tree):
+    # Assert the balance rules of the tree and the size and available count
+    # it keeps for every subtree
+    if isinstance(tree, BTreeIndex):
+        leafDepths = set()
+        def checkNode(node, depth):
+            assert node.ids == [book.bookId for book in node.books]
+            if not node.children:
+                leafDepths.add(depth)
+            for child in node.children:
+                checkNode(child, depth + 1)
+            assert node.size == len(node.books) + sum(child.size for child in node.children)
+            assert node.available == sum(map(isAvailable, node.books)) + sum(
+                child.available for child in node.children
+            )
+        checkNode(tree.root, 0)
+        assert len(leafDepths) == 1
+        assert tree.root.size == tree.size
+    elif isinstance(tree, SortedArrayIndex):
+        for ids, books, last, available in zip(
+            tree.idBlocks, tree.blocks, tree.maxes, tree.availableCounts
+        ):
+            assert ids == [book.bookId for book in books] and ids[-1] == last
+            assert available == sum(map(isAvailable, books))
+        assert sum(map(len, tree.blocks)) == tree.size
+        for block in range(len(tree.blocks) + 1):
+            assert tree.blockSizes.prefix(block) == sum(map(len, tree.blocks[:block]))
+            assert tree.blockAvailable.prefix(block) == sum(tree.availableCounts[:block])
+    else:
+        def checkNode(node):
+            # Number of black nodes on every path down from node
+            if node == tree.nil:
+                return 1
+            if node.red:
+                assert not node.l.red and not node.r.red
+            blackHeight = checkNode(node.l)
+            assert checkNode(node.r) == blackHeight
+            assert node.size == node.l.size + node.r.size + 1
+            assert node.available == (
+                node.l.available + node.r.available + isAvailable(node.value)
+            )
+            return blackHeight + (not node.red)
+        assert not tree.root.red
+        checkNode(tree.root)
+        assert tree.root.size == tree.size
+    ids = [node.value.bookId for node in tree.inorder()]
+    assert ids == sorted(set(ids)) and len(ids) == tree.size
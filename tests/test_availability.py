@@ -0,0 +1,48 @@
+import random
+
+import pytest
+
+from gatorLibrary import AVAILABLE, LibrarySystem
+from support import LIBRARY_MODES, checkTree, randomCommands, run
+
+def bookId(node):
+    return None if node is None else node.value.bookId
+
+@pytest.mark.parametrize("options", LIBRARY_MODES)
+def test_available_queries_match_a_scan(options):
+    library = LibrarySystem(**options)
+    rng = random.Random(21)
+    lines = randomCommands(21, count=2000, idSpace=300)
+    for start in range(0, len(lines), 100):
+        run(library, lines[start : start + 100])
+        checkTree(library.bookTree)
+        available = [
+            node.value.bookId
+            for node in library.bookTree.inorder()
+            if node.value.availability == AVAILABLE
+        ]
+        for _ in range(30):
+            low, high = sorted(rng.randint(0, 301) for _ in range(2))
+            assert library.countAvailable(low, high) == sum(
+                low <= i <= high for i in available
+            )
+            target = rng.randint(0, 301)
+            above = [i for i in available if i >= target]
+            below = [i for i in available if i <= target]
+            assert bookId(library.bookTree.nextAvailable(target)) == (above[0] if above else None)
+            lower, higher = library.bookTree.closestAvailable(target)
+            assert (bookId(lower), bookId(higher)) == (
+                below[-1] if below else None,
+                above[0] if above else None,
+            )
+
+def test_borrowing_the_last_copy_moves_next_available():
+    library = LibrarySystem()
+    run(library, [f'InsertBook({i}, "Book{i}", "Author{i}", "Yes")' for i in (5, 10, 15)])
+    run(library, ["BorrowBook(1, 10, 1)"])
+    assert "BookID = 15" in run(library, ["NextAvailableBook(6)"])
+    assert run(library, ["CountAvailable(1, 20)"]).strip() == "Available Book Count: 2"
+    run(library, ["BorrowBook(2, 15, 1)", "BorrowBook(3, 5, 1)"])
+    assert run(library, ["NextAvailableBook(6)"]).strip() == "No available books found at or after 6."
+    run(library, ["ReturnBook(1, 10)"])
+    assert "BookID = 10" in run(library, ["NextAvailableBook(6)"])
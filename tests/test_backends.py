@@ -0,0 +1,66 @@
+import random
+
+import pytest
+
+from gatorLibrary import (
+    UNCOUNTED_COLOR_FLIPS,
+    BTreeIndex,
+    FenwickTree,
+    LibrarySystem,
+    SortedArrayIndex,
+)
+from support import checkTree, libraryState, randomCommands, run, withoutColourFlips
+
+@pytest.fixture(autouse=True)
+def smallNodes(monkeypatch):
+    # Small nodes and blocks so a few hundred books split and merge them
+    monkeypatch.setattr(BTreeIndex, "MIN_DEGREE", 2)
+    monkeypatch.setattr(SortedArrayIndex, "BLOCK_SIZE", 4)
+
+@pytest.mark.parametrize("seed", range(4))
+@pytest.mark.parametrize("backend", ["btree", "sortedarray"])
+def test_matches_red_black_tree(backend, seed):
+    lines = randomCommands(seed, count=1500, idSpace=400)
+    index = LibrarySystem(backend=backend)
+    baseline = LibrarySystem()
+    for start in range(0, len(lines), 250):
+        chunk = lines[start : start + 250]
+        assert run(index, chunk) == run(baseline, chunk)
+        checkTree(index.bookTree)
+    assert libraryState(index) == libraryState(baseline)
+    assert index.bookTree.size == baseline.bookTree.size
+
+@pytest.mark.parametrize("backend", ["btree", "sortedarray"])
+def test_bulk_load_into_a_filled_index(backend):
+    # The second run is larger than the index, so it is merged in and the
+    # index rebuilt
+    lines = [f'InsertBook({i}, "Book{i}", "Author{i}", "Yes")' for i in range(1, 3001, 3)]
+    lines.append("PrintBook(1)")
+    lines += [f'InsertBook({i}, "Book{i}", "Author{i}", "Yes")' for i in range(3100, 100, -2)]
+    index = LibrarySystem(backend=backend)
+    baseline = LibrarySystem()
+    run(index, lines, bulkLoad=True)
+    run(baseline, lines)
+    checkTree(index.bookTree)
+    assert libraryState(index) == libraryState(baseline)
+    output = run(index, ["ColorFlipCount()"] + randomCommands(6, count=300))
+    assert output.startswith(UNCOUNTED_COLOR_FLIPS)
+    assert withoutColourFlips(output) == withoutColourFlips(
+        run(baseline, ["ColorFlipCount()"] + randomCommands(6, count=300))
+    )
+
+def test_fenwick_tree_matches_list_sums():
+    rng = random.Random(23)
+    counts = [rng.randint(0, 5) for _ in range(37)]
+    tree = FenwickTree(counts)
+    for _ in range(500):
+        index = rng.randrange(len(counts))
+        change = rng.randint(-counts[index], 5)
+        counts[index] += change
+        tree.add(index, change)
+        count = rng.randint(0, len(counts))
+        assert tree.prefix(count) == sum(counts[:count])
+        position = rng.randint(0, sum(counts) + 3)
+        index, within = tree.find(position)
+        assert sum(counts[:index]) + within == position
+        assert index == len(counts) or within < counts[index]
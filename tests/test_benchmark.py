@@ -0,0 +1,73 @@
+import json
+import sys
+
+import pytest
+
+import benchmark
+
+def runBenchmark(monkeypatch, *arguments):
+    monkeypatch.setattr(sys, "argv", ["benchmark.py", *arguments])
+    benchmark.main()
+
+def test_compare_runs_and_reports(tmp_path, monkeypatch, capsys):
+    # A tiny workload, run twice and the second compared with the first
+    basePath = tmp_path / "base.json"
+    newPath = tmp_path / "new.json"
+    options = ["--size", "200", "--mix", "insert", "churn", "--in-process"]
+    runBenchmark(monkeypatch, *options, "--output", str(basePath))
+    # No drop in throughput counts as a regression at this threshold
+    runBenchmark(
+        monkeypatch,
+        *options,
+        "--output",
+        str(newPath),
+        "--compare",
+        str(basePath),
+        "--threshold",
+        "1",
+    )
+    report = json.loads(newPath.read_text())
+    assert set(report) == {"python", "platform", "script", "timestamp", "results"}
+    assert [(result["workload"], result["size"]) for result in report["results"]] == [
+        ("insert", 200),
+        ("churn", 200),
+    ]
+    for result in report["results"]:
+        assert result["compact"] is False and result["backend"] == "redblack"
+        assert sum(command["count"] for command in result["commands"].values()) == 200
+        for command in result["commands"].values():
+            assert set(command) == {"count", "opsPerSec", "p50Us", "p99Us"}
+            assert command["p50Us"] <= command["p99Us"]
+    assert "REGRESSION" not in capsys.readouterr().out
+
+def churnResult(opsPerSec, **fields):
+    result = {
+        "workload": "churn",
+        "size": 10,
+        "compact": False,
+        "commands": {"BorrowBook": {"opsPerSec": opsPerSec}},
+    }
+    result.update(fields)
+    return result
+
+def test_compare_flags_throughput_drops(capsys):
+    # Results from before --backend existed compare as redblack
+    baseline = {"results": [churnResult(1000)]}
+    assert benchmark.compareResults(baseline, [churnResult(850, backend="redblack")], 0.2) == 0
+    assert benchmark.compareResults(baseline, [churnResult(700, backend="redblack")], 0.2) == 1
+    assert benchmark.compareResults(baseline, [churnResult(700, backend="btree")], 0.2) == 0
+    assert "REGRESSION churn/BorrowBook: 0.70x" in capsys.readouterr().out
+
+def test_regressions_fail_the_run(tmp_path, monkeypatch):
+    basePath = tmp_path / "base.json"
+    options = ["--size", "100", "--mix", "closest", "--in-process"]
+    runBenchmark(monkeypatch, *options, "--output", str(basePath))
+    report = json.loads(basePath.read_text())
+    for command in report["results"][0]["commands"].values():
+        command["opsPerSec"] *= 1000
+    basePath.write_text(json.dumps(report))
+    with pytest.raises(SystemExit) as error:
+        runBenchmark(
+            monkeypatch, *options, "--output", str(tmp_path / "new.json"), "--compare", str(basePath)
+        )
+    assert error.value.code == 1
@@ -0,0 +1,27 @@
+import pytest
+
+from gatorLibrary import BULK_LOAD_MIN_RUN, LibrarySystem
+from support import LIBRARY_MODES, libraryState, randomCommands, run, withoutColourFlips
+
+INSERTS = [
+    f'InsertBook({bookId}, "Book{bookId}", "Author{bookId % 5}", "Yes")'
+    for bookId in range(3 * BULK_LOAD_MIN_RUN, 0, -3)
+]
+
+def test_inserts_run_one_at_a_time_by_default():
+    library = LibrarySystem()
+    output = run(library, INSERTS + ["ColorFlipCount()"])
+    reference = LibrarySystem()
+    for line in INSERTS:
+        run(reference, [line])
+    assert output == run(reference, ["ColorFlipCount()"])
+    assert libraryState(library) == libraryState(reference)
+
+@pytest.mark.parametrize("options", LIBRARY_MODES)
+def test_bulk_load_changes_only_the_tree_shape(options):
+    lines = INSERTS + randomCommands(5, count=300)
+    bulk = LibrarySystem(**options)
+    single = LibrarySystem(**options)
+    bulkOutput = run(bulk, lines, bulkLoad=True)
+    assert withoutColourFlips(bulkOutput) == withoutColourFlips(run(single, lines))
+    assert libraryState(bulk) == libraryState(single)
@@ -0,0 +1,61 @@
+import random
+
+import pytest
+
+from gatorLibrary import BookNode, BTreeIndex, LibrarySystem, SortedArrayIndex, closestItems
+from support import LIBRARY_MODES
+
+@pytest.fixture(autouse=True)
+def smallNodes(monkeypatch):
+    monkeypatch.setattr(BTreeIndex, "MIN_DEGREE", 2)
+    monkeypatch.setattr(SortedArrayIndex, "BLOCK_SIZE", 4)
+
+def closestByScan(ids, targetId, k):
+    # Every bookId by distance, lower first on ties; the k nearest and any
+    # as near as the last of them
+    ranked = sorted(ids, key=lambda bookId: (abs(bookId - targetId), bookId))
+    if k < 1:
+        return []
+    last = abs(ranked[min(k, len(ranked)) - 1] - targetId) if ranked else 0
+    return ranked[:k] + [
+        bookId for bookId in ranked[k:] if abs(bookId - targetId) == last
+    ]
+
+@pytest.mark.parametrize("options", LIBRARY_MODES)
+def test_nearest_matches_a_scan(options):
+    rng = random.Random(19)
+    for size in (0, 1, 2, 5, 30, 200):
+        library = LibrarySystem(**options)
+        # Even bookIds only, so odd targets fall halfway between two books
+        ids = rng.sample(range(2, 1000, 2), size)
+        for bookId in ids:
+            library.bookTree.insert(BookNode(bookId, '"B"', '"A"', '"Yes"'))
+        for bookId in ids[: size // 3]:
+            library.bookTree.delete(bookId)
+            ids.remove(bookId)
+        targets = [-5, 0, 1, 999, 1005] + [rng.randint(0, 1000) for _ in range(40)]
+        if ids:
+            targets += [min(ids), max(ids), min(ids) - 1, max(ids) + 1]
+        for targetId in targets:
+            below, above = library.bookTree.nearest(targetId)
+            assert [node.value.bookId for node in below] == sorted(
+                (bookId for bookId in ids if bookId <= targetId), reverse=True
+            )
+            assert [node.value.bookId for node in above] == sorted(
+                bookId for bookId in ids if bookId > targetId
+            )
+            for k in (0, 1, 2, 3, len(ids), len(ids) + 3):
+                found = [book.bookId for book in library.findClosestBooks(targetId, k)]
+                assert found == closestByScan(ids, targetId, k), (targetId, k)
+
+def pairs(ids):
+    return iter([(bookId, bookId) for bookId in ids])
+
+def test_closest_items_ties():
+    # 4 and 6 are both 1 from 5: the lower comes first and a tie at the
+    # cut is kept
+    assert closestItems(5, 1, pairs([4, 2]), pairs([6, 8])) == [(4, 4), (6, 6)]
+    assert closestItems(5, 3, pairs([4, 2]), pairs([6, 8])) == [(4, 4), (6, 6), (2, 2), (8, 8)]
+    assert closestItems(5, 2, pairs([5, 3]), pairs([7])) == [(5, 5), (3, 3), (7, 7)]
+    assert closestItems(5, 4, pairs([]), pairs([9])) == [(9, 9)]
+    assert closestItems(5, 0, pairs([4]), pairs([6])) == []
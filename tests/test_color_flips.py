@@ -0,0 +1,32 @@
+import random
+
+import pytest
+
+from gatorLibrary import BookNode, LibrarySystem
+from support import checkTree
+
+def colours(tree):
+    return {node.value.bookId: node.red for node in tree.inorder()}
+
+def snapshotFlips(before, after):
+    # What delete once counted from colour snapshots of the whole tree: the
+    # books in it both before and after whose colour differs
+    return sum(1 for bookId, red in before.items() if bookId in after and after[bookId] != red)
+
+@pytest.mark.parametrize("options", [{}, {"compact": True}, {"persistent": True}])
+@pytest.mark.parametrize("seed", range(3))
+def test_delete_counts_match_whole_tree_snapshots(options, seed):
+    # Inserts count their flips case by case in fixInsert, as they always
+    # have; they run in between so deletes meet every tree shape
+    rng = random.Random(seed)
+    tree = LibrarySystem(**options).bookTree
+    for _ in range(4000):
+        bookId = rng.randint(1, 300)
+        if rng.random() < 0.55:
+            tree.insert(BookNode(bookId, '"B"', '"A"', '"Yes"'))
+            continue
+        before = colours(tree)
+        count = tree.colorFlipCount
+        tree.delete(bookId)
+        assert tree.colorFlipCount - count == snapshotFlips(before, colours(tree))
+    checkTree(tree)
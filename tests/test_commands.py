@@ -0,0 +1,58 @@
+import pytest
+
+from gatorLibrary import LibrarySystem, compileCommand
+from support import run
+
+def test_commas_inside_quotes_stay_in_the_name():
+    library = LibrarySystem()
+    output = run(
+        library,
+        [
+            'InsertBook(9, "B, Vol 2", "Smith, John", "Yes")',
+            'InsertBook(10, "C", "Smith", "Yes")',
+            "PrintBook(9)",
+            'FindBooksByAuthor("Smith, John")',
+            'FindBooksByTitlePrefix("B, V")',
+        ],
+    )
+    book = 'BookID = 9\nTitle = "B, Vol 2"\nAuthor = "Smith, John"\n'
+    assert output.count(book) == 3
+    assert "BookID = 10" not in output
+
+@pytest.mark.parametrize(
+    "line, arguments",
+    [
+        ("BorrowBooks(1, 2, [3, 4, 3])", (1, 2, [3, 4, 3])),
+        ("ReturnBooks( 1 ,[ 2 ] )", (1, [2])),
+        ("PrintBookSet([])", ([],)),
+        ("PrintBookSet([ ])", ([],)),
+    ],
+)
+def test_lists_are_one_argument(line, arguments):
+    assert compileCommand(line)[1] == arguments
+
+@pytest.mark.parametrize(
+    "line, message",
+    [
+        ("BorrowBooks(1, 2, 3)", "BorrowBooks was given '3' where a [list] of IDs belongs"),
+        ("ReturnBooks(1, [2, 3)", "ReturnBooks was given an unclosed [list] of IDs '[2, 3'"),
+        ("PrintBookSet(1, 2)", "PrintBookSet takes 1 argument(s) but was given 2"),
+        ("BorrowBooks(1, 2, [3], 4)", "BorrowBooks takes 3 argument(s) but was given 4"),
+        ("BorrowBooks(1, [2])", "BorrowBooks takes 3 argument(s) but was given 2"),
+        ("PrintBookSet([1, x])", "PrintBookSet was given a non-numeric ID or priority"),
+        ('InsertBook(9, "B, Vol 2", "X")', "InsertBook takes 4 argument(s) but was given 3"),
+        ('InsertBook(9, "B, Vol 2, "X", "Yes")', "InsertBook takes 4 argument(s) but was given 2"),
+    ],
+)
+def test_malformed_arguments_are_named(line, message):
+    with pytest.raises(ValueError) as error:
+        compileCommand(line)
+    assert str(error.value) == message
+
+def test_malformed_line_is_reported_and_skipped():
+    library = LibrarySystem()
+    output = run(library, ['InsertBook(1, "A", "B", "Yes")', "BorrowBooks(1, 2, 1)", "PrintBook(1)"])
+    assert output.startswith(
+        "Invalid command on line 2: BorrowBooks was given '1' where a [list] of IDs belongs"
+    )
+    assert "BookID = 1" in output
@@ -0,0 +1,60 @@
+import gc
+import random
+import tracemalloc
+
+import pytest
+
+from gatorLibrary import AVAILABLE, LibrarySystem
+from support import checkTree, libraryState, randomCommands, run
+
+@pytest.mark.parametrize("seed", range(4))
+def test_matches_pointer_tree(seed):
+    # The same algorithms run on both, so even the colour flips agree
+    lines = randomCommands(seed, count=1500, idSpace=400)
+    lines[::50] = ["ColorFlipCount()"] * len(lines[::50])
+    compact = LibrarySystem(compact=True)
+    baseline = LibrarySystem()
+    for start in range(0, len(lines), 250):
+        chunk = lines[start : start + 250]
+        assert run(compact, chunk) == run(baseline, chunk)
+        checkTree(compact.bookTree)
+    assert libraryState(compact) == libraryState(baseline)
+
+def test_bulk_load_matches_pointer_tree():
+    lines = [f'InsertBook({i}, "Book{i}", "Author{i}", "Yes")' for i in range(1, 3001, 3)]
+    lines += ["BorrowBook(1, 4, 1)", "BorrowBook(2, 4, 1)"]
+    lines += [f'InsertBook({i}, "Book{i}", "Author{i}", "Yes")' for i in range(3100, 100, -2)]
+    lines += randomCommands(8, count=300) + ["ColorFlipCount()"]
+    compact = LibrarySystem(compact=True)
+    baseline = LibrarySystem()
+    assert run(compact, lines, bulkLoad=True) == run(baseline, lines, bulkLoad=True)
+    checkTree(compact.bookTree)
+    assert libraryState(compact) == libraryState(baseline)
+
+def test_deleted_slots_are_reused():
+    library = LibrarySystem(compact=True)
+    inserts = [f'InsertBook({i}, "Book{i}", "Author{i}", "Yes")' for i in range(1, 201)]
+    run(library, inserts)
+    slots = len(library.bookTree.keys)
+    run(library, [f"DeleteBook({i})" for i in range(1, 101)] + ["DeleteBooks(150, 200)"])
+    assert len(library.bookTree.free) == 151
+    run(library, inserts)
+    checkTree(library.bookTree)
+    assert len(library.bookTree.keys) == slots
+    assert not library.bookTree.free
+
+def libraryMemory(options, books):
+    gc.collect()
+    tracemalloc.start()
+    library = LibrarySystem(**options)
+    for bookId in books:
+        library.insertBook(bookId, "Book", "Author", AVAILABLE)
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size
+
+def test_uses_less_memory_than_pointer_tree():
+    # Names are shared, so only the tree and indexes are measured
+    books = random.Random(5).sample(range(1, 100000), 5000)
+    assert libraryMemory({"compact": True}, books) < 0.85 * libraryMemory({}, books)
@@ -0,0 +1,69 @@
+import pytest
+
+from gatorLibrary import BOOK_VERSIONS, BookNode, DetailsCache, LibrarySystem, formatBook
+from support import LIBRARY_MODES, run
+
+def printed(library, bookId):
+    return run(library, [f"PrintBook({bookId})"]).strip()
+
+@pytest.mark.parametrize("options", LIBRARY_MODES)
+@pytest.mark.parametrize(
+    "command",
+    [
+        "BorrowBook(1, 2, 1)",
+        "BorrowBook(4, 1, 1)",
+        "ReturnBook(1, 1)",
+        "CancelReservation(2, 1)",
+        "UpdatePriority(2, 1, 9)",
+        "CancelAllReservations(2)",
+        "BorrowBooks(4, 1, [1, 2])",
+        "ReturnBooks(1, [1, 2])",
+        "DeleteBook(1)",
+        "DeleteBooks(1, 2)",
+    ],
+)
+def test_changes_invalidate_cached_details(options, command):
+    library = LibrarySystem(**options)
+    run(
+        library,
+        [
+            'InsertBook(1, "A", "X", "Yes")',
+            'InsertBook(2, "B", "X", "Yes")',
+            "BorrowBook(1, 1, 1)",
+            "BorrowBook(2, 1, 3)",
+            "BorrowBook(3, 1, 2)",
+        ],
+    )
+    printed(library, 1)
+    printed(library, 2)
+    run(library, [command, 'InsertBook(1, "A2", "X", "Yes")', 'InsertBook(2, "B2", "X", "Yes")'])
+    for bookId in (1, 2):
+        assert printed(library, bookId) == formatBook(library.bookTree.find(bookId).value).strip()
+
+def test_evicts_least_recently_used():
+    cache = DetailsCache(size=3)
+    books = [BookNode(bookId, '"B"', '"A"', '"Yes"') for bookId in range(1, 6)]
+    for book in books[:3]:
+        cache.get(book)
+    # Book 1 becomes the most recently used, so book 2 goes first
+    cache.get(books[0])
+    cache.get(books[3])
+    assert list(cache.entries) == [3, 1, 4]
+    cache.get(books[4])
+    assert list(cache.entries) == [1, 4, 5]
+    assert (cache.hits, cache.misses) == (1, 5)
+
+def test_stale_entries_are_never_served():
+    cache = DetailsCache()
+    book = BookNode(1, '"B"', '"A"', '"Yes"')
+    cache.get(book)
+    changed = book.copy()
+    changed.borrowedBy = 7
+    changed.version = next(BOOK_VERSIONS)
+    assert cache.get(changed) == formatBook(changed)
+    # The entry now holds the newer version, and the older book misses it
+    assert cache.get(book) == formatBook(book)
+    assert cache.misses == 3
+    # A book inserted again under a deleted book's bookId has its own version
+    reinserted = BookNode(1, '"C"', '"A"', '"Yes"')
+    assert cache.get(reinserted) == formatBook(reinserted)
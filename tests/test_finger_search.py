@@ -0,0 +1,45 @@
+import random
+
+import pytest
+
+from gatorLibrary import LibrarySystem
+from support import LIBRARY_MODES, libraryState, randomCommands, run
+
+def bookId(node):
+    return None if node is None else node.value.bookId
+
+@pytest.mark.parametrize("options", LIBRARY_MODES)
+def test_find_many_matches_find(options):
+    # Sorted bookIds with repeats, gaps and ids beyond both ends
+    library = LibrarySystem(**options)
+    run(library, randomCommands(20, count=1500, idSpace=300))
+    tree = library.bookTree
+    rng = random.Random(20)
+    for count in (0, 1, 2, 5, 40, 400):
+        values = sorted(rng.randint(-5, 305) for _ in range(count))
+        assert [bookId(node) for node in tree.findMany(values)] == [
+            bookId(tree.find(value)) for value in values
+        ]
+    assert list(LibrarySystem(**options).bookTree.findMany([1, 2])) == [None, None]
+
+@pytest.mark.parametrize("options", LIBRARY_MODES)
+def test_batches_match_single_commands(options):
+    # Unsorted bookIds with repeats, as the batch commands take them
+    rng = random.Random(21)
+    batch = LibrarySystem(**options)
+    single = LibrarySystem(**options)
+    lines = randomCommands(21, count=400, idSpace=100)
+    run(batch, lines)
+    run(single, lines)
+    for _ in range(100):
+        patronId = rng.randint(1, 12)
+        ids = [rng.randint(1, 100) for _ in range(rng.randint(1, 8))]
+        command, perBook = rng.choice(
+            [
+                (f"BorrowBooks({patronId}, 2, {ids})", f"BorrowBook({patronId}, {{}}, 2)"),
+                (f"ReturnBooks({patronId}, {ids})", f"ReturnBook({patronId}, {{}})"),
+                (f"PrintBookSet({ids})", "PrintBook({})"),
+            ]
+        )
+        assert run(batch, [command]) == run(single, [perBook.format(i) for i in ids])
+    assert libraryState(batch) == libraryState(single)
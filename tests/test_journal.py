@@ -0,0 +1,151 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from gatorLibrary import (
+    CommandJournal,
+    LibrarySystem,
+    checkpointFiles,
+    compileLines,
+    main,
+    recoverJournal,
+    resetJournal,
+    runCommands,
+)
+from support import libraryState, randomCommands, run
+
+class Crash(Exception):
+    pass
+
+def crashAfter(lines, count):
+    # Yield the first count lines, then fail as if the process died
+    for i, line in enumerate(lines):
+        if i == count:
+            raise Crash()
+        yield line
+
+def crashRun(journalPath, lines, crashLine, **journalOptions):
+    # Run lines with a journal until crashLine, committing what was written
+    resetJournal(journalPath)
+    journal = CommandJournal(journalPath, **journalOptions)
+    with pytest.raises(Crash):
+        runCommands(
+            LibrarySystem(),
+            compileLines(crashAfter(lines, crashLine)),
+            lambda output: None,
+            echo=False,
+            journal=journal,
+        )
+    journal.close()
+
+def recoverAndFinish(journalPath, lines):
+    library = LibrarySystem()
+    seq, resumeLine, outputOffset = recoverJournal(library, journalPath)
+    journal = CommandJournal(journalPath, seq)
+    run(library, lines, journal=journal, skipLines=resumeLine)
+    journal.close()
+    return library
+
+def test_crash_right_after_checkpoint_resumes_after_covered_lines(tmp_path):
+    lines = [
+        'InsertBook(1, "A", "X", "Yes")',
+        'InsertBook(2, "B", "X", "Yes")',
+        "BorrowBook(7, 1, 1)",
+        "BorrowBook(8, 1, 2)",
+        "PrintBook(1)",
+        "BorrowBook(9, 2, 1)",
+    ]
+    journalPath = str(tmp_path / "journal")
+    # The fourth mutation triggers a checkpoint, which truncates the log
+    crashRun(journalPath, lines, 5, checkpointInterval=4)
+    assert [entry[:3] for entry in checkpointFiles(journalPath)] == [(4, 4, 0)]
+    library = LibrarySystem()
+    assert recoverJournal(library, journalPath) == (4, 4, 0)
+    reference = LibrarySystem()
+    run(reference, lines)
+    assert libraryState(recoverAndFinish(journalPath, lines)) == libraryState(reference)
+
+@pytest.mark.parametrize("seed", range(4))
+@pytest.mark.parametrize("interval", [5, 40, 10**9])
+def test_recovery_matches_an_uninterrupted_run(tmp_path, seed, interval):
+    lines = randomCommands(seed, count=300)
+    reference = LibrarySystem()
+    run(reference, lines)
+    journalPath = str(tmp_path / "journal")
+    crashRun(journalPath, lines, 50 + seed * 60, groupSize=1, checkpointInterval=interval)
+    assert libraryState(recoverAndFinish(journalPath, lines)) == libraryState(reference)
+
+# Runs main on a command file with a journal, its group size, checkpoint
+# interval and output buffer shrunk, and kills the process without any
+# cleanup when it reaches the given input line
+CRASHING_RUN = """
+import os, sys
+import gatorLibrary
+inputPath, journalPath, crashLine, groupSize, interval, stream, recover = sys.argv[1:]
+class Journal(gatorLibrary.CommandJournal):
+    def __init__(self, path, seq=0):
+        super().__init__(path, seq, int(groupSize), int(interval))
+def crashAt(records):
+    for record in records:
+        if record[0] == int(crashLine):
+            os._exit(1)
+        yield record
+compileLines = gatorLibrary.compileLines
+gatorLibrary.compileLines = lambda lines, stats=None: crashAt(compileLines(lines, stats))
+gatorLibrary.CommandJournal = Journal
+gatorLibrary.STREAM_BUFFER_SIZE = 4096
+gatorLibrary.main(
+    inputPath,
+    echo=False,
+    stream=stream == "1",
+    bulkLoad=True,
+    journalPath=journalPath,
+    recover=recover == "1",
+)
+"""
+
+def crashingMain(inputPath, journalPath, crashLine, groupSize, interval, stream, recover):
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            CRASHING_RUN,
+            str(inputPath),
+            journalPath,
+            str(crashLine),
+            str(groupSize),
+            str(interval),
+            str(int(stream)),
+            str(int(recover)),
+        ],
+        cwd=Path(__file__).parent.parent,
+        capture_output=True,
+    )
+    assert result.returncode == 1, result.stderr
+
+@pytest.mark.parametrize("stream", [False, True])
+@pytest.mark.parametrize("groupSize, interval", [(256, 10**9), (7, 150)])
+@pytest.mark.parametrize("crashLine", [900, 1777, 2300])
+@pytest.mark.parametrize("crashes", [1, 2])
+def test_recovered_output_matches_an_uninterrupted_run(
+    tmp_path, capsys, stream, groupSize, interval, crashLine, crashes
+):
+    # A bulk-loaded run of inserts, then every kind of command
+    lines = [f'InsertBook({i}, "Book{i}", "Author{i % 7}", "Yes")' for i in range(1, 2400, 2)]
+    lines += ["ColorFlipCount()", "BorrowBooks(1, 2, [3, x])"]
+    lines += randomCommands(crashLine, count=1500, idSpace=400) + ["ColorFlipCount()"]
+    inputPath = tmp_path / "commands.txt"
+    inputPath.write_text("\n".join(lines) + "\n")
+    outputPath = tmp_path / "commands_output_file.txt"
+    main(str(inputPath), echo=False, bulkLoad=True)
+    expected = outputPath.read_bytes()
+    outputPath.unlink()
+    journalPath = str(tmp_path / "journal")
+    crashingMain(inputPath, journalPath, crashLine, groupSize, interval, stream, False)
+    if crashes == 2:
+        # The recovered run journals like any other, so it can crash and recover
+        crashingMain(inputPath, journalPath, crashLine + 300, groupSize, interval, stream, True)
+    main(str(inputPath), echo=False, stream=stream, bulkLoad=True, journalPath=journalPath, recover=True)
+    assert outputPath.read_bytes() == expected
@@ -0,0 +1,69 @@
+import random
+
+import pytest
+
+from gatorLibrary import LibrarySystem, SortedBlockList, unquote
+from support import LIBRARY_MODES, run
+
+def checkBlocks(index):
+    # Blocks are non-empty, sorted end to end, within their size bounds and
+    # summed up by maxes and size
+    items = [item for block in index.blocks for item in block]
+    assert items == sorted(items)
+    assert all(0 < len(block) <= 2 * index.BLOCK_SIZE for block in index.blocks)
+    if len(index.blocks) > 1:
+        assert all(len(block) >= index.BLOCK_SIZE // 2 for block in index.blocks[:-1])
+    assert index.maxes == [block[-1] for block in index.blocks]
+    assert index.size == len(items)
+
+@pytest.mark.parametrize("options", LIBRARY_MODES)
+@pytest.mark.parametrize("seed", range(3))
+def test_lookups_match_a_scan(monkeypatch, options, seed):
+    # Blocks of a few entries, so inserts and deletes split and join them
+    monkeypatch.setattr(SortedBlockList, "BLOCK_SIZE", 4)
+    rng = random.Random(seed)
+    library = LibrarySystem(**options)
+    # Few names, so many books share an author or title
+    authors = [f"Author{i}" for i in range(5)]
+    titles = ["A", "Ab", "Abc", "B", "Ba", "Bab", "C"]
+    for step in range(1500):
+        bookId = rng.randint(1, 250)
+        if rng.random() < 0.6:
+            line = f'InsertBook({bookId}, "{rng.choice(titles)}", "{rng.choice(authors)}", "Yes")'
+        elif rng.random() < 0.9:
+            line = f"DeleteBook({bookId})"
+        else:
+            line = f"DeleteBooks({bookId}, {bookId + rng.randint(0, 30)})"
+        run(library, [line])
+        if step % 25:
+            continue
+        checkBlocks(library.authorIndex)
+        checkBlocks(library.titleIndex)
+        books = [node.value for node in library.bookTree.inorder()]
+        for author in authors + ["Nobody"]:
+            found = [book.bookId for book in library.findBooksByAuthor(f'"{author}"')]
+            assert found == [book.bookId for book in books if unquote(book.authorName) == author]
+        for prefix in ["", "A", "Ab", "B", "Bab", "Babc", "D"]:
+            found = [book.bookId for book in library.findBooksByTitlePrefix(f'"{prefix}"')]
+            assert found == [
+                book.bookId
+                for book in sorted(books, key=lambda book: (unquote(book.bookName), book.bookId))
+                if unquote(book.bookName).startswith(prefix)
+            ]
+
+def test_blocks_stay_in_bounds():
+    rng = random.Random(7)
+    index = SortedBlockList()
+    index.BLOCK_SIZE = 8
+    present = []
+    for _ in range(5000):
+        if present and rng.random() < 0.45:
+            item = present.pop(rng.randrange(len(present)))
+            assert index.remove(item)
+        else:
+            item = (rng.choice("abc"), rng.randint(1, 100))
+            index.add(item)
+            present.append(item)
+        assert not index.remove(("d", 0))
+        checkBlocks(index)
+        assert list(index.irange(("b",))) == sorted(item for item in present if item >= ("b",))
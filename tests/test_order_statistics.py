@@ -0,0 +1,38 @@
+import random
+import re
+
+import pytest
+
+from gatorLibrary import LibrarySystem
+from support import LIBRARY_MODES, checkTree, randomCommands, run
+
+@pytest.mark.parametrize("options", LIBRARY_MODES)
+def test_counts_match_the_books_held(options):
+    library = LibrarySystem(**options)
+    rng = random.Random(12)
+    lines = randomCommands(12, count=2000, idSpace=400)
+    for start in range(0, len(lines), 100):
+        run(library, lines[start : start + 100])
+        checkTree(library.bookTree)
+        ids = [node.value.bookId for node in library.bookTree.inorder()]
+        for _ in range(20):
+            low, high = sorted(rng.randint(0, 401) for _ in range(2))
+            assert library.countBooks(low, high) == sum(low <= i <= high for i in ids)
+        for k in range(len(ids) + 2):
+            node = library.bookTree.select(k)
+            assert (node.value.bookId if node is not None else None) == (
+                ids[k] if k < len(ids) else None
+            )
+
+@pytest.mark.parametrize("options", LIBRARY_MODES)
+def test_pages_follow_the_full_listing(options):
+    library = LibrarySystem(**options)
+    run(library, [f'InsertBook({i}, "Book{i}", "Author{i}", "Yes")' for i in range(1, 60, 2)])
+    listed = re.findall(r"BookID = (\d+)", run(library, ["PrintBooks(10, 50)"]))
+    pages = [run(library, [f"PrintBooks(10, 50, {offset}, 4)"]) for offset in range(0, 24, 4)]
+    assert [re.findall(r"BookID = (\d+)", page) for page in pages[:5]] == [
+        listed[offset : offset + 4] for offset in range(0, 20, 4)
+    ]
+    assert "BookID" not in pages[5]
+    assert run(library, ["KthBook(3)"]) == run(library, ["PrintBook(5)"])
+    assert run(library, ["KthBook(31)"]).strip() == "Book number 31 not found in the library."
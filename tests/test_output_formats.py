@@ -0,0 +1,137 @@
+import json
+import struct
+
+import pytest
+
+from gatorLibrary import (
+    BINARY_BATCH,
+    BINARY_BOOK,
+    BINARY_BOOKS,
+    BINARY_COUNT,
+    BINARY_HEADER,
+    BINARY_INVALID,
+    COMMAND_NAMES,
+    LibrarySystem,
+    compileLines,
+    main,
+    runCommands,
+)
+from support import randomCommands, run
+
+LINES = randomCommands(25, count=600) + ["NotACommand(1)", "ColorFlipCount()"]
+
+def decodeBook(data, offset):
+    bookId, available, borrowedBy, titleSize, authorSize, count = BINARY_BOOK.unpack_from(
+        data, offset
+    )
+    offset += BINARY_BOOK.size
+    title = data[offset : offset + titleSize].decode("utf-8")
+    offset += titleSize
+    author = data[offset : offset + authorSize].decode("utf-8")
+    offset += authorSize
+    reservations = list(struct.unpack_from(f"<{count}q", data, offset))
+    book = {
+        "bookId": bookId,
+        "title": title,
+        "author": author,
+        "availability": "Yes" if available else "No",
+        "borrowedBy": None if borrowedBy == -1 else borrowedBy,
+        "reservations": reservations,
+    }
+    return book, offset + 8 * count
+
+def decodeRecord(data, offset, nested=False):
+    # A binary record as the JSON Lines record of the same result, and the
+    # offset after it. Records nested in a batch name no command.
+    size, opcode, kind = BINARY_HEADER.unpack_from(data, offset)
+    end = offset + 4 + size
+    offset += BINARY_HEADER.size
+    if opcode == BINARY_INVALID:
+        record = {"error": data[offset:end].decode("utf-8")}
+    elif kind in (BINARY_BOOKS, BINARY_BATCH):
+        (count,) = BINARY_COUNT.unpack_from(data, offset)
+        offset += BINARY_COUNT.size
+        items = []
+        for _ in range(count):
+            if kind == BINARY_BOOKS:
+                item, offset = decodeBook(data, offset)
+            else:
+                item, offset = decodeRecord(data, offset, nested=True)
+            items.append(item)
+        record = {"books": items} if kind == BINARY_BOOKS else {"results": items}
+    else:
+        record = {"message": data[offset:end].decode("utf-8")}
+    if opcode != BINARY_INVALID and not nested:
+        record["command"] = COMMAND_NAMES[opcode]
+    return record, end
+
+def decodeBinary(data):
+    records = []
+    offset = 0
+    while offset < len(data):
+        record, offset = decodeRecord(data, offset)
+        records.append(record)
+    return records
+
+def textBlocks(record):
+    # The book details and messages a JSON Lines record gives, as text
+    if "error" in record:
+        return [f"Invalid command on line {record['line']}: {record['error']}"]
+    if "results" in record:
+        return [block for item in record["results"] for block in textBlocks(item)]
+    if "books" in record:
+        return [
+            f"BookID = {book['bookId']}\n"
+            f'Title = "{book["title"]}"\n'
+            f'Author = "{book["author"]}"\n'
+            f'Availability = "{book["availability"]}"\n'
+            f"BorrowedBy = {book['borrowedBy']}\n"
+            f"Reservations = {book['reservations']}"
+            for book in record["books"]
+        ]
+    return [record["message"]]
+
+def blocks(text):
+    # Book details and messages of text output, without the blank lines
+    return [block.strip("\n") for block in text.split("\n\n") if block.strip("\n")]
+
+@pytest.mark.parametrize("options", [{}, {"backend": "btree"}])
+def test_json_lines_carry_the_text_results(options):
+    text = LibrarySystem(**options)
+    jsonLines = LibrarySystem(outputFormat="jsonl", **options)
+    # Batch commands give a record per book, which text spaces as separate
+    # commands
+    for line in LINES:
+        records = [json.loads(record) for record in run(jsonLines, [line]).splitlines()]
+        assert sum(map(textBlocks, records), []) == blocks(run(text, [line]))
+        for record in records:
+            assert record.get("command", COMMAND_NAMES[0]) in COMMAND_NAMES
+
+def test_binary_matches_json_lines():
+    jsonLines = LibrarySystem(outputFormat="jsonl")
+    binary = LibrarySystem(outputFormat="binary")
+    expected = [json.loads(line) for line in run(jsonLines, LINES).splitlines()]
+    written = []
+    runCommands(binary, compileLines(LINES), written.append, echo=False)
+    decoded = decodeBinary(b"".join(written))
+    for record in expected:
+        if "line" in record:
+            record["error"] = f"Invalid command on line {record.pop('line')}: {record['error']}"
+    assert decoded == expected
+
+@pytest.mark.parametrize("outputFormat", ["jsonl", "binary"])
+def test_main_writes_the_format_extension(tmp_path, outputFormat):
+    inputPath = tmp_path / "commands.txt"
+    inputPath.write_text("\n".join(LINES[:200] + ["Quit()"]) + "\n")
+    main(str(inputPath), echo=False, outputFormat=outputFormat)
+    if outputFormat == "jsonl":
+        records = [
+            json.loads(line)
+            for line in (tmp_path / "commands_output_file.jsonl").read_text().splitlines()
+        ]
+    else:
+        records = decodeBinary((tmp_path / "commands_output_file.bin").read_bytes())
+    assert records[-1] == {"command": "Quit", "message": "Program Terminated!!"}
+    reference = LibrarySystem(outputFormat="jsonl")
+    expected = [json.loads(line) for line in run(reference, LINES[:200]).splitlines()]
+    assert records[:-1] == expected
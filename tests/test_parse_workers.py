@@ -0,0 +1,37 @@
+import gatorLibrary
+from gatorLibrary import compileLines, main, parseFile
+from support import randomCommands
+
+def commandFile(tmp_path):
+    # Blank, malformed and non-ASCII lines, and no newline at the end
+    lines = randomCommands(24, count=400)
+    lines[10:10] = ["", "   ", "NotACommand(1)", "BorrowBook(1, x, 1)"]
+    lines[50:50] = ['InsertBook(999, "Café Ünïcode", "Zoë", "Yes")', "PrintBook(999)"]
+    path = tmp_path / "commands.txt"
+    path.write_text("\n".join(lines), encoding="utf-8")
+    return path
+
+def test_parse_file_matches_compile_lines(tmp_path, monkeypatch):
+    # Chunks of a few lines each, so most lines are parsed far from the
+    # start of their chunk
+    monkeypatch.setattr(gatorLibrary, "PARSE_CHUNK_SIZE", 100)
+    path = commandFile(tmp_path)
+    with open(path, encoding="utf-8") as file:
+        expected = list(compileLines(file.readlines()))
+    assert list(parseFile(str(path), 3)) == expected
+
+def test_empty_file_parses_to_nothing(tmp_path):
+    path = tmp_path / "empty.txt"
+    path.write_bytes(b"")
+    assert list(parseFile(str(path), 2)) == []
+
+def test_main_output_is_the_same_with_parse_workers(tmp_path, monkeypatch):
+    monkeypatch.setattr(gatorLibrary, "PARSE_CHUNK_SIZE", 100)
+    path = commandFile(tmp_path)
+    outputPath = tmp_path / "commands_output_file.txt"
+    main(str(path), echo=False)
+    expected = outputPath.read_bytes()
+    for stream in (False, True):
+        outputPath.unlink()
+        main(str(path), echo=False, stream=stream, parseWorkers=2)
+        assert outputPath.read_bytes() == expected
@@ -0,0 +1,60 @@
+import random
+
+import pytest
+
+from gatorLibrary import LibrarySystem, cancelledMessage, formatPatron
+from support import LIBRARY_MODES, libraryState, randomCommands, run
+
+def scannedPatrons(library):
+    # Each patron's loans and reservations, found by scanning every book
+    patrons = {}
+    for node in library.bookTree.inorder():
+        book = node.value
+        if book.borrowedBy is not None:
+            patrons.setdefault(book.borrowedBy, (set(), set()))[0].add(book.bookId)
+        for patronId in book.getReservations():
+            patrons.setdefault(patronId, (set(), set()))[1].add(book.bookId)
+    return {
+        patronId: (sorted(borrowed), sorted(reserved))
+        for patronId, (borrowed, reserved) in patrons.items()
+    }
+
+@pytest.mark.parametrize("options", LIBRARY_MODES)
+@pytest.mark.parametrize("seed", range(3))
+def test_index_matches_the_books(options, seed):
+    # Patrons left with no loans or reservations are dropped from the index
+    library = LibrarySystem(**options)
+    for line in randomCommands(seed, count=1500, idSpace=60):
+        run(library, [line])
+        assert libraryState(library)[1] == scannedPatrons(library), line
+
+@pytest.mark.parametrize("options", LIBRARY_MODES)
+def test_patron_commands_match_a_scan(options):
+    rng = random.Random(6)
+    library = LibrarySystem(**options)
+    lines = randomCommands(6, count=2000, idSpace=60)
+    for start in range(0, len(lines), 20):
+        run(library, lines[start : start + 20])
+        patronId = rng.randint(1, 12)
+        borrowed, reserved = scannedPatrons(library).get(patronId, ([], []))
+        output = run(library, [f"PrintPatron({patronId})"])
+        assert output.strip() == formatPatron(patronId, borrowed, reserved)
+        if rng.random() < 0.3:
+            output = run(library, [f"CancelAllReservations({patronId})"])
+            if reserved:
+                assert output.strip() == cancelledMessage(patronId, reserved)
+            else:
+                assert output.strip() == f"Patron {patronId} has no reservations."
+            assert scannedPatrons(library).get(patronId, ([], []))[1] == []
+        if rng.random() < 0.3:
+            # ReturnBooks over the patron's loans and books they do not hold.
+            # A book comes back to them only if they are next on its waitlist.
+            kept = [
+                bookId
+                for bookId in borrowed
+                if library.bookTree.find(bookId).value.getReservations()[:1] == [patronId]
+            ]
+            ids = borrowed + [rng.randint(1, 60) for _ in range(2)]
+            run(library, [f"ReturnBooks({patronId}, {ids})"])
+            assert scannedPatrons(library).get(patronId, ([], []))[0] == kept
+    assert libraryState(library)[1] == scannedPatrons(library)
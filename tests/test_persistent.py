@@ -0,0 +1,89 @@
+import random
+
+import pytest
+
+from gatorLibrary import LibrarySystem, compileCommand, formatBook
+from libraryServer import LibraryServer
+from support import libraryState, randomCommands, run
+
+@pytest.mark.parametrize("seed", range(4))
+def test_matches_pointer_tree(seed):
+    lines = randomCommands(seed)
+    persistent = LibrarySystem(persistent=True)
+    baseline = LibrarySystem()
+    assert run(persistent, lines) == run(baseline, lines)
+    assert libraryState(persistent) == libraryState(baseline)
+
+def test_repeated_books_in_a_batch():
+    library = LibrarySystem(persistent=True)
+    run(library, ['InsertBook(1, "Book1", "Author1", "Yes")'])
+    output = run(library, ["BorrowBooks(1, 1, [1, 1])", "ReturnBooks(1, [1, 1])"])
+    baseline = LibrarySystem()
+    run(baseline, ['InsertBook(1, "Book1", "Author1", "Yes")'])
+    assert output == run(baseline, ["BorrowBooks(1, 1, [1, 1])", "ReturnBooks(1, [1, 1])"])
+    assert libraryState(library) == libraryState(baseline)
+    # The author index holds the book the tree published last
+    assert list(library.findBooksByAuthor('"Author1"')) == [library.bookTree.find(1).value]
+
+def bookFields(book):
+    return (
+        book.availability,
+        book.borrowedBy,
+        list(book.reservations.heap),
+        dict(book.reservations.positions),
+        book.version,
+    )
+
+def test_writes_never_change_published_books():
+    # Reader threads render the books of the version they took, so a write
+    # must leave every book of earlier versions as it was
+    library = LibrarySystem(persistent=True)
+    run(library, [f'InsertBook({i}, "Book{i}", "Author{i}", "Yes")' for i in range(1, 21)])
+    rng = random.Random(7)
+    for _ in range(2000):
+        bookId = rng.randint(1, 20)
+        patronId = rng.randint(1, 10)
+        line = rng.choice(
+            [
+                f"BorrowBook({patronId}, {bookId}, {rng.randint(1, 5)})",
+                f"ReturnBook({patronId}, {bookId})",
+                f"CancelReservation({patronId}, {bookId})",
+                f"UpdatePriority({patronId}, {bookId}, {rng.randint(1, 5)})",
+                f"BorrowBooks({patronId}, 1, [{bookId}, {bookId}, {rng.randint(1, 20)}])",
+                f"ReturnBooks({patronId}, [{bookId}, {rng.randint(1, 20)}])",
+                f"CancelAllReservations({patronId})",
+                f"DeleteBook({bookId})",
+                f"DeleteBooks({bookId}, {bookId + rng.randint(0, 3)})",
+                f'InsertBook({bookId}, "Book{bookId}", "Author{bookId}", "Yes")',
+            ]
+        )
+        published = [(node.value, bookFields(node.value)) for node in library.bookTree.inorder()]
+        run(library, [line])
+        for book, fields in published:
+            assert bookFields(book) == fields, line
+
+def test_details_of_a_deleted_book_are_not_served_again():
+    # A reader may cache a book after a write deleted it; the book inserted
+    # again under its bookId must not match that entry
+    library = LibrarySystem(persistent=True)
+    run(library, ['InsertBook(1, "Old", "Author", "Yes")'])
+    deleted = library.bookTree.find(1).value
+    run(library, ["DeleteBook(1)", 'InsertBook(1, "New", "Author", "Yes")'])
+    library.details.get(deleted)
+    assert 'Title = "New"' in run(library, ["PrintBook(1)"])
+
+def test_readers_share_the_details_cache():
+    library = LibrarySystem(persistent=True)
+    run(library, [f'InsertBook({i}, "Book{i}", "Author{i}", "Yes")' for i in range(1, 201)])
+    server = LibraryServer(library, readerThreads=4)
+    reads = [compileCommand(f"PrintBook({i % 200 + 1})") for i in range(4000)]
+    # Small enough that readers evict each other's entries
+    library.details.size = 50
+    try:
+        futures = [server.readers.submit(server.run, *read) for read in reads]
+        outputs = [future.result() for future in futures]
+    finally:
+        server.readers.shutdown()
+    assert outputs == [formatBook(library.bookTree.find(i % 200 + 1).value) for i in range(4000)]
+    assert len(library.details.entries) <= 50
+    assert library.details.hits + library.details.misses == len(reads)
@@ -0,0 +1,41 @@
+import pytest
+
+from gatorLibrary import LibrarySystem, compileLines, formatBook, runCommands
+from support import LIBRARY_MODES, randomCommands, run
+
+def listing(library, low, high):
+    # PrintBooks output built from a scan of every book
+    books = [node.value for node in library.bookTree.inorder() if low <= node.value.bookId <= high]
+    return "\n".join(f"{formatBook(book)}\n" for book in books) + "\n\n\n"
+
+@pytest.mark.parametrize("options", LIBRARY_MODES)
+def test_ranges_match_a_scan(options):
+    library = LibrarySystem(**options)
+    assert run(library, ["PrintBooks(1, 100)"]) == "\n\n\n"
+    run(library, randomCommands(2, count=600))
+    ids = [node.value.bookId for node in library.bookTree.inorder()]
+    gap = next(bookId + 1 for bookId, following in zip(ids, ids[1:]) if following > bookId + 1)
+    ranges = [
+        # The whole tree, exactly and with room on both sides
+        (ids[0], ids[-1]),
+        (-10, 10**9),
+        # Bounds that are not bookIds, and ranges holding no book
+        (ids[0] - 5, ids[0] - 1),
+        (ids[-1] + 1, ids[-1] + 5),
+        (gap, gap),
+        (ids[2] - 1, ids[7] + 1),
+        # bookId1 above bookId2 lists nothing
+        (ids[7], ids[2]),
+        (ids[5], ids[5]),
+    ]
+    for low, high in ranges:
+        assert run(library, [f"PrintBooks({low}, {high})"]) == listing(library, low, high)
+
+def test_listing_is_written_book_by_book():
+    library = LibrarySystem()
+    run(library, [f'InsertBook({i}, "Book{i}", "Author{i}", "Yes")' for i in range(1, 201)])
+    written = []
+    runCommands(library, compileLines(["PrintBooks(51, 150)"]), written.append, echo=False)
+    # Each book is written as it is rendered, then the result's ending
+    assert len(written) == 101
+    assert "".join(written) == listing(library, 51, 150)
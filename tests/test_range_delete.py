@@ -0,0 +1,79 @@
+import random
+
+import pytest
+
+from gatorLibrary import BookNode, LibrarySystem
+from support import LIBRARY_MODES, checkTree, libraryState, randomCommands, run
+
+@pytest.mark.parametrize("options", LIBRARY_MODES)
+def test_remove_range_splits_and_joins(options):
+    # Ranges inside, across and beyond both ends of trees of many sizes
+    rng = random.Random(22)
+    for size in (0, 1, 2, 3, 7, 40, 300):
+        for _ in range(15):
+            tree = LibrarySystem(**options).bookTree
+            ids = rng.sample(range(1, 1000), size)
+            for bookId in ids:
+                tree.insert(BookNode(bookId, '"B"', '"A"', rng.choice(['"Yes"', '"No"'])))
+            low, high = sorted(rng.randint(0, 1001) for _ in range(2))
+            removed = tree.removeRange(low, high)
+            assert [book.bookId for book in removed] == sorted(i for i in ids if low <= i <= high)
+            checkTree(tree)
+            assert [node.value.bookId for node in tree.inorder()] == sorted(
+                i for i in ids if not low <= i <= high
+            )
+
+@pytest.mark.parametrize("options", LIBRARY_MODES)
+def test_delete_books_matches_deleting_one_at_a_time(options):
+    rng = random.Random(23)
+    for seed in range(5):
+        lines = randomCommands(seed, count=500)
+        library = LibrarySystem(**options)
+        reference = LibrarySystem(**options)
+        run(library, lines)
+        run(reference, lines)
+        low = rng.randint(1, 150)
+        high = low + rng.randint(0, 60)
+        held = [
+            node.value.bookId
+            for node in reference.bookTree.inorder()
+            if low <= node.value.bookId <= high
+        ]
+        output = run(library, [f"DeleteBooks({low}, {high})"])
+        if held:
+            assert output == run(reference, [f"DeleteBook({bookId})" for bookId in held])
+        else:
+            assert output.strip() == f"No books found between {low} and {high}."
+        assert libraryState(library) == libraryState(reference)
+        checkTree(library.bookTree)
+
+@pytest.mark.parametrize("options", LIBRARY_MODES)
+def test_extracted_books_take_their_loans_and_reservations(tmp_path, options):
+    path = str(tmp_path / "extracted.snap")
+    library = LibrarySystem(**options)
+    run(library, [f'InsertBook({i}, "Book{i}", "Author{i}", "Yes")' for i in range(1, 31)])
+    run(library, ["BorrowBook(1, 12, 1)", "BorrowBook(2, 12, 3)", "BorrowBook(2, 25, 1)"])
+    before = libraryState(library)
+    output = run(library, [f'ExtractBooks(10, 19, "{path}")'])
+    assert output.strip() == f"10 book(s) extracted to {path}"
+    books, patrons = libraryState(library)
+    assert [book[0] for book in books] == [i for i in range(1, 31) if not 10 <= i <= 19]
+    assert patrons == {2: ([25], [])}
+    checkTree(library.bookTree)
+    extracted = LibrarySystem()
+    extracted.loadSnapshot(path)
+    assert libraryState(extracted) == (
+        [book for book in before[0] if 10 <= book[0] <= 19],
+        {1: ([12], []), 2: ([], [12])},
+    )
+
+def test_failed_extract_puts_the_books_back(tmp_path):
+    library = LibrarySystem()
+    run(library, [f'InsertBook({i}, "Book{i}", "Author{i}", "Yes")' for i in range(1, 31)])
+    run(library, ["BorrowBook(1, 12, 1)", "BorrowBook(2, 12, 3)"])
+    before = libraryState(library)
+    path = str(tmp_path / "missing" / "extracted.snap")
+    output = run(library, [f'ExtractBooks(10, 19, "{path}")'])
+    assert output.startswith(f"Books could not be extracted to {path}")
+    assert libraryState(library) == before
+    checkTree(library.bookTree)
@@ -0,0 +1,85 @@
+import random
+
+import pytest
+
+from gatorLibrary import WAITLIST_LIMIT, BinaryMinHeap, LibrarySystem
+from support import LIBRARY_MODES, run
+
+BOOK = 'InsertBook(1, "Book1", "Author1", "Yes")'
+
+@pytest.mark.parametrize("options", LIBRARY_MODES)
+def test_repeated_reservation_is_reported(options):
+    library = LibrarySystem(**options)
+    run(library, [BOOK, "BorrowBook(1, 1, 1)", "BorrowBook(2, 1, 3)"])
+    version = library.bookTree.find(1).value.version
+    output = run(library, ["BorrowBook(2, 1, 1)"])
+    assert output.strip() == "Patron 2 already has a reservation for Book 1."
+    book = library.bookTree.find(1).value
+    # The first reservation stands, and cached details stay current
+    assert book.version == version
+    assert list(book.reservations) == [(3, 2, book.reservations.heap[0][2])]
+
+def test_full_waitlist():
+    library = LibrarySystem()
+    run(library, [BOOK, "BorrowBook(100, 1, 1)"])
+    run(library, [f"BorrowBook({patronId}, 1, 1)" for patronId in range(WAITLIST_LIMIT)])
+    output = run(library, [f"BorrowBook({WAITLIST_LIMIT}, 1, 1)"])
+    assert output.strip() == f"Waitlist for Book 1 is full. Cannot add reservation for Patron {WAITLIST_LIMIT}"
+    assert WAITLIST_LIMIT not in library.patrons
+
+def test_returned_book_goes_to_highest_priority():
+    library = LibrarySystem()
+    run(
+        library,
+        [BOOK, "BorrowBook(1, 1, 1)", "BorrowBook(2, 1, 2)", "BorrowBook(3, 1, 1)", "UpdatePriority(2, 1, 0)"],
+    )
+    assert library.bookTree.find(1).value.getReservations() == [2, 3]
+    output = run(library, ["ReturnBook(1, 1)", "CancelReservation(3, 1)", "PrintPatron(2)"])
+    assert "Book 1 Allotted to Patron 2" in output
+    assert "Reservation made by Patron 3 for Book 1 has been cancelled!" in output
+    assert "Borrowed = [1]\nReservations = []" in output
+    assert 3 not in library.patrons
+
+def checkHeap(heap):
+    entries = heap.heap
+    for index in range(1, len(entries)):
+        parent = entries[(index - 1) // 2]
+        assert (parent[0], parent[2]) <= (entries[index][0], entries[index][2])
+    assert heap.positions == {entry[1]: index for index, entry in enumerate(entries)}
+
+def test_heap_against_sorted_list():
+    # Removals, cancellations and priority changes against a plain list
+    # ordered by (priority, timestamp)
+    rng = random.Random(3)
+    heap = BinaryMinHeap()
+    expected = {}
+    for step in range(3000):
+        patronId = rng.randint(1, 40)
+        action = rng.random()
+        if action < 0.4 and patronId not in heap:
+            entry = (rng.randint(0, 5), patronId, step)
+            heap.insert(entry)
+            expected[patronId] = entry
+        elif action < 0.6:
+            removed = heap.remove(patronId)
+            assert removed == expected.pop(patronId, None)
+        elif action < 0.8:
+            priority = rng.randint(0, 5)
+            assert heap.updatePriority(patronId, priority) == (patronId in expected)
+            if patronId in expected:
+                expected[patronId] = (priority, patronId, expected[patronId][2])
+        elif expected:
+            first = min(expected.values(), key=lambda entry: (entry[0], entry[2]))
+            assert heap.removeMin() == first
+            del expected[first[1]]
+        checkHeap(heap)
+        assert len(heap) == len(expected)
+
+def test_heap_load_orders_entries():
+    rng = random.Random(4)
+    entries = [(rng.randint(0, 3), patronId, rng.random()) for patronId in range(50)]
+    heap = BinaryMinHeap()
+    heap.load(entries)
+    checkHeap(heap)
+    order = [heap.removeMin() for _ in range(len(entries))]
+    assert order == sorted(entries, key=lambda entry: (entry[0], entry[2]))
@@ -0,0 +1,115 @@
+import asyncio
+import random
+
+import pytest
+
+from gatorLibrary import LibrarySystem
+from libraryServer import LISTEN_BACKLOG, LibraryServer
+from support import libraryState
+
+# Connections sending commands at once, and the lines each one sends
+CLIENTS = 6
+CLIENT_COMMANDS = 400
+# Lines a client writes before letting the other clients run
+CHUNK_SIZE = 25
+
+def clientCommands(client, seed):
+    # Reads and writes on books and patrons of this client alone, so every
+    # interleaving of the clients gives each one the output it gets alone
+    rng = random.Random(seed)
+    base = client * 1000
+    lines = []
+    for _ in range(CLIENT_COMMANDS):
+        bookId = base + rng.randint(1, 40)
+        other = base + rng.randint(1, 40)
+        low, high = min(bookId, other), max(bookId, other)
+        patronId = base + rng.randint(1, 4)
+        ids = ", ".join(str(base + rng.randint(1, 40)) for _ in range(rng.randint(1, 4)))
+        lines.append(
+            rng.choice(
+                [
+                    f'InsertBook({bookId}, "Book{bookId}", "Author{client}", "Yes")',
+                    f'InsertBook({bookId}, "Book{bookId}", "Author{client}", "Yes")',
+                    f"PrintBook({bookId})",
+                    f"PrintBooks({low}, {high})",
+                    f"PrintBookSet([{ids}])",
+                    f"CountBooks({low}, {high})",
+                    f"CountAvailable({low}, {high})",
+                    f"BorrowBook({patronId}, {bookId}, {rng.randint(1, 5)})",
+                    f"BorrowBooks({patronId}, {rng.randint(1, 5)}, [{ids}])",
+                    f"ReturnBook({patronId}, {bookId})",
+                    f"ReturnBooks({patronId}, [{ids}])",
+                    f"CancelReservation({patronId}, {bookId})",
+                    f"UpdatePriority({patronId}, {bookId}, {rng.randint(1, 5)})",
+                    f"PrintPatron({patronId})",
+                    f"DeleteBook({bookId})",
+                    f"DeleteBooks({low}, {min(high, low + 5)})",
+                    f'FindBooksByAuthor("Author{client}")',
+                    f"BorrowBook({patronId}, {bookId})",
+                ]
+            )
+        )
+    return lines
+
+async def sendCommands(port, lines):
+    # Pipeline lines over one connection in chunks, reading the framed
+    # responses while they are sent
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+
+    async def receive():
+        responses = []
+        while True:
+            header = await reader.readline()
+            if not header:
+                return responses
+            responses.append((await reader.readexactly(int(header))).decode("utf-8"))
+
+    receiver = asyncio.create_task(receive())
+    for start in range(0, len(lines), CHUNK_SIZE):
+        writer.write("".join(line + "\n" for line in lines[start : start + CHUNK_SIZE]).encode())
+        await writer.drain()
+        await asyncio.sleep(0)
+    writer.write_eof()
+    responses = await receiver
+    writer.close()
+    return responses
+
+async def serveClients(server, commands):
+    listener = await asyncio.start_server(
+        server.handle, "127.0.0.1", 0, backlog=LISTEN_BACKLOG
+    )
+    port = listener.sockets[0].getsockname()[1]
+    async with listener:
+        return await asyncio.gather(*(sendCommands(port, lines) for lines in commands))
+
+async def runSequentially(server, commands):
+    responses = []
+    for lines in commands:
+        responses.append([(await server.execute(line, []))[0] for line in lines])
+    return responses
+
+@pytest.mark.parametrize(
+    "options, readerThreads", [({}, 0), ({"persistent": True}, 0), ({"persistent": True}, 4)]
+)
+def test_concurrent_clients_match_sequential_execution(options, readerThreads):
+    commands = [clientCommands(client, seed=client) for client in range(1, CLIENTS + 1)]
+    library = LibrarySystem(**options)
+    server = LibraryServer(library, readerThreads=readerThreads)
+    try:
+        responses = asyncio.run(serveClients(server, commands))
+    finally:
+        if server.readers is not None:
+            server.readers.shutdown()
+    reference = LibrarySystem()
+    expected = asyncio.run(runSequentially(LibraryServer(reference), commands))
+    assert responses == expected
+    assert libraryState(library) == libraryState(reference)
+    assert server.connections == 0
+
+def test_connection_ends_at_quit():
+    library = LibrarySystem()
+    server = LibraryServer(library)
+    lines = ['InsertBook(1, "A", "B", "Yes")', "Quit()", "PrintBook(1)", 'SaveSnapshot("x")']
+    responses = asyncio.run(serveClients(server, [lines, lines[2:]]))
+    assert responses[0] == ["", "Program Terminated!!"]
+    assert responses[1][1] == "SaveSnapshot is disabled on this server"
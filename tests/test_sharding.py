@@ -0,0 +1,31 @@
+import pytest
+
+import shardedLibrary
+from gatorLibrary import LibrarySystem
+from shardedLibrary import ShardedLibrary, runShardedCommands
+from support import randomCommands, run, withoutColourFlips
+
+@pytest.mark.parametrize(
+    "shards, options", [(2, {}), (3, {"backend": "btree"}), (3, {"compact": True})]
+)
+def test_matches_one_library(monkeypatch, shards, options):
+    # Small chunks, so shards hand ranges to each other between them
+    monkeypatch.setattr(shardedLibrary, "SHARD_CHUNK_SIZE", 100)
+    monkeypatch.setattr(shardedLibrary, "REBALANCE_MIN_LOAD", 50)
+    lines = [f'InsertBook({i}, "Book{i}", "Author{i % 7}", "Yes")' for i in range(1, 201, 2)]
+    # Point commands on the low bookIds make the first shard hot
+    lines += [
+        command.format(patronId=i % 9 + 1, bookId=i * 7 % 40 + 1)
+        for i in range(600)
+        for command in ("BorrowBook({patronId}, {bookId}, 1)", "ReturnBook({patronId}, {bookId})")
+    ]
+    lines += randomCommands(17, count=800) + ["NotACommand(1)", "ColorFlipCount()", "Quit()"]
+    written = []
+    library = ShardedLibrary(shards, **options)
+    try:
+        runShardedCommands(library, lines, written.append, echo=False)
+    finally:
+        library.close()
+    assert library.moves > 0
+    expected = run(LibrarySystem(**options), lines)
+    assert withoutColourFlips("".join(written)) == withoutColourFlips(expected)
@@ -0,0 +1,102 @@
+import pytest
+
+from gatorLibrary import (
+    SNAPSHOT_BOOK,
+    SNAPSHOT_HEADER,
+    SNAPSHOT_STRING,
+    LibrarySystem,
+    loadSnapshotCommand,
+)
+from support import LIBRARY_MODES, libraryState, randomCommands, run
+
+def populated(seed, **options):
+    library = LibrarySystem(**options)
+    run(library, randomCommands(seed, count=400))
+    return library
+
+@pytest.mark.parametrize("options", LIBRARY_MODES)
+def test_round_trip(tmp_path, options):
+    path = str(tmp_path / "library.snap")
+    library = populated(1, **options)
+    library.saveSnapshot(path)
+    loaded = LibrarySystem(**options)
+    loaded.loadSnapshot(path)
+    assert libraryState(loaded) == libraryState(library)
+    # Both libraries behave the same from here on
+    lines = randomCommands(2, count=300)
+    assert run(loaded, lines) == run(library, lines)
+
+@pytest.mark.parametrize("options", LIBRARY_MODES[1:])
+def test_snapshots_load_across_backends(tmp_path, options):
+    path = str(tmp_path / "library.snap")
+    library = populated(3)
+    library.saveSnapshot(path)
+    loaded = LibrarySystem(**options)
+    loaded.loadSnapshot(path)
+    assert libraryState(loaded) == libraryState(library)
+
+@pytest.mark.parametrize("cut", [1, 8, 24, 300])
+def test_truncated_snapshot_leaves_library_unchanged(tmp_path, cut):
+    path = str(tmp_path / "library.snap")
+    populated(4).saveSnapshot(path)
+    with open(path, "rb") as file:
+        data = file.read()
+    with open(path, "wb") as file:
+        file.write(data[:-cut])
+    library = populated(5)
+    before = libraryState(library)
+    message = loadSnapshotCommand(library, path)
+    assert message.startswith(f"Snapshot could not be loaded from {path}")
+    assert libraryState(library) == before
+
+def test_short_reservation_section_is_rejected(tmp_path):
+    # A reservation count larger than the reservations saved is reported
+    # as a ValueError instead of escaping as StopIteration
+    path = str(tmp_path / "library.snap")
+    library = LibrarySystem()
+    run(library, ['InsertBook(1, "Book1", "Author1", "Yes")', "BorrowBook(1, 1, 1)", "BorrowBook(2, 1, 1)"])
+    library.saveSnapshot(path)
+    with open(path, "rb") as file:
+        data = bytearray(file.read())
+    # Claim no reservations while the book still counts one
+    header = list(SNAPSHOT_HEADER.unpack_from(data, 0))
+    header[3] = 0
+    SNAPSHOT_HEADER.pack_into(data, 0, *header)
+    with open(path, "wb") as file:
+        file.write(data)
+    target = populated(6)
+    before = libraryState(target)
+    with pytest.raises(ValueError):
+        target.loadSnapshot(path)
+    assert libraryState(target) == before
+
+def test_empty_file_is_rejected(tmp_path):
+    path = tmp_path / "library.snap"
+    path.write_bytes(b"")
+    library = populated(7)
+    before = libraryState(library)
+    assert "could not be loaded" in loadSnapshotCommand(library, str(path))
+    assert libraryState(library) == before
+
+def test_book_claiming_missing_reservations_is_rejected(tmp_path):
+    # A book counting more reservations than the section holds used to
+    # escape as StopIteration with the library half replaced
+    path = str(tmp_path / "library.snap")
+    library = LibrarySystem()
+    run(library, ['InsertBook(1, "Book1", "Author1", "Yes")', "BorrowBook(1, 1, 1)", "BorrowBook(2, 1, 1)"])
+    library.saveSnapshot(path)
+    with open(path, "rb") as file:
+        data = bytearray(file.read())
+    offset = SNAPSHOT_HEADER.size
+    for _ in range(SNAPSHOT_HEADER.unpack_from(data, 0)[5]):
+        offset += SNAPSHOT_STRING.size + SNAPSHOT_STRING.unpack_from(data, offset)[0]
+    book = list(SNAPSHOT_BOOK.unpack_from(data, offset))
+    book[6] += 1
+    SNAPSHOT_BOOK.pack_into(data, offset, *book)
+    with open(path, "wb") as file:
+        file.write(data)
+    target = populated(8)
+    before = libraryState(target)
+    with pytest.raises(ValueError):
+        target.loadSnapshot(path)
+    assert libraryState(target) == before
@@ -0,0 +1,41 @@
+from gatorLibrary import LibrarySystem, Stats
+from support import randomCommands, run
+
+def rebalancing(library):
+    return [
+        line
+        for line in library.printStats().split("\n")
+        if line.startswith(("Rotations", "FixInsert", "FixDelete", "Heap"))
+    ]
+
+def test_counters_run_only_when_enabled():
+    library = LibrarySystem()
+    run(library, randomCommands(9, count=1000))
+    assert library.bookTree.stats is None
+    assert "rotateLeft" not in vars(library.bookTree)
+    assert library.printStats().startswith("Stats are disabled")
+
+def test_compact_tree_counts_the_same_work():
+    lines = randomCommands(9, count=2000, idSpace=500)
+    pointer = LibrarySystem()
+    compact = LibrarySystem(compact=True)
+    for library in (pointer, compact):
+        library.enableStats()
+        run(library, lines)
+    assert rebalancing(pointer) == rebalancing(compact)
+    assert pointer.stats.rotations > 0
+    assert pointer.stats.fixInsertLoops > 0
+    assert pointer.stats.siftSteps > 0
+
+def test_loaded_snapshot_keeps_counting(tmp_path):
+    path = str(tmp_path / "library.snap")
+    source = LibrarySystem()
+    run(source, randomCommands(10, count=500))
+    source.saveSnapshot(path)
+    library = LibrarySystem()
+    library.enableStats()
+    stats = library.stats
+    library.loadSnapshot(path)
+    run(library, randomCommands(11, count=500))
+    assert library.stats is stats
+    assert isinstance(stats, Stats) and stats.rotations > 0
@@ -0,0 +1,18 @@
+from gatorLibrary import main
+from support import randomCommands
+
+def test_streamed_run_matches_the_default(tmp_path, capsys):
+    # Lines after Quit() are never run
+    lines = randomCommands(3, count=500) + ["Quit()", "PrintBook(1)"]
+    path = tmp_path / "commands.txt"
+    path.write_text("\n".join(lines) + "\n")
+    outputPath = tmp_path / "commands_output_file.txt"
+    main(str(path), echo=False)
+    expected = outputPath.read_bytes()
+    assert expected.endswith(b"Program Terminated!!\n")
+    capsys.readouterr()
+    outputPath.unlink()
+    main(str(path), echo=False, stream=True)
+    assert outputPath.read_bytes() == expected
+    # Quiet runs only report where the output went
+    assert capsys.readouterr().out == "Output printed to file\n"